@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Content-Addressed Presidio Analysis Cache
+SQLite-backed cache of analyzer results keyed by a hash of the query text and
+the full analyzer configuration, with size-bounded LRU eviction
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from importlib import metadata
+from typing import Any, Dict, List, Optional
+
+from presidio_analyzer import AnalyzerEngine, RecognizerResult
+
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "not-installed"
+
+
+def analyzer_fingerprint(analyzer: AnalyzerEngine, analyzer_config: Dict[str, Any]) -> str:
+    """
+    Hash everything that can change analyzer output for a given text
+
+    Covers the analyzer config (language, score threshold, custom recognizer
+    set), every registered recognizer's patterns, context words and deny
+    lists, and the presidio, spaCy and spaCy model versions. Editing a
+    recognizer pattern therefore yields a new fingerprint.
+    """
+    recognizers = []
+    for recognizer in analyzer.registry.recognizers:
+        patterns = [
+            [pattern.name, pattern.regex, pattern.score]
+            for pattern in getattr(recognizer, "patterns", None) or []
+        ]
+        recognizers.append({
+            "name": recognizer.name,
+            "class": type(recognizer).__name__,
+            "supported_entities": sorted(recognizer.supported_entities),
+            "supported_language": recognizer.supported_language,
+            "patterns": patterns,
+            "context": list(getattr(recognizer, "context", None) or []),
+            "deny_list": list(getattr(recognizer, "deny_list", None) or []),
+        })
+    recognizers.sort(key=lambda r: (r["name"], r["class"], r["supported_entities"]))
+
+    models = {}
+    for language, nlp in getattr(analyzer.nlp_engine, "nlp", {}).items():
+        meta = getattr(nlp, "meta", {})
+        models[language] = f"{meta.get('lang', '')}_{meta.get('name', '')}-{meta.get('version', '')}"
+
+    fingerprint = {
+        "analyzer_config": analyzer_config,
+        "recognizers": recognizers,
+        "versions": {
+            "presidio-analyzer": _package_version("presidio-analyzer"),
+            "spacy": _package_version("spacy"),
+            "models": models,
+        },
+    }
+    encoded = json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _serialize_results(results: List[RecognizerResult]) -> str:
+    return json.dumps([
+        [
+            result.entity_type,
+            result.start,
+            result.end,
+            result.score,
+            result.recognition_metadata.get("recognizer_name", "Unknown"),
+            result.recognition_metadata.get("recognizer_identifier", ""),
+        ]
+        for result in results
+    ], separators=(",", ":"))
+
+
+def _deserialize_results(payload: str) -> List[RecognizerResult]:
+    return [
+        RecognizerResult(
+            entity_type=entity_type,
+            start=start,
+            end=end,
+            score=score,
+            recognition_metadata={
+                "recognizer_name": recognizer_name,
+                "recognizer_identifier": recognizer_identifier,
+            },
+        )
+        for entity_type, start, end, score, recognizer_name, recognizer_identifier in json.loads(payload)
+    ]
+
+
+class AnalysisCache:
+    """
+    On-disk cache of analyzer results for query texts
+
+    The analyzer fingerprint is part of every key, so a changed recognizer
+    pattern, threshold or model version never serves stale results, and
+    runs with different configs (e.g. the evaluation and threshold_sweep.py
+    collect at threshold 0.0) can share one file. Entries of other
+    fingerprints are left in place; the least recently used entries of any
+    fingerprint are evicted once the stored payload exceeds max_bytes, and
+    evicted entries of other fingerprints are counted as invalidated. The
+    stored payload size is summed once on open and tracked from then on.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        analyzer: AnalyzerEngine,
+        analyzer_config: Dict[str, Any],
+        max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.fingerprint = analyzer_fingerprint(analyzer, analyzer_config)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidated = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS analysis ("
+            " key TEXT PRIMARY KEY,"
+            " fingerprint TEXT NOT NULL,"
+            " results TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS analysis_last_used ON analysis (last_used)")
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM analysis"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        """Close the underlying database connection"""
+        self.conn.close()
+
+    def key(self, text: str) -> str:
+        """Content address of a query text under the current analyzer"""
+        return hashlib.sha256(f"{self.fingerprint}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, texts: List[str]) -> List[Optional[List[RecognizerResult]]]:
+        """Look up texts, returning None for every miss"""
+        keys = [self.key(text) for text in texts]
+        found: Dict[str, str] = {}
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, results FROM analysis WHERE key IN ({placeholders})", chunk
+            )
+            found.update(rows)
+
+        if found:
+            now = time.time_ns()
+            with self.conn:
+                self.conn.executemany(
+                    "UPDATE analysis SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+
+        results = []
+        for key in keys:
+            payload = found.get(key)
+            if payload is None:
+                self.misses += 1
+                results.append(None)
+            else:
+                self.hits += 1
+                results.append(_deserialize_results(payload))
+        return results
+
+    def put_many(self, texts: List[str], results: List[List[RecognizerResult]]) -> None:
+        """Store analyzer results for texts, then evict down to max_bytes"""
+        now = time.time_ns()
+        rows: Dict[str, tuple] = {}
+        for text, text_results in zip(texts, results):
+            payload = _serialize_results(text_results)
+            key = self.key(text)
+            rows[key] = (key, self.fingerprint, payload, len(payload), now)
+        keys = list(rows)
+        with self.conn:
+            # Replaced entries give back their old size
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                self.total_bytes -= self.conn.execute(
+                    f"SELECT COALESCE(SUM(size), 0) FROM analysis WHERE key IN ({placeholders})", chunk
+                ).fetchone()[0]
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO analysis (key, fingerprint, results, size, last_used)"
+                " VALUES (?, ?, ?, ?, ?)",
+                rows.values()
+            )
+        self.total_bytes += sum(row[3] for row in rows.values())
+        self._evict()
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        excess = self.total_bytes - self.max_bytes
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT key, size, fingerprint FROM analysis ORDER BY last_used"
+            )
+            doomed = []
+            for key, size, fingerprint in rows:
+                if excess <= 0:
+                    break
+                doomed.append((key,))
+                excess -= size
+                self.total_bytes -= size
+                if fingerprint != self.fingerprint:
+                    self.invalidated += 1
+            self.conn.executemany("DELETE FROM analysis WHERE key = ?", doomed)
+        self.evictions += len(doomed)
+
+    def take_stats(self) -> Dict[str, int]:
+        """Return the hit/miss/eviction counters accumulated since the last call and reset them"""
+        stats = {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidated": self.invalidated,
+        }
+        self.hits = self.misses = self.evictions = self.invalidated = 0
+        return stats
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Inspect a Presidio analysis cache")
+    parser.add_argument("cache", help="Path to the cache database")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.cache)
+    entries, total_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM analysis"
+    ).fetchone()
+    fingerprints = conn.execute("SELECT COUNT(DISTINCT fingerprint) FROM analysis").fetchone()[0]
+    conn.close()
+
+    print(f"Entries: {entries}")
+    print(f"Payload size: {total_bytes / (1024 * 1024):.1f} MB")
+    print(f"Analyzer fingerprints: {fingerprints}")
+
+
+if __name__ == "__main__":
+    main()
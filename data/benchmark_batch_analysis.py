@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Batched vs Per-Query Presidio Analysis Benchmark
+Compares queries/sec of analyze_batch_with_presidio against the per-text loop
+and checks that both paths return identical entities
+"""
+
+import argparse
+import os
+import time
+from typing import List
+
+from dataset_index import DatasetReader
+from run_presidio_evaluation import (
+    initialize_presidio_analyzer,
+    analyze_batch_with_presidio,
+)
+
+
+def load_query_texts(dataset_file: str) -> List[str]:
+    """Load query texts from synthetic_dataset.txt"""
+    with DatasetReader(dataset_file) as reader:
+        return [record['query_text'] for record in reader.iter_queries()]
+
+
+def result_key(results) -> List[tuple]:
+    """Comparable form of one query's analyzer results"""
+    return sorted(
+        (r.entity_type, r.start, r.end, round(r.score, 6),
+         r.recognition_metadata.get("recognizer_name", "Unknown"))
+        for r in results
+    )
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Benchmark batched Presidio analysis")
+    parser.add_argument("--dataset", default=os.path.join(os.path.dirname(__file__), "synthetic_dataset.txt"),
+                        help="Path to synthetic_dataset.txt")
+    parser.add_argument("--batch-sizes", default="8,32,128",
+                        help="Comma-separated batch sizes to benchmark")
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Times to replicate the query list (default: 1)")
+    args = parser.parse_args()
+
+    texts = load_query_texts(args.dataset) * args.repeat
+
+    print("=" * 80)
+    print("PRESIDIO BATCH ANALYSIS BENCHMARK")
+    print("=" * 80)
+    print(f"Queries: {len(texts)}")
+
+    print(f"Initializing Presidio analyzer...")
+    analyzer = initialize_presidio_analyzer()
+
+    # Warm up both paths so model loading is not counted
+    analyzer.analyze(text=texts[0], language="en", entities=None, score_threshold=0.35)
+    analyze_batch_with_presidio(texts[:8], analyzer, batch_size=8)
+
+    # Baseline: one analyzer.analyze call per query
+    start = time.perf_counter()
+    baseline = [
+        analyzer.analyze(text=text, language="en", entities=None, score_threshold=0.35)
+        for text in texts
+    ]
+    baseline_elapsed = time.perf_counter() - start
+    baseline_qps = len(texts) / baseline_elapsed
+    print(f"\nPer-query loop:   {baseline_qps:8.1f} queries/sec ({baseline_elapsed:.2f}s)")
+
+    baseline_keys = [result_key(results) for results in baseline]
+
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        start = time.perf_counter()
+        batched = analyze_batch_with_presidio(texts, analyzer, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        qps = len(texts) / elapsed
+
+        mismatches = sum(
+            1 for expected, results in zip(baseline_keys, batched)
+            if expected != result_key(results)
+        )
+        status = "identical" if mismatches == 0 else f"{mismatches} MISMATCHED"
+        print(f"Batch size {batch_size:>5}: {qps:8.1f} queries/sec ({elapsed:.2f}s), "
+              f"speedup {qps / baseline_qps:.2f}x, results {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Detected Entity Memory Benchmark
+Compares per-entity dicts against the columnar EntityBatch on the analyzer results
+of synthetic_dataset.txt: traced memory, pickled size and build time
+"""
+
+import argparse
+import gc
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Tuple
+
+from presidio_analyzer import RecognizerResult
+
+from analysis_cache import AnalysisCache
+from dataset_index import DatasetReader
+from entity_batch import EntityBatch
+from run_presidio_evaluation import (
+    ANALYZER_CONFIG,
+    analyze_batch_with_presidio,
+    initialize_presidio_analyzer,
+    map_presidio_entity_to_hipaa,
+)
+
+
+def legacy_entity_dicts(text: str, analyzer_results: List[RecognizerResult]) -> List[Dict[str, Any]]:
+    """Previous redact_analyzer_results entity list, kept as the baseline"""
+    detected_entities = []
+    for result in analyzer_results:
+        detected_entities.append({
+            "entity_type": result.entity_type,
+            "hipaa_category": map_presidio_entity_to_hipaa(result.entity_type),
+            "start": result.start,
+            "end": result.end,
+            "score": result.score,
+            "text": text[result.start:result.end],
+            "recognizer": result.recognition_metadata.get("recognizer_name", "Unknown")
+        })
+    return detected_entities
+
+
+def build_columnar(pairs: List[Tuple[str, List[RecognizerResult]]]) -> EntityBatch:
+    entities = EntityBatch(map_presidio_entity_to_hipaa)
+    for text, results in pairs:
+        entities.add_query(text, results)
+    return entities
+
+
+def traced_bytes(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """Build a structure and return it with the bytes still allocated for it"""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        structure = build()
+        gc.collect()
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return structure, allocated
+
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-repeat wall time in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Benchmark detected entity memory layouts")
+    parser.add_argument("--dataset", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_dataset.txt"),
+                        help="Path to synthetic_dataset.txt")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database, so reruns skip the NLP pass")
+    parser.add_argument("--scale", type=int, default=100,
+                        help="Copies of the analyzed dataset to hold at once (default: %(default)s)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Timing repetitions (best is reported)")
+    args = parser.parse_args()
+    if args.scale < 1 or args.repeat < 1:
+        parser.error("--scale and --repeat must be at least 1")
+
+    with DatasetReader(args.dataset) as reader:
+        texts = [record['query_text'] for record in reader.iter_queries() if record['query_text']]
+
+    print("=" * 80)
+    print("DETECTED ENTITY MEMORY BENCHMARK")
+    print("=" * 80)
+    print(f"Analyzing {len(texts)} queries...")
+    analyzer = initialize_presidio_analyzer()
+    cache = AnalysisCache(args.cache, analyzer, ANALYZER_CONFIG) if args.cache else None
+    try:
+        batch_results = analyze_batch_with_presidio(texts, analyzer, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    pairs = list(zip(texts, batch_results)) * args.scale
+    spans = sum(len(results) for _, results in pairs)
+
+    legacy, legacy_bytes = traced_bytes(lambda: [legacy_entity_dicts(text, results) for text, results in pairs])
+    columnar, columnar_bytes = traced_bytes(lambda: build_columnar(pairs))
+
+    # The trace export must give back exactly the old dicts
+    mismatches = [q for q, query_entities in enumerate(columnar) if query_entities.to_dicts() != legacy[q]]
+    if mismatches:
+        print(f"✗ {len(mismatches)} queries exported differently, e.g. query {mismatches[0]}")
+        sys.exit(1)
+    print(f"✓ Identical trace export on {len(pairs):,} queries ({spans:,} entities, "
+          f"{len(columnar.entity_types)} entity types, {len(columnar.recognizers)} recognizers)")
+
+    legacy_pickled = len(pickle.dumps(legacy, pickle.HIGHEST_PROTOCOL))
+    columnar_pickled = len(pickle.dumps(columnar, pickle.HIGHEST_PROTOCOL))
+    del legacy, columnar
+    legacy_seconds = time_call(lambda: [legacy_entity_dicts(text, results) for text, results in pairs], args.repeat)
+    columnar_seconds = time_call(lambda: build_columnar(pairs), args.repeat)
+
+    print(f"\n{'layout':<14} {'memory':>10} {'per entity':>11} {'pickled':>10} {'build':>10}")
+    for name, allocated, pickled, seconds in (
+            ("entity dicts", legacy_bytes, legacy_pickled, legacy_seconds),
+            ("EntityBatch", columnar_bytes, columnar_pickled, columnar_seconds)):
+        print(f"{name:<14} {allocated / 1e6:>8.1f}MB {allocated / max(spans, 1):>9.1f}B "
+              f"{pickled / 1e6:>8.1f}MB {seconds * 1000:>8.1f}ms")
+    print(f"Memory: {legacy_bytes / max(columnar_bytes, 1):.1f}x smaller, "
+          f"pickled: {legacy_pickled / max(columnar_pickled, 1):.1f}x smaller")
+    print("(query texts are shared with the input, so neither memory figure counts them;\n"
+          " the EntityBatch pickle carries them, as a worker result does)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Leak Detection Micro-Benchmark
+Compares the per-entity lowercase substring loop against PhiMatcher on long
+multi-turn transcripts and on single queries from synthetic_dataset.txt
+"""
+
+import argparse
+import os
+import random
+import re
+import time
+from typing import Any, Dict, List
+
+from dataset_index import DatasetReader
+from leak_detection import PhiMatcher, find_phi_leaks
+
+
+def substring_leaks(anonymized_query: str, ground_truth_entities: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Previous detect_phi_leaks implementation, kept as the baseline"""
+    leaked_phi = []
+    for entity in ground_truth_entities:
+        phi_value = entity['value']
+        if phi_value.lower() in anonymized_query.lower():
+            leaked_phi.append({
+                "type": entity['type'],
+                "value": phi_value,
+                "start": entity.get('start', -1),
+                "end": entity.get('end', -1)
+            })
+    return {
+        "leaked_phi_count": len(leaked_phi),
+        "leaked_phi_details": leaked_phi,
+        "status": "LEAK_DETECTED" if leaked_phi else "NO_LEAK"
+    }
+
+
+def build_transcript(records: List[Dict[str, Any]], n_values: int, rng: random.Random):
+    """
+    Concatenate queries into one transcript and collect their PHI values
+
+    Half of the PHI occurrences are replaced by redaction markers so the
+    transcript contains both leaked and redacted values.
+    """
+    entities = []
+    turns = []
+    for record in rng.sample(records, len(records)):
+        text = record['query_text']
+        for tag in record['phi_entities']:
+            entities.append({"type": tag['identifier_type'], "value": tag['value']})
+            if rng.random() < 0.5:
+                text = text.replace(tag['value'], f"[REDACTED_{tag['identifier_type']}]")
+        turns.append(f"USER: {text}\nASSISTANT: Based on current guidelines, consider the following options.")
+        if len(entities) >= n_values:
+            break
+    return "\n".join(turns), entities[:n_values]
+
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-repeat wall time in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def build_matcher_cold(values: List[str]) -> PhiMatcher:
+    """Build a compiled matcher with re's pattern cache emptied first, as for a new value set"""
+    re.purge()
+    return PhiMatcher(values)
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Benchmark PHI leak detection engines")
+    parser.add_argument("--dataset", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_dataset.txt"),
+                        help="Path to synthetic_dataset.txt")
+    parser.add_argument("--values", default="10,30,100,300,1000,3000",
+                        help="Comma-separated PHI value counts to benchmark")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timing repetitions (best is reported)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with DatasetReader(args.dataset) as reader:
+        records = [record for record in reader.iter_queries() if record['phi_entities']]
+    rng = random.Random(args.seed)
+
+    print("=" * 80)
+    print("PHI LEAK DETECTION BENCHMARK")
+    print("=" * 80)
+    print(f"{'PHI values':>10} {'text chars':>11} {'substring':>11} {'automaton':>11} "
+          f"{'+compile':>11} {'speedup':>8}")
+
+    for n_values in [int(v) for v in args.values.split(",")]:
+        transcript, entities = build_transcript(records, n_values, rng)
+        values = [entity['value'] for entity in entities]
+        matcher = PhiMatcher(values)
+
+        expected = substring_leaks(transcript, entities)
+        for actual in (find_phi_leaks(transcript, entities, matcher=matcher),
+                       find_phi_leaks(transcript, entities)):
+            if expected != actual:
+                raise AssertionError(f"Leak results differ for {n_values} values")
+
+        baseline = time_call(lambda: substring_leaks(transcript, entities), args.repeat)
+        scan_only = time_call(lambda: find_phi_leaks(transcript, entities, matcher=matcher), args.repeat)
+        # The compile column starts from an empty re cache: a repeated
+        # re.compile of the same pattern would otherwise be a dict lookup
+        with_compile = time_call(
+            lambda: find_phi_leaks(transcript, entities, matcher=build_matcher_cold(values)), args.repeat
+        )
+
+        print(f"{len(entities):>10} {len(transcript):>11} {baseline * 1000:>9.2f}ms "
+              f"{scan_only * 1000:>9.2f}ms {with_compile * 1000:>9.2f}ms {baseline / scan_only:>7.1f}x")
+
+    # One check per query, as detect_phi_leaks runs during an evaluation
+    pairs = [
+        (record['query_text'], [{"type": tag['identifier_type'], "value": tag['value']}
+                                for tag in record['phi_entities']])
+        for record in records
+    ]
+    per_query = time_call(lambda: [find_phi_leaks(text, entities) for text, entities in pairs], args.repeat)
+    per_query_compiled = time_call(
+        lambda: [find_phi_leaks(text, entities, matcher=build_matcher_cold([e['value'] for e in entities]))
+                 for text, entities in pairs],
+        args.repeat
+    )
+    print(f"\nPer-query check over {len(pairs)} queries: "
+          f"{per_query / len(pairs) * 1e6:.1f}µs substring, "
+          f"{per_query_compiled / len(pairs) * 1e6:.1f}µs with a compiled matcher per query")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Redaction Engine Micro-Benchmark
+Compares AnonymizerEngine with per-query OperatorConfig dicts against
+SpanRedactor on the analyzer results of synthetic_dataset.txt
+"""
+
+import argparse
+import os
+import sys
+import time
+from typing import List
+
+from presidio_analyzer import RecognizerResult
+from presidio_anonymizer import AnonymizerEngine
+from presidio_anonymizer.entities import OperatorConfig
+
+from analysis_cache import AnalysisCache
+from dataset_index import DatasetReader
+from run_presidio_evaluation import (
+    ANALYZER_CONFIG,
+    analyze_batch_with_presidio,
+    initialize_presidio_analyzer,
+    initialize_presidio_redactor,
+    map_presidio_entity_to_hipaa,
+)
+
+
+def anonymizer_engine_redact(
+    text: str,
+    analyzer_results: List[RecognizerResult],
+    anonymizer: AnonymizerEngine
+) -> str:
+    """Previous redact_analyzer_results text path, kept as the baseline"""
+    operators = {}
+    for result in analyzer_results:
+        hipaa_type = map_presidio_entity_to_hipaa(result.entity_type)
+        operators[result.entity_type] = OperatorConfig(
+            "replace",
+            {"new_value": f"[REDACTED_{hipaa_type}]"}
+        )
+    return anonymizer.anonymize(text=text, analyzer_results=analyzer_results, operators=operators).text
+
+
+def time_call(fn, repeat: int) -> float:
+    """Best-of-repeat wall time in seconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Benchmark the redaction engines")
+    parser.add_argument("--dataset", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_dataset.txt"),
+                        help="Path to synthetic_dataset.txt")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database, so reruns skip the NLP pass")
+    parser.add_argument("--repeat", type=int, default=5,
+                        help="Timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    with DatasetReader(args.dataset) as reader:
+        texts = [record['query_text'] for record in reader.iter_queries() if record['query_text']]
+
+    print("=" * 80)
+    print("REDACTION ENGINE BENCHMARK")
+    print("=" * 80)
+    print(f"Analyzing {len(texts)} queries...")
+    analyzer = initialize_presidio_analyzer()
+    cache = AnalysisCache(args.cache, analyzer, ANALYZER_CONFIG) if args.cache else None
+    try:
+        batch_results = analyze_batch_with_presidio(texts, analyzer, cache=cache)
+    finally:
+        if cache is not None:
+            cache.close()
+    pairs = list(zip(texts, batch_results))
+    spans = sum(len(results) for results in batch_results)
+
+    anonymizer = AnonymizerEngine()
+    redactor = initialize_presidio_redactor()
+
+    # Both engines must agree on every query before their timings mean anything
+    mismatches = [
+        text for text, results in pairs
+        if anonymizer_engine_redact(text, results, anonymizer) != redactor.redact(text, results)
+    ]
+    if mismatches:
+        print(f"✗ {len(mismatches)} queries redacted differently, e.g. {mismatches[0]!r}")
+        sys.exit(1)
+    print(f"✓ Identical output on {len(pairs)} queries ({spans} analyzer spans)")
+
+    baseline = time_call(lambda: [anonymizer_engine_redact(text, results, anonymizer) for text, results in pairs],
+                         args.repeat)
+    direct = time_call(lambda: [redactor.redact(text, results) for text, results in pairs], args.repeat)
+
+    print(f"\n{'engine':<18} {'total':>10} {'per query':>11}")
+    for name, seconds in (("AnonymizerEngine", baseline), ("SpanRedactor", direct)):
+        print(f"{name:<18} {seconds * 1000:>8.1f}ms {seconds / len(pairs) * 1e6:>9.1f}µs")
+    print(f"Speedup: {baseline / direct:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Presidio Latency/Throughput/Memory Benchmark Suite
+Measures cold start, per-query latency, queries/sec and peak RSS over the
+synthetic corpus, broken down by query length and PHI density, and compares runs
+"""
+
+import argparse
+import csv
+import json
+import math
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from dataset_index import DatasetReader
+
+# Upper bounds (exclusive) of the query length buckets, in characters
+LENGTH_BUCKET_EDGES = (125, 150, 175)
+DEFAULT_REGRESSION_THRESHOLD = 0.10
+
+# Metric name suffixes where larger is better; everything else is a cost
+HIGHER_IS_BETTER = ("queries_per_second",)
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process in MB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+def length_bucket(text: str) -> str:
+    """Bucket label for a query's character length"""
+    lower = 0
+    for edge in LENGTH_BUCKET_EDGES:
+        if len(text) < edge:
+            return f"{lower}-{edge - 1}"
+        lower = edge
+    return f"{lower}+"
+
+
+def phi_density_bucket(phi_count: int) -> str:
+    """Bucket label for a query's ground truth PHI count"""
+    if phi_count == 0:
+        return "0"
+    if phi_count <= 3:
+        return "1-3"
+    return "4+"
+
+
+def load_benchmark_queries(
+    dataset_file: Optional[str] = None,
+    positive_csv: Optional[str] = None,
+    negative_csv: Optional[str] = None
+) -> List[Dict[str, Any]]:
+    """
+    Load query texts with their ground truth PHI counts
+
+    Uses the positive/negative CSVs when given, otherwise synthetic_dataset.txt.
+
+    Returns:
+        List of dicts with query_id, query_text and phi_count
+    """
+    queries = []
+    if positive_csv or negative_csv:
+        for csv_file in (positive_csv, negative_csv):
+            if not csv_file:
+                continue
+            with open(csv_file, 'r', encoding='utf-8') as f:
+                for row in csv.DictReader(f):
+                    try:
+                        phi_count = len(json.loads(row.get('phi_entities') or '[]'))
+                    except json.JSONDecodeError:
+                        phi_count = 0
+                    queries.append({
+                        "query_id": row['query_id'],
+                        "query_text": row['query_text'],
+                        "phi_count": phi_count,
+                    })
+        return queries
+
+    with DatasetReader(dataset_file) as reader:
+        for record in reader.iter_queries():
+            queries.append({
+                "query_id": record['query_id'],
+                "query_text": record['query_text'],
+                "phi_count": len(record['phi_entities']),
+            })
+    return queries
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, Any]:
+    """Count, mean, p50/p95/p99/max latency (ms) and serial queries/sec"""
+    if not latencies:
+        return {"count": 0}
+    ordered = sorted(latencies)
+
+    def percentile(q: float) -> float:
+        index = min(len(ordered) - 1, max(0, math.ceil(q * len(ordered)) - 1))
+        return round(ordered[index] * 1000, 3)
+
+    total = sum(ordered)
+    return {
+        "count": len(ordered),
+        "mean_ms": round(total / len(ordered) * 1000, 3),
+        "p50_ms": percentile(0.50),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": round(ordered[-1] * 1000, 3),
+        "queries_per_second": round(len(ordered) / total, 2) if total > 0 else 0.0,
+    }
+
+
+def measure_cold_start(runs: int = 3) -> Dict[str, Any]:
+    """
+    Time initialize_presidio_analyzer in fresh interpreters
+
+    Each run is a new process, so imports and spaCy model loading are
+    counted. Reports the median of `runs`.
+    """
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "cold-start"],
+            check=True, capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout
+        samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {
+        "runs": runs,
+        **{
+            name: round(statistics.median(sample[name] for sample in samples), 4)
+            for name in samples[0]
+        },
+    }
+
+
+def _cold_start_child() -> None:
+    """Body of one cold-start measurement; prints one JSON line"""
+    started = time.perf_counter()
+    from run_presidio_evaluation import (
+        anonymize_with_presidio,
+        initialize_presidio_analyzer,
+        initialize_presidio_redactor,
+    )
+    imported = time.perf_counter()
+
+    analyzer = initialize_presidio_analyzer()
+    redactor = initialize_presidio_redactor()
+    initialized = time.perf_counter()
+
+    anonymize_with_presidio("Follow-up for Anna S. seen at Methodist Hospital on April 12, 2023?",
+                            analyzer, redactor)
+    first_query = time.perf_counter()
+
+    print(json.dumps({
+        "import_seconds": imported - started,
+        "initialize_seconds": initialized - imported,
+        "first_query_seconds": first_query - initialized,
+        "total_seconds": first_query - started,
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+
+def measure_latency(
+    queries: List[Dict[str, Any]],
+    repeat: int = 1,
+    batch_size: int = 32
+) -> Tuple[Dict[str, Any], Dict[str, Any], str]:
+    """
+    Warm per-query latency and batched throughput
+
+    Every query runs through anonymize_with_presidio (analyze + redact) one
+    at a time; then the whole list runs through anonymize_batch_with_presidio.
+
+    Returns:
+        Tuple of (latency section, batch throughput section, fingerprint of
+        the analyzer measured)
+    """
+    from analysis_cache import analyzer_fingerprint
+    from run_presidio_evaluation import (
+        ANALYZER_CONFIG,
+        anonymize_batch_with_presidio,
+        anonymize_with_presidio,
+        initialize_presidio_analyzer,
+        initialize_presidio_redactor,
+    )
+
+    analyzer = initialize_presidio_analyzer()
+    redactor = initialize_presidio_redactor()
+    # Warm up so lazy initialization is not counted as query latency
+    for query in queries[:5]:
+        anonymize_with_presidio(query['query_text'], analyzer, redactor)
+
+    all_latencies: List[float] = []
+    by_length: Dict[str, List[float]] = {}
+    by_phi_density: Dict[str, List[float]] = {}
+    for _ in range(repeat):
+        for query in queries:
+            text = query['query_text']
+            started = time.perf_counter()
+            anonymize_with_presidio(text, analyzer, redactor)
+            elapsed = time.perf_counter() - started
+            all_latencies.append(elapsed)
+            by_length.setdefault(length_bucket(text), []).append(elapsed)
+            by_phi_density.setdefault(phi_density_bucket(query['phi_count']), []).append(elapsed)
+
+    texts = [query['query_text'] for query in queries]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        anonymize_batch_with_presidio(texts, analyzer, redactor, batch_size=batch_size)
+    batch_elapsed = time.perf_counter() - started
+
+    latency = {
+        "overall": latency_summary(all_latencies),
+        "by_length": {bucket: latency_summary(values) for bucket, values in sorted(by_length.items())},
+        "by_phi_density": {bucket: latency_summary(values) for bucket, values in sorted(by_phi_density.items())},
+    }
+    batch = {
+        "batch_size": batch_size,
+        "queries": len(texts) * repeat,
+        "seconds": round(batch_elapsed, 4),
+        "queries_per_second": round(len(texts) * repeat / batch_elapsed, 2) if batch_elapsed > 0 else 0.0,
+    }
+    return latency, batch, analyzer_fingerprint(analyzer, ANALYZER_CONFIG)
+
+
+def run_benchmark(
+    queries: List[Dict[str, Any]],
+    repeat: int = 1,
+    batch_size: int = 32,
+    cold_start_runs: int = 3
+) -> Dict[str, Any]:
+    """Run every measurement and assemble the benchmark report"""
+    from analysis_cache import _package_version
+    from run_presidio_evaluation import ANALYZER_CONFIG
+
+    report: Dict[str, Any] = {
+        "benchmark_timestamp": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "presidio-analyzer": _package_version("presidio-analyzer"),
+            "spacy": _package_version("spacy"),
+        },
+        "analyzer_config": ANALYZER_CONFIG,
+        "queries": len(queries),
+        "repeat": repeat,
+    }
+
+    if cold_start_runs > 0:
+        print(f"Measuring cold start ({cold_start_runs} fresh processes)...")
+        report["cold_start"] = measure_cold_start(cold_start_runs)
+
+    print(f"Measuring per-query latency ({len(queries)} queries x {repeat})...")
+    report["latency"], report["batch_throughput"], report["analyzer_fingerprint"] = measure_latency(
+        queries, repeat, batch_size
+    )
+    # One analyzer has been loaded in this process; ru_maxrss is its peak
+    report["peak_rss_mb"] = round(peak_rss_mb(), 1)
+    return report
+
+
+def flatten_metrics(report: Dict[str, Any]) -> Dict[str, float]:
+    """Flatten a report into dotted metric names that compare_reports checks"""
+    metrics = {}
+    for name in ("total_seconds", "initialize_seconds", "peak_rss_mb"):
+        if name in report.get("cold_start", {}):
+            metrics[f"cold_start.{name}"] = report["cold_start"][name]
+
+    latency = report.get("latency", {})
+    sections = [("overall", latency.get("overall", {}))]
+    sections += [(f"by_length.{k}", v) for k, v in latency.get("by_length", {}).items()]
+    sections += [(f"by_phi_density.{k}", v) for k, v in latency.get("by_phi_density", {}).items()]
+    for prefix, summary in sections:
+        for name in ("p50_ms", "p95_ms", "p99_ms", "queries_per_second"):
+            if summary.get(name) is not None:
+                metrics[f"latency.{prefix}.{name}"] = summary[name]
+
+    if "queries_per_second" in report.get("batch_throughput", {}):
+        metrics["batch_throughput.queries_per_second"] = report["batch_throughput"]["queries_per_second"]
+    if "peak_rss_mb" in report:
+        metrics["peak_rss_mb"] = report["peak_rss_mb"]
+    return metrics
+
+
+def compare_reports(
+    baseline: Dict[str, Any],
+    candidate: Dict[str, Any],
+    threshold: float = DEFAULT_REGRESSION_THRESHOLD
+) -> List[Dict[str, Any]]:
+    """
+    Compare two benchmark reports metric by metric
+
+    A metric regresses when it is worse than the baseline by more than
+    `threshold` (relative): higher for latencies, times and memory, lower
+    for queries/sec.
+
+    Returns:
+        List of rows with metric, baseline, candidate, change and status
+    """
+    base_metrics = flatten_metrics(baseline)
+    new_metrics = flatten_metrics(candidate)
+
+    rows = []
+    for metric in sorted(set(base_metrics) & set(new_metrics)):
+        old, new = base_metrics[metric], new_metrics[metric]
+        change = (new - old) / old if old else 0.0
+        worse = -change if metric.endswith(HIGHER_IS_BETTER) else change
+        if worse > threshold:
+            status = "REGRESSION"
+        elif worse < -threshold:
+            status = "improved"
+        else:
+            status = "ok"
+        rows.append({"metric": metric, "baseline": old, "candidate": new, "change": change, "status": status})
+    return rows
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Presidio latency/throughput/memory benchmark suite")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Benchmark the current analyzer setup")
+    run_parser.add_argument("--dataset", default=os.path.join(data_dir, "synthetic_dataset.txt"),
+                            help="Dataset to benchmark on (default: %(default)s)")
+    run_parser.add_argument("--positive-csv", default=None,
+                            help="Use positive_queries.csv (and --negative-csv) instead of the dataset")
+    run_parser.add_argument("--negative-csv", default=None)
+    run_parser.add_argument("--limit", type=int, default=None,
+                            help="Only benchmark the first N queries")
+    run_parser.add_argument("--repeat", type=int, default=1,
+                            help="Passes over the queries (default: 1)")
+    run_parser.add_argument("--batch-size", type=int, default=32,
+                            help="Batch size for the batched throughput pass (default: 32)")
+    run_parser.add_argument("--cold-start-runs", type=int, default=3,
+                            help="Fresh processes for cold-start timing, 0 to skip (default: 3)")
+    run_parser.add_argument("--output", default="benchmark_results.json",
+                            help="Report file (default: %(default)s)")
+
+    compare_parser = subparsers.add_parser("compare", help="Flag regressions between two reports")
+    compare_parser.add_argument("baseline", help="Baseline report JSON")
+    compare_parser.add_argument("candidate", help="Candidate report JSON")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_REGRESSION_THRESHOLD,
+                                help="Relative change counted as a regression (default: %(default)s)")
+
+    subparsers.add_parser("cold-start", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.command == "cold-start":
+        _cold_start_child()
+        return
+
+    if args.command == "compare":
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.candidate, 'r', encoding='utf-8') as f:
+            candidate = json.load(f)
+
+        if baseline.get("analyzer_fingerprint") != candidate.get("analyzer_fingerprint"):
+            print("Note: analyzer fingerprints differ (recognizers, config or model changed)")
+        if baseline.get("queries") != candidate.get("queries"):
+            print(f"Note: query counts differ ({baseline.get('queries')} vs {candidate.get('queries')})")
+
+        rows = compare_reports(baseline, candidate, args.threshold)
+        print(f"{'metric':<48} {'baseline':>12} {'candidate':>12} {'change':>8}  status")
+        for row in rows:
+            print(f"{row['metric']:<48} {row['baseline']:>12.3f} {row['candidate']:>12.3f} "
+                  f"{row['change']:>+7.1%}  {row['status']}")
+
+        regressions = [row for row in rows if row['status'] == "REGRESSION"]
+        print(f"\n{len(regressions)} regression(s) beyond {args.threshold:.0%}")
+        sys.exit(1 if regressions else 0)
+
+    queries = load_benchmark_queries(args.dataset, args.positive_csv, args.negative_csv)
+    if args.limit is not None:
+        queries = queries[:args.limit]
+
+    print("=" * 80)
+    print("PRESIDIO BENCHMARK SUITE")
+    print("=" * 80)
+
+    report = run_benchmark(queries, args.repeat, args.batch_size, args.cold_start_runs)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+
+    if "cold_start" in report:
+        cold = report["cold_start"]
+        print(f"\nCold start: {cold['total_seconds']:.2f}s "
+              f"(imports {cold['import_seconds']:.2f}s, init {cold['initialize_seconds']:.2f}s, "
+              f"first query {cold['first_query_seconds']:.3f}s)")
+    overall = report["latency"]["overall"]
+    print(f"Per-query latency: p50 {overall['p50_ms']} ms, p95 {overall['p95_ms']} ms, "
+          f"p99 {overall['p99_ms']} ms ({overall['queries_per_second']:.1f} queries/sec serial)")
+    print(f"Batched throughput: {report['batch_throughput']['queries_per_second']:.1f} queries/sec")
+    for section in ("by_length", "by_phi_density"):
+        for bucket, summary in report["latency"][section].items():
+            print(f"  {section[3:]:<12} {bucket:<8} n={summary['count']:<5} "
+                  f"p50 {summary['p50_ms']:>7} ms  p95 {summary['p95_ms']:>7} ms")
+    print(f"Peak RSS: {report['peak_rss_mb']:.1f} MB")
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Offset Index and Memory-Mapped Reader for synthetic_dataset.txt
+Builds a persistent sidecar index of every ===QUERY=== / ===PHI_TAGS=== block
+so queries can be fetched by position and streamed without loading the file
+"""
+
+import argparse
+import hashlib
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+QUERY_MARKER = b'===QUERY==='
+TAGS_MARKER = b'===PHI_TAGS==='
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'PHIIDX01'
+# magic, indexed dataset size, record count, hash of the indexed tail
+HEADER = struct.Struct('<8sqq32s')
+# query offset, query length, tags offset, tags length (-1 when malformed)
+RECORD = struct.Struct('<qqqq')
+TAIL_HASH_BYTES = 4096
+
+
+def _tail_hash(mm: mmap.mmap, size: int) -> bytes:
+    """Hash of the last TAIL_HASH_BYTES bytes before `size`"""
+    return hashlib.sha256(mm[max(0, size - TAIL_HASH_BYTES):size]).digest()
+
+
+def _scan_blocks(mm: mmap.mmap, start: int, end: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Yield (query_offset, query_length, tags_offset, tags_length) for every
+    block whose ===QUERY=== marker starts at or after `start`
+    """
+    marker = mm.find(QUERY_MARKER, start, end)
+    while marker != -1:
+        body_start = marker + len(QUERY_MARKER)
+        next_marker = mm.find(QUERY_MARKER, body_start, end)
+        body_end = next_marker if next_marker != -1 else end
+
+        tags_marker = mm.find(TAGS_MARKER, body_start, body_end)
+        if tags_marker == -1:
+            yield body_start, body_end - body_start, -1, -1
+        else:
+            tags_start = tags_marker + len(TAGS_MARKER)
+            yield body_start, tags_marker - body_start, tags_start, body_end - tags_start
+
+        marker = next_marker
+
+
+def parse_phi_tags(tags_text: str) -> List[Dict[str, Any]]:
+    """Parse the JSON tag lines of a PHI_TAGS section, skipping invalid lines"""
+    entities = []
+    for line in tags_text.split('\n'):
+        line = line.strip()
+        if not line.startswith('{'):
+            continue
+        try:
+            entities.append(json.loads(line))
+        except json.JSONDecodeError:
+            continue
+    return entities
+
+
+class DatasetIndex:
+    """
+    Sidecar offset index for a synthetic_dataset.txt file
+
+    The index is a fixed-width binary file (<dataset>.idx), so record N is
+    read with a single seek. When the dataset has only grown since the
+    index was written, only the appended bytes are scanned.
+    """
+
+    def __init__(self, dataset_path: str, index_path: Optional[str] = None):
+        self.dataset_path = dataset_path
+        self.index_path = index_path or dataset_path + INDEX_SUFFIX
+
+    def _read_header(self) -> Optional[Tuple[int, int, bytes]]:
+        """Return (indexed_size, record_count, tail_hash) or None if unusable"""
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, 'rb') as f:
+            raw = f.read(HEADER.size)
+        if len(raw) != HEADER.size:
+            return None
+        magic, indexed_size, record_count, tail_hash = HEADER.unpack(raw)
+        if magic != INDEX_MAGIC:
+            return None
+        expected_size = HEADER.size + record_count * RECORD.size
+        if os.path.getsize(self.index_path) < expected_size:
+            return None
+        return indexed_size, record_count, tail_hash
+
+    def update(self) -> int:
+        """
+        Bring the index up to date with the dataset file
+
+        Returns:
+            Number of records (re)indexed by this call
+        """
+        size = os.path.getsize(self.dataset_path)
+        header = self._read_header()
+
+        if size == 0:
+            with open(self.index_path, 'wb') as f:
+                f.write(HEADER.pack(INDEX_MAGIC, 0, 0, b'\0' * 32))
+            return 0
+
+        with open(self.dataset_path, 'rb') as data, \
+                mmap.mmap(data.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+            resume_record = 0
+            resume_offset = 0
+            if header is not None:
+                indexed_size, record_count, tail_hash = header
+                if indexed_size == size and _tail_hash(mm, size) == tail_hash:
+                    return 0
+                if 0 < indexed_size < size and _tail_hash(mm, indexed_size) == tail_hash \
+                        and record_count > 0:
+                    # Append-only growth: the last indexed block may have been
+                    # extended, so re-scan from its marker
+                    resume_record = record_count - 1
+                    with open(self.index_path, 'rb') as f:
+                        f.seek(HEADER.size + resume_record * RECORD.size)
+                        query_offset = RECORD.unpack(f.read(RECORD.size))[0]
+                    resume_offset = query_offset - len(QUERY_MARKER)
+
+            mode = 'r+b' if resume_record else 'wb'
+            with open(self.index_path, mode) as f:
+                f.seek(HEADER.size + resume_record * RECORD.size)
+                f.truncate()
+                record_count = resume_record
+                for record in _scan_blocks(mm, resume_offset, size):
+                    f.write(RECORD.pack(*record))
+                    record_count += 1
+
+                f.seek(0)
+                f.write(HEADER.pack(INDEX_MAGIC, size, record_count, _tail_hash(mm, size)))
+
+        return record_count - resume_record
+
+
+class DatasetReader:
+    """
+    Memory-mapped reader over synthetic_dataset.txt backed by DatasetIndex
+
+    Usage:
+        with DatasetReader("synthetic_dataset.txt") as reader:
+            query = reader[10]
+            for query in reader:
+                ...
+    """
+
+    def __init__(self, dataset_path: str, index_path: Optional[str] = None, update_index: bool = True):
+        self.index = DatasetIndex(dataset_path, index_path)
+        if update_index:
+            self.index.update()
+
+        self._data_file = open(dataset_path, 'rb')
+        self._index_file = open(self.index.index_path, 'rb')
+        header = HEADER.unpack(self._index_file.read(HEADER.size))
+        self.indexed_size = header[1]
+        self._count = header[2]
+
+        self._data = None
+        self._records = None
+        if self.indexed_size > 0:
+            self._data = mmap.mmap(self._data_file.fileno(), self.indexed_size, access=mmap.ACCESS_READ)
+        if self._count > 0:
+            self._records = mmap.mmap(self._index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __enter__(self) -> 'DatasetReader':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the memory maps and file handles"""
+        for handle in (self._data, self._records, self._data_file, self._index_file):
+            if handle is not None:
+                handle.close()
+        self._data = None
+        self._records = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def block_offsets(self, n: int) -> Tuple[int, int, int, int]:
+        """Return (query_offset, query_length, tags_offset, tags_length) of block n"""
+        if n < 0:
+            n += self._count
+        if not 0 <= n < self._count:
+            raise IndexError(f"query index {n} out of range")
+        return RECORD.unpack_from(self._records, HEADER.size + n * RECORD.size)
+
+    def raw_block(self, n: int) -> Tuple[str, Optional[str]]:
+        """
+        Return the undecoded query text and PHI_TAGS section of block n
+
+        The tags section is None for malformed blocks without ===PHI_TAGS===.
+        """
+        query_offset, query_length, tags_offset, tags_length = self.block_offsets(n)
+        query_text = self._data[query_offset:query_offset + query_length].decode('utf-8')
+        if tags_length < 0:
+            return query_text, None
+        return query_text, self._data[tags_offset:tags_offset + tags_length].decode('utf-8')
+
+    def __getitem__(self, n: int) -> Dict[str, Any]:
+        """
+        Return block n as a query record
+
+        Returns:
+            Dict with query_id, query_text, phi_entities and malformed
+        """
+        query_text, tags_text = self.raw_block(n)
+        return {
+            "query_id": str(n if n >= 0 else n + self._count),
+            "query_text": query_text.strip(),
+            "phi_entities": parse_phi_tags(tags_text) if tags_text is not None else [],
+            "malformed": tags_text is None,
+        }
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        """Lazily yield every block in file order"""
+        for n in range(self._count):
+            yield self[n]
+
+    def iter_queries(self) -> Iterator[Dict[str, Any]]:
+        """Lazily yield well-formed, non-empty queries in file order"""
+        for record in self:
+            if not record['malformed'] and record['query_text']:
+                yield record
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Compute the validate_dataset counts in a single streaming pass
+
+        Returns:
+            Dict with valid_queries, queries_with_phi, hard_negatives,
+            total_phi_elements, mean_phi_per_query and malformed_queries
+        """
+        valid_queries = 0
+        queries_with_phi = 0
+        hard_negatives = 0
+        total_phi_elements = 0
+        malformed_queries = 0
+
+        for n in range(self._count):
+            query_text, tags_text = self.raw_block(n)
+            if tags_text is None:
+                malformed_queries += 1
+                continue
+            if not query_text.strip():
+                continue
+
+            valid_queries += 1
+            # Count PHI elements (lines starting with '{' are JSON tags)
+            phi_lines = sum(1 for line in tags_text.split('\n') if line.strip().startswith('{'))
+            if phi_lines:
+                queries_with_phi += 1
+                total_phi_elements += phi_lines
+            else:
+                hard_negatives += 1
+
+        return {
+            'valid_queries': valid_queries,
+            'queries_with_phi': queries_with_phi,
+            'hard_negatives': hard_negatives,
+            'total_phi_elements': total_phi_elements,
+            'mean_phi_per_query': (total_phi_elements / valid_queries) if valid_queries > 0 else 0,
+            'malformed_queries': malformed_queries
+        }
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Build or query the synthetic_dataset.txt offset index")
+    parser.add_argument("dataset", nargs="?",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_dataset.txt"),
+                        help="Path to synthetic_dataset.txt")
+    parser.add_argument("--show", type=int, default=None,
+                        help="Print query N as JSON")
+    args = parser.parse_args()
+
+    index = DatasetIndex(args.dataset)
+    updated = index.update()
+    print(f"Indexed {updated} new blocks into {index.index_path}")
+
+    with DatasetReader(args.dataset, update_index=False) as reader:
+        print(f"Total blocks: {len(reader)}")
+        if args.show is not None:
+            print(json.dumps(reader[args.show], indent=2, ensure_ascii=False))
+        else:
+            print(json.dumps(reader.summary(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,524 @@
+#!/usr/bin/env python3
+"""
+Streaming Dataset Statistics for synthetic_dataset.txt
+Counts the dataset once into mergeable accumulators and writes dataset_statistics.txt
+and the data behind the figure1-figure3 plots, updating both incrementally on append
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import math
+import os
+import time
+from collections import Counter
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Tuple
+
+from dataset_index import QUERY_MARKER, TAIL_HASH_BYTES, DatasetReader, parse_phi_tags
+
+STATE_SUFFIX = '.stats.json'
+STATE_FORMAT_VERSION = 1
+DEFAULT_RELATIVE_ACCURACY = 0.01
+RULE_WIDTH = 70
+
+# Data files written next to the plots in figures/
+FIGURE_DATA = {
+    "figure1": "figure1_phi_type_distribution.csv",
+    "figure2": "figure2_query_complexity_distribution.csv",
+    "figure3": "figure3_query_composition.csv",
+}
+
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch with bounded relative error
+
+    Values fall into logarithmic buckets (as in DDSketch): bucket k holds
+    values in (gamma^(k-1), gamma^k], so any quantile is answered within
+    relative_accuracy of a true value. Two sketches with the same accuracy
+    merge by adding bucket counts, and the bucket count grows only with the
+    log of the value range, not with the number of values.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError(f"relative_accuracy must be in (0, 1), got {relative_accuracy}")
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets: Counter = Counter()
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float) -> None:
+        """Add one non-negative value"""
+        if value < 0:
+            raise ValueError(f"QuantileSketch only holds non-negative values, got {value}")
+        if value == 0:
+            self.zeros += 1
+        else:
+            self.buckets[math.ceil(math.log(value) / self.log_gamma)] += 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def merge(self, other: 'QuantileSketch') -> None:
+        """Fold another sketch of the same accuracy into this one"""
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError(
+                f"Cannot merge sketches with relative accuracy {self.relative_accuracy} "
+                f"and {other.relative_accuracy}"
+            )
+        self.buckets.update(other.buckets)
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Value at quantile q in [0, 1], or 0.0 for an empty sketch"""
+        if not 0 <= q <= 1:
+            raise ValueError(f"quantile must be in [0, 1], got {q}")
+        if not self.count:
+            return 0.0
+        rank = q * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.buckets):
+            seen += self.buckets[key]
+            if seen > rank:
+                # Midpoint of the bucket in relative terms, kept inside the
+                # observed range so q=0 and q=1 are exact
+                estimate = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(estimate, self.min), self.max)
+        return self.max
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "buckets": {str(key): count for key, count in sorted(self.buckets.items())},
+            "zeros": self.zeros,
+            "count": self.count,
+            "total": self.total,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'QuantileSketch':
+        sketch = cls(data["relative_accuracy"])
+        sketch.buckets = Counter({int(key): count for key, count in data["buckets"].items()})
+        sketch.zeros = data["zeros"]
+        sketch.count = data["count"]
+        sketch.total = data["total"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        return sketch
+
+
+def histogram_median(histogram: Dict[int, int], skip_zero: bool = False) -> float:
+    """
+    Exact median of the values counted in a {value: count} histogram
+
+    An even number of values gives the mean of the two middle ones, as
+    statistics.median does.
+    """
+    values = sorted((value, count) for value, count in histogram.items() if count and not (skip_zero and value == 0))
+    total = sum(count for _, count in values)
+    if not total:
+        return 0.0
+    middle = [(total - 1) // 2, total // 2]
+    found = []
+    seen = 0
+    for value, count in values:
+        seen += count
+        while middle and middle[0] < seen:
+            middle.pop(0)
+            found.append(value)
+    return sum(found) / 2
+
+
+class DatasetStatistics:
+    """
+    Mergeable accumulators for the dataset_statistics.txt report
+
+    Everything reported is derived from counters (queries, PHI types, PHI
+    elements per query) and a QuantileSketch of query length in characters.
+    The PHI-per-query histogram has one bucket per distinct tag count, so
+    it gives exact medians at constant size. Statistics of disjoint block
+    ranges merge into the statistics of their union.
+    """
+
+    def __init__(self, relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY):
+        self.malformed_queries = 0
+        self.phi_types: Counter = Counter()
+        # PHI elements per query -> number of queries
+        self.complexity: Counter = Counter()
+        self.query_length = QuantileSketch(relative_accuracy)
+
+    def add_block(self, query_text: str, tags_text: Optional[str]) -> None:
+        """
+        Count one raw dataset block
+
+        Malformed blocks are only counted as such and empty queries are
+        skipped, as DatasetReader.iter_queries does.
+        """
+        if tags_text is None:
+            self.malformed_queries += 1
+            return
+        query_text = query_text.strip()
+        if not query_text:
+            return
+        tags = parse_phi_tags(tags_text)
+        self.complexity[len(tags)] += 1
+        self.phi_types.update(tag.get('identifier_type', 'UNKNOWN') for tag in tags)
+        self.query_length.add(len(query_text))
+
+    def merge(self, other: 'DatasetStatistics') -> None:
+        """Fold the statistics of another block range into these"""
+        self.malformed_queries += other.malformed_queries
+        self.phi_types.update(other.phi_types)
+        self.complexity.update(other.complexity)
+        self.query_length.merge(other.query_length)
+
+    @property
+    def total_queries(self) -> int:
+        return sum(self.complexity.values())
+
+    @property
+    def hard_negatives(self) -> int:
+        return self.complexity.get(0, 0)
+
+    @property
+    def queries_with_phi(self) -> int:
+        return self.total_queries - self.hard_negatives
+
+    @property
+    def total_phi_elements(self) -> int:
+        return sum(phi * queries for phi, queries in self.complexity.items())
+
+    def phi_type_rows(self) -> List[Tuple[str, int]]:
+        """(identifier_type, count) by count descending, ties by name"""
+        return sorted(self.phi_types.items(), key=lambda item: (-item[1], item[0]))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "malformed_queries": self.malformed_queries,
+            "phi_types": dict(self.phi_types),
+            "complexity": {str(phi): queries for phi, queries in sorted(self.complexity.items())},
+            "query_length": self.query_length.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> 'DatasetStatistics':
+        stats = cls()
+        stats.malformed_queries = data["malformed_queries"]
+        stats.phi_types = Counter(data["phi_types"])
+        stats.complexity = Counter({int(phi): queries for phi, queries in data["complexity"].items()})
+        stats.query_length = QuantileSketch.from_dict(data["query_length"])
+        return stats
+
+
+# Worker-process state, set once per process by _init_worker
+_worker_reader: Optional[DatasetReader] = None
+_worker_accuracy = DEFAULT_RELATIVE_ACCURACY
+
+
+def _init_worker(dataset_file: str, relative_accuracy: float) -> None:
+    """Pool initializer: open the dataset once per worker (the index is already current)"""
+    global _worker_reader, _worker_accuracy
+    _worker_reader = DatasetReader(dataset_file, update_index=False)
+    _worker_accuracy = relative_accuracy
+
+
+def count_chunk(task: Tuple[int, int]) -> DatasetStatistics:
+    """Count blocks [start, stop) of the dataset in the worker"""
+    start, stop = task
+    stats = DatasetStatistics(_worker_accuracy)
+    for n in range(start, stop):
+        stats.add_block(*_worker_reader.raw_block(n))
+    return stats
+
+
+def count_blocks(
+    dataset_file: str,
+    start: int,
+    stop: int,
+    workers: int = 1,
+    chunk_size: int = 5000,
+    relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY
+) -> DatasetStatistics:
+    """
+    Count blocks [start, stop) in chunks and merge the partial statistics
+
+    The sidecar index must already be current (DatasetReader opened with
+    update_index=True beforehand).
+    """
+    tasks = [(begin, min(begin + chunk_size, stop)) for begin in range(start, stop, chunk_size)]
+    merged = DatasetStatistics(relative_accuracy)
+
+    if workers <= 1 or len(tasks) <= 1:
+        _init_worker(dataset_file, relative_accuracy)
+        try:
+            for task in tasks:
+                merged.merge(count_chunk(task))
+        finally:
+            _worker_reader.close()
+        return merged
+
+    with Pool(processes=workers, initializer=_init_worker, initargs=(dataset_file, relative_accuracy)) as pool:
+        for partial in pool.imap_unordered(count_chunk, tasks):
+            merged.merge(partial)
+    return merged
+
+
+def _prefix_hash(dataset_file: str, size: int) -> str:
+    """Hash of the last TAIL_HASH_BYTES bytes before `size`, as DatasetIndex checks"""
+    with open(dataset_file, 'rb') as f:
+        f.seek(max(0, size - TAIL_HASH_BYTES))
+        return hashlib.sha256(f.read(size - max(0, size - TAIL_HASH_BYTES))).hexdigest()
+
+
+def _load_state(state_file: str, relative_accuracy: float) -> Optional[Dict[str, Any]]:
+    """Saved state, or None if missing, unreadable or counted at another accuracy"""
+    try:
+        with open(state_file, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if state.get("format_version") != STATE_FORMAT_VERSION:
+        return None
+    if state["statistics"]["query_length"]["relative_accuracy"] != relative_accuracy:
+        return None
+    return state
+
+
+def _save_state(state_file: str, state: Dict[str, Any]) -> None:
+    tmp_path = f"{state_file}.tmp.{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, state_file)
+
+
+def update_statistics(
+    dataset_file: str,
+    state_file: Optional[str] = None,
+    workers: int = 1,
+    chunk_size: int = 5000,
+    relative_accuracy: float = DEFAULT_RELATIVE_ACCURACY,
+    full: bool = False
+) -> Tuple[DatasetStatistics, int]:
+    """
+    Statistics of the whole dataset, counting only blocks not yet counted
+
+    The state file (<dataset>.stats.json) holds the merged accumulators of
+    every block but the last, with the byte offset where they end. When the
+    dataset has only grown past that offset, counting resumes there; the
+    last block is always recounted, since an append may still extend it,
+    just as DatasetIndex re-scans it. Any other change recounts everything.
+
+    Args:
+        dataset_file: Labeled dataset
+        state_file: Accumulator state (default: <dataset>.stats.json)
+        workers: Counting processes
+        chunk_size: Blocks per worker task
+        relative_accuracy: Query length sketch accuracy
+        full: Ignore the saved state and recount everything
+
+    Returns:
+        Tuple of (statistics of every block, number of blocks counted by this call)
+    """
+    state_file = state_file or dataset_file + STATE_SUFFIX
+    with DatasetReader(dataset_file) as reader:
+        total = len(reader)
+        state = None if full else _load_state(state_file, relative_accuracy)
+        resume = 0
+        if state is not None and 0 < state["sealed_blocks"] < total \
+                and reader.block_offsets(state["sealed_blocks"])[0] == state["sealed_size"] + len(QUERY_MARKER) \
+                and _prefix_hash(dataset_file, state["sealed_size"]) == state["prefix_hash"]:
+            resume = state["sealed_blocks"]
+        # Every block but the last is final once counted
+        seal_at = max(total - 1, 0)
+        sealed_size = reader.block_offsets(seal_at)[0] - len(QUERY_MARKER) if total else 0
+
+    stats = DatasetStatistics.from_dict(state["statistics"]) if resume else DatasetStatistics(relative_accuracy)
+    stats.merge(count_blocks(dataset_file, resume, seal_at, workers, chunk_size, relative_accuracy))
+    _save_state(state_file, {
+        "format_version": STATE_FORMAT_VERSION,
+        "dataset": os.path.basename(dataset_file),
+        "sealed_blocks": seal_at,
+        "sealed_size": sealed_size,
+        "prefix_hash": _prefix_hash(dataset_file, sealed_size),
+        "statistics": stats.to_dict(),
+    })
+    stats.merge(count_blocks(dataset_file, seal_at, total, 1, chunk_size, relative_accuracy))
+    return stats, total - resume
+
+
+def _percent(part: int, whole: int) -> str:
+    """Share with one decimal, or two when one would round a nonzero share to 0.0"""
+    share = part / whole * 100 if whole else 0.0
+    text = f"{share:.1f}"
+    if text == "0.0" and part:
+        text = f"{share:.2f}"
+    return f"{text}%"
+
+
+def format_report(stats: DatasetStatistics, dataset_name: str) -> str:
+    """Render the dataset_statistics.txt report"""
+    rule = "=" * RULE_WIDTH
+    section = "-" * RULE_WIDTH
+    total = stats.total_queries
+    with_phi = stats.queries_with_phi
+    phi_elements = stats.total_phi_elements
+    length = stats.query_length
+
+    lines = [
+        rule,
+        "SYNTHETIC CLINICAL QUERY DATASET - STATISTICS",
+        rule,
+        "",
+        "DATASET OVERVIEW",
+        section,
+        f"Total Queries: {total:,}",
+        f"  • Queries with PHI: {with_phi:,} ({_percent(with_phi, total)})",
+        f"  • Hard Negatives (no PHI): {stats.hard_negatives:,} ({_percent(stats.hard_negatives, total)})",
+        f"Total PHI Elements: {phi_elements:,}",
+        "",
+        "PHI DENSITY METRICS",
+        section,
+        "Overall (all queries):",
+        f"  • Mean PHI per query: {phi_elements / total if total else 0:.2f}",
+        f"  • Median PHI per query: {histogram_median(stats.complexity):.1f}",
+        "",
+        "For queries with PHI only:",
+        f"  • Mean PHI per query: {phi_elements / with_phi if with_phi else 0:.2f}",
+        f"  • Median PHI per query: {histogram_median(stats.complexity, skip_zero=True):.1f}",
+        "",
+        "PHI TYPE DISTRIBUTION",
+        section,
+    ]
+    lines += [
+        f"  {phi_type}: {count:,} ({_percent(count, phi_elements)})"
+        for phi_type, count in stats.phi_type_rows()
+    ]
+    lines += ["", "QUERY COMPLEXITY DISTRIBUTION", section]
+    lines += [
+        f"  {phi} PHI elements: {queries:,} queries ({_percent(queries, total)})"
+        for phi, queries in sorted(stats.complexity.items())
+    ]
+    lines += [
+        "",
+        "QUERY LENGTH DISTRIBUTION",
+        section,
+        f"  • Mean query length: {length.mean():.1f} characters",
+        f"  • Median query length: {length.quantile(0.5):.0f} characters",
+        f"  • 90th percentile: {length.quantile(0.9):.0f} characters",
+        f"  • Longest query: {length.max if length.count else 0:,.0f} characters",
+        f"  (percentiles within {length.relative_accuracy:.0%} of an observed length)",
+    ]
+    if stats.malformed_queries:
+        lines += ["", f"Malformed blocks skipped: {stats.malformed_queries:,}"]
+    lines += [
+        "",
+        rule,
+        f"Generated from: {dataset_name}",
+        rule,
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def write_figure_data(stats: DatasetStatistics, output_dir: str) -> List[str]:
+    """
+    Write the data plotted in figure1-figure3 as CSV files
+
+    Returns:
+        Paths written, in figure order
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    total = stats.total_queries
+    phi_elements = stats.total_phi_elements
+    tables = {
+        "figure1": (
+            ["identifier_type", "count", "percentage"],
+            [[phi_type, count, round(count / phi_elements * 100, 4) if phi_elements else 0.0] for phi_type, count in stats.phi_type_rows()],
+        ),
+        "figure2": (
+            ["phi_elements", "queries", "percentage"],
+            [[phi, queries, round(queries / total * 100, 4) if total else 0.0] for phi, queries in sorted(stats.complexity.items())],
+        ),
+        "figure3": (
+            ["category", "queries", "percentage"],
+            [
+                [category, queries, round(queries / total * 100, 4) if total else 0.0]
+                for category, queries in (("Queries with PHI", stats.queries_with_phi),
+                                          ("Hard Negatives (no PHI)", stats.hard_negatives))
+            ],
+        ),
+    }
+
+    paths = []
+    for figure, (header, rows) in tables.items():
+        path = os.path.join(output_dir, FIGURE_DATA[figure])
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(
+        description="Regenerate dataset_statistics.txt and the figure data from synthetic_dataset.txt")
+    parser.add_argument("dataset", nargs="?", default=os.path.join(data_dir, "synthetic_dataset.txt"),
+                        help="Labeled dataset (default: %(default)s)")
+    parser.add_argument("--output", default=os.path.join(data_dir, "dataset_statistics.txt"),
+                        help="Report to write (default: %(default)s)")
+    parser.add_argument("--figure-data", default=os.path.join(os.path.dirname(data_dir), "figures"),
+                        help="Directory for the figure1-figure3 CSVs (default: %(default)s)")
+    parser.add_argument("--state", default=None,
+                        help="Accumulator state file (default: <dataset>.stats.json)")
+    parser.add_argument("--full", action="store_true",
+                        help="Ignore the saved state and recount every block")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Counting processes (default: all cores, %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=5000,
+                        help="Queries per worker task (default: %(default)s)")
+    args = parser.parse_args()
+    if args.workers < 1 or args.chunk_size < 1:
+        parser.error("--workers and --chunk-size must be at least 1")
+
+    print(f"Counting {args.dataset} ({args.workers} workers)...")
+    started = time.perf_counter()
+    stats, counted = update_statistics(args.dataset, args.state, args.workers, args.chunk_size, full=args.full)
+    elapsed = time.perf_counter() - started
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(format_report(stats, os.path.basename(args.dataset)))
+    figure_paths = write_figure_data(stats, args.figure_data)
+
+    print(f"✓ Counted {counted:,} blocks in {elapsed:.1f}s "
+          f"({stats.total_queries:,} queries, {stats.total_phi_elements:,} PHI elements)")
+    print(f"  {args.output}")
+    for path in figure_paths:
+        print(f"  {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Load Test for the De-identification Server
+Replays synthetic_dataset.txt queries against deid_server.py from concurrent
+clients and reports throughput and client/server latency percentiles
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from dataset_index import DatasetReader
+from deid_server import DeidClient, latency_percentiles
+
+
+def run_load_test(
+    endpoint: str,
+    texts: List[str],
+    concurrency: int = 4,
+    batch_size: int = 1,
+    duration: Optional[float] = None
+) -> Dict[str, Any]:
+    """
+    Send texts to the server from `concurrency` threads
+
+    Args:
+        endpoint: Server endpoint (http://host:port or unix:///path)
+        texts: Query texts to replay, in order
+        concurrency: Number of client threads, each with its own connection
+        batch_size: Texts per request (1 sends single-text requests)
+        duration: Keep cycling through texts for this many seconds instead
+                  of sending each text once
+
+    Returns:
+        Dict with request/query counts, errors, throughput, client-side
+        latency percentiles and the server's /stats snapshot
+    """
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    source = itertools.cycle(batches) if duration else iter(batches)
+    source_lock = threading.Lock()
+    latencies: List[float] = []
+    counters = {"requests": 0, "queries": 0, "errors": 0}
+    results_lock = threading.Lock()
+
+    control = DeidClient(endpoint)
+    control.reset_stats()
+
+    started = time.perf_counter()
+    deadline = started + duration if duration else None
+
+    def client_loop() -> None:
+        client = DeidClient(endpoint)
+        try:
+            while True:
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return
+                with source_lock:
+                    batch = next(source, None)
+                if batch is None:
+                    return
+                request_started = time.perf_counter()
+                try:
+                    if batch_size == 1:
+                        client.deidentify(batch[0])
+                    else:
+                        client.deidentify_batch(batch)
+                except Exception:
+                    with results_lock:
+                        counters["errors"] += 1
+                    continue
+                elapsed = time.perf_counter() - request_started
+                with results_lock:
+                    latencies.append(elapsed)
+                    counters["requests"] += 1
+                    counters["queries"] += len(batch)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=client_loop) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+
+    server_stats = control.stats()
+    control.close()
+
+    return {
+        "endpoint": endpoint,
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "requests": counters["requests"],
+        "queries": counters["queries"],
+        "errors": counters["errors"],
+        "wall_seconds": round(wall_seconds, 3),
+        "queries_per_second": round(counters["queries"] / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+        "client_latency": latency_percentiles(sorted(latencies)),
+        "server_stats": server_stats,
+    }
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Replay synthetic_dataset.txt against deid_server.py")
+    parser.add_argument("endpoint", help="Server endpoint, e.g. http://127.0.0.1:8787 or unix:///tmp/deid.sock")
+    parser.add_argument("--dataset",
+                        default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "synthetic_dataset.txt"),
+                        help="Dataset to replay (default: %(default)s)")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Concurrent client connections (default: 4)")
+    parser.add_argument("--batch-size", type=int, default=1,
+                        help="Queries per request (default: 1, single-text requests)")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="Only replay the first N queries")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="Cycle through the queries for this many seconds")
+    parser.add_argument("--output", default=None,
+                        help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    with DatasetReader(args.dataset) as reader:
+        texts = [record['query_text'] for record in itertools.islice(reader.iter_queries(), args.limit)]
+
+    print(f"Replaying {len(texts)} queries against {args.endpoint} "
+          f"({args.concurrency} clients, batch size {args.batch_size})...")
+    report = run_load_test(args.endpoint, texts, args.concurrency, args.batch_size, args.duration)
+
+    client_latency = report["client_latency"]
+    print(f"\n✓ {report['queries']} queries in {report['requests']} requests "
+          f"({report['errors']} errors) over {report['wall_seconds']:.2f}s")
+    print(f"  Throughput: {report['queries_per_second']:.1f} queries/sec")
+    print(f"  Client latency: p50 {client_latency['p50_ms']} ms, "
+          f"p95 {client_latency['p95_ms']} ms, p99 {client_latency['p99_ms']} ms")
+    for kind, summary in report["server_stats"]["latency"].items():
+        if summary["count"]:
+            print(f"  Server {kind} latency: p50 {summary['p50_ms']} ms, "
+                  f"p95 {summary['p95_ms']} ms, p99 {summary['p99_ms']} ms ({summary['count']} requests)")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
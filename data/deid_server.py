@@ -0,0 +1,458 @@
+#!/usr/bin/env python3
+"""
+Long-Lived Presidio De-identification Server
+Keeps warm AnalyzerEngine/SpanRedactor pairs loaded and serves redaction
+requests over localhost HTTP or a Unix socket, with latency percentiles
+"""
+
+import argparse
+import collections
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import socket
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from analysis_cache import AnalysisCache, DEFAULT_MAX_BYTES
+from run_presidio_evaluation import (
+    ANALYZER_CONFIG,
+    _anonymize_chunk_in_worker,
+    _chunked,
+    _init_worker,
+    anonymize_batch_with_presidio,
+    initialize_presidio_analyzer,
+    initialize_presidio_redactor,
+)
+
+DEIDENTIFY_PATH = "/deidentify"
+STATS_PATH = "/stats"
+HEALTH_PATH = "/health"
+LATENCY_WINDOW = 10000
+
+
+class DeidBackend:
+    """
+    Warm Presidio engines shared by all request threads
+
+    With workers > 1 each pool process holds its own engine pair (built once
+    by _init_worker) and batched requests are spread across them in chunks.
+    With workers = 1 a single in-process pair serves requests one at a time.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        chunksize: int = 16,
+        cache_path: Optional[str] = None,
+        cache_max_bytes: int = DEFAULT_MAX_BYTES
+    ):
+        self.workers = workers
+        self.chunksize = chunksize
+        self.pool = None
+        self.lock = threading.Lock()
+        self.cache = None
+
+        if workers > 1:
+            self.pool = multiprocessing.Pool(
+                processes=workers,
+                initializer=_init_worker,
+                initargs=(cache_path, cache_max_bytes)
+            )
+        else:
+            self.analyzer = initialize_presidio_analyzer()
+            self.redactor = initialize_presidio_redactor()
+            if cache_path:
+                self.cache = AnalysisCache(cache_path, self.analyzer, ANALYZER_CONFIG, cache_max_bytes)
+
+    def anonymize(self, texts: List[str]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """Redact texts, returning (anonymized_text, detected_entities) per text"""
+        if not texts:
+            return []
+        if self.pool is not None:
+            results = []
+            for (anonymized_texts, entities), *_ in self.pool.map(
+                _anonymize_chunk_in_worker, list(_chunked(texts, self.chunksize))
+            ):
+                # Workers return columnar entities; the API answers with entity dicts
+                results.extend(zip(anonymized_texts, (view.to_dicts() for view in entities)))
+            return results
+        with self.lock:
+            return anonymize_batch_with_presidio(
+                texts, self.analyzer, self.redactor, batch_size=self.chunksize, cache=self.cache
+            )
+
+    def close(self) -> None:
+        """Stop worker processes and close the cache"""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+        if self.cache is not None:
+            self.cache.close()
+
+
+class LatencyRecorder:
+    """Thread-safe counters plus a sliding window of recent latencies"""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.lock = threading.Lock()
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+
+    def record(self, seconds: float) -> None:
+        with self.lock:
+            self.samples.append(seconds)
+            self.count += 1
+
+    def reset(self) -> None:
+        with self.lock:
+            self.samples.clear()
+            self.count = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Return count and p50/p95/p99/max latency in milliseconds"""
+        with self.lock:
+            samples = sorted(self.samples)
+            count = self.count
+        summary = {"count": count}
+        summary.update(latency_percentiles(samples))
+        return summary
+
+
+def latency_percentiles(samples: List[float]) -> Dict[str, Optional[float]]:
+    """Nearest-rank p50/p95/p99/max (milliseconds) of sorted latencies in seconds"""
+    if not samples:
+        return {"p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+
+    def rank(q: float) -> float:
+        index = min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))
+        return round(samples[index] * 1000, 3)
+
+    return {
+        "p50_ms": rank(0.50),
+        "p95_ms": rank(0.95),
+        "p99_ms": rank(0.99),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+
+class DeidRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles:
+        POST /deidentify   {"text": "..."} or {"texts": ["...", ...]}
+        GET  /stats        request counts and latency percentiles
+        POST /stats/reset  clear the latency counters
+        GET  /health       liveness check
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def setup(self) -> None:
+        # Headers and body go out in separate writes; without TCP_NODELAY
+        # each keep-alive response waits on the client's delayed ACK
+        self.disable_nagle_algorithm = self.request.family != socket.AF_UNIX
+        super().setup()
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def address_string(self) -> str:
+        # Unix socket peers have no (host, port) address
+        if isinstance(self.client_address, tuple):
+            return super().address_string()
+        return "unix"
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        path = self.path.split('?', 1)[0]
+        if path == HEALTH_PATH:
+            self._send_json(200, {"status": "ok"})
+        elif path == STATS_PATH:
+            self._send_json(200, self.server.stats())
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self) -> None:
+        path = self.path.split('?', 1)[0]
+        length = int(self.headers.get('Content-Length', 0))
+        raw = self.rfile.read(length) if length else b''
+
+        if path == STATS_PATH + "/reset":
+            self.server.reset_stats()
+            self._send_json(200, {"status": "reset"})
+            return
+        if path != DEIDENTIFY_PATH:
+            self._send_json(404, {"error": "not found"})
+            return
+
+        started = time.perf_counter()
+        try:
+            request = json.loads(raw or b'{}')
+            if not isinstance(request, dict):
+                raise ValueError("request body must be a JSON object")
+            if isinstance(request.get("texts"), list):
+                texts = request["texts"]
+                batched = True
+            elif isinstance(request.get("text"), str):
+                texts = [request["text"]]
+                batched = False
+            else:
+                raise ValueError('expected {"text": str} or {"texts": [str, ...]}')
+            if not all(isinstance(text, str) for text in texts):
+                raise ValueError("texts must all be strings")
+        except ValueError as e:
+            self.server.count_error()
+            self._send_json(400, {"error": str(e)})
+            return
+
+        try:
+            results = self.server.backend.anonymize(texts)
+        except Exception as e:
+            self.server.count_error()
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        payload = [
+            {"anonymized_text": anonymized_text, "detected_entities": detected_entities}
+            for anonymized_text, detected_entities in results
+        ]
+        if batched:
+            self._send_json(200, {"results": payload})
+        else:
+            self._send_json(200, payload[0])
+        self.server.record(batched, len(texts), time.perf_counter() - started)
+
+
+class _DeidServerMixin:
+    """Shared backend, counters and stats for the TCP and Unix socket servers"""
+
+    daemon_threads = True
+
+    def setup_deid(self, backend: DeidBackend, verbose: bool) -> None:
+        self.backend = backend
+        self.verbose = verbose
+        self.started_at = time.time()
+        self.counter_lock = threading.Lock()
+        self.queries = 0
+        self.errors = 0
+        self.latency = {"single": LatencyRecorder(), "batch": LatencyRecorder()}
+
+    def record(self, batched: bool, query_count: int, seconds: float) -> None:
+        self.latency["batch" if batched else "single"].record(seconds)
+        with self.counter_lock:
+            self.queries += query_count
+
+    def count_error(self) -> None:
+        with self.counter_lock:
+            self.errors += 1
+
+    def reset_stats(self) -> None:
+        for recorder in self.latency.values():
+            recorder.reset()
+        with self.counter_lock:
+            self.queries = 0
+            self.errors = 0
+
+    def stats(self) -> Dict[str, Any]:
+        latency = {name: recorder.snapshot() for name, recorder in self.latency.items()}
+        with self.counter_lock:
+            queries, errors = self.queries, self.errors
+        return {
+            "uptime_seconds": round(time.time() - self.started_at, 3),
+            "workers": self.backend.workers,
+            "requests": sum(summary["count"] for summary in latency.values()),
+            "queries": queries,
+            "errors": errors,
+            "latency": latency,
+        }
+
+
+class DeidHTTPServer(_DeidServerMixin, ThreadingHTTPServer):
+    """Localhost HTTP transport"""
+
+
+class DeidUnixServer(_DeidServerMixin, socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix domain socket transport (HTTP framing over AF_UNIX)"""
+
+
+def start_deid_server(
+    host: str = '127.0.0.1',
+    port: int = 0,
+    unix_socket: Optional[str] = None,
+    workers: int = 1,
+    chunksize: int = 16,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    verbose: bool = False
+) -> Tuple[socketserver.BaseServer, str]:
+    """
+    Load the Presidio engines and start serving in a background thread
+
+    Args:
+        host: Interface to bind for HTTP
+        port: Port to bind (0 picks a free port)
+        unix_socket: Serve on this Unix socket path instead of TCP
+        workers: Number of warm engine processes (1 = in-process)
+        chunksize: Texts per nlp.pipe batch / worker task
+        cache_path: Analysis cache database shared with the batch evaluators
+        cache_max_bytes: Size bound for the analysis cache
+        verbose: Log each request to stderr
+
+    Returns:
+        Tuple of (server, endpoint); endpoint is http://host:port or
+        unix:///path. Call server.shutdown() then server.backend.close().
+    """
+    backend = DeidBackend(workers, chunksize, cache_path, cache_max_bytes)
+    # Pay model loading and first-call costs before accepting traffic
+    backend.anonymize(["Warm-up query for John Smith on March 3, 2024"] * max(1, workers))
+
+    if unix_socket:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = DeidUnixServer(unix_socket, DeidRequestHandler)
+        endpoint = f"unix://{os.path.abspath(unix_socket)}"
+    else:
+        server = DeidHTTPServer((host, port), DeidRequestHandler)
+        endpoint = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    server.setup_deid(backend, verbose)
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, endpoint
+
+
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: float):
+        super().__init__("localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.unix_path)
+
+
+class DeidClient:
+    """
+    Minimal keep-alive client for the de-identification server
+
+    Not thread-safe; use one client per thread.
+
+    Usage:
+        client = DeidClient("http://127.0.0.1:8787")
+        anonymized_text, detected_entities = client.deidentify(query)
+    """
+
+    def __init__(self, endpoint: str, timeout: float = 60.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.conn = None
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.endpoint.startswith("unix://"):
+            return _UnixHTTPConnection(self.endpoint[len("unix://"):], self.timeout)
+        host_port = self.endpoint.split("://", 1)[-1].rstrip("/")
+        return http.client.HTTPConnection(host_port, timeout=self.timeout)
+
+    def _request(self, method: str, path: str, payload: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        body = json.dumps(payload).encode('utf-8') if payload is not None else None
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = self._connect()
+            try:
+                self.conn.request(method, path, body=body, headers=headers)
+                response = self.conn.getresponse()
+                data = json.loads(response.read() or b'{}')
+                break
+            except (ConnectionError, http.client.RemoteDisconnected, http.client.CannotSendRequest):
+                # Stale keep-alive connection; reconnect once
+                self.close()
+                if attempt:
+                    raise
+        if response.status != 200:
+            raise RuntimeError(f"{method} {path} failed with {response.status}: {data.get('error')}")
+        return data
+
+    def deidentify(self, text: str) -> Tuple[str, List[Dict[str, Any]]]:
+        """Redact one text, returning (anonymized_text, detected_entities)"""
+        data = self._request("POST", DEIDENTIFY_PATH, {"text": text})
+        return data["anonymized_text"], data["detected_entities"]
+
+    def deidentify_batch(self, texts: List[str]) -> List[Tuple[str, List[Dict[str, Any]]]]:
+        """Redact several texts in one request"""
+        data = self._request("POST", DEIDENTIFY_PATH, {"texts": texts})
+        return [(item["anonymized_text"], item["detected_entities"]) for item in data["results"]]
+
+    def stats(self) -> Dict[str, Any]:
+        """Fetch the server's counters and latency percentiles"""
+        return self._request("GET", STATS_PATH)
+
+    def reset_stats(self) -> None:
+        """Clear the server's latency counters"""
+        self._request("POST", STATS_PATH + "/reset", {})
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Serve Presidio de-identification from warm engines")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--unix-socket", default=None,
+                        help="Listen on a Unix socket path instead of TCP")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of warm engine processes (default: 1, in-process)")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="Texts per NLP batch / worker task (default: 16)")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database; repeated texts skip the NLP pass")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Analysis cache size bound in MB (default: %(default)s)")
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    args = parser.parse_args()
+
+    print(f"Loading Presidio engines ({args.workers} worker(s))...")
+    started = time.perf_counter()
+    server, endpoint = start_deid_server(
+        host=args.host,
+        port=args.port,
+        unix_socket=args.unix_socket,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        cache_path=args.cache,
+        cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+        verbose=args.verbose
+    )
+    print(f"Ready in {time.perf_counter() - started:.1f}s")
+    print(f"De-identification server listening on {endpoint}")
+    print(f"  POST {DEIDENTIFY_PATH}  GET {STATS_PATH}  GET {HEALTH_PATH}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        server.backend.close()
+        if args.unix_socket and os.path.exists(args.unix_socket):
+            os.unlink(args.unix_socket)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Streaming Presidio De-identification
+Redacts any iterable or async iterable of records in micro-batches, yielding
+(record, redacted_text, entities) in input order with bounded memory
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from analysis_cache import DEFAULT_MAX_BYTES
+from deid_server import DeidBackend
+from run_presidio_evaluation import _chunked, iter_csv_rows
+
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_MAX_PENDING_BATCHES = 4
+
+
+def _record_text(record: Any, text_key: str) -> str:
+    """A record is either the text itself or a mapping holding it under text_key"""
+    return record if isinstance(record, str) else record[text_key]
+
+
+def _open_backend(
+    backend: Optional[DeidBackend],
+    workers: int,
+    batch_size: int,
+    cache_path: Optional[str],
+    cache_max_bytes: int
+) -> Tuple[DeidBackend, bool]:
+    """Return (backend, owned); a backend built here is closed by the stream"""
+    if backend is not None:
+        return backend, False
+    return DeidBackend(workers, batch_size, cache_path, cache_max_bytes), True
+
+
+def deidentify_stream(
+    records: Iterable[Any],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_pending_batches: int = DEFAULT_MAX_PENDING_BATCHES,
+    backend: Optional[DeidBackend] = None,
+    workers: int = 1,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    text_key: str = "query_text"
+) -> Iterator[Tuple[Any, str, List[Dict[str, Any]]]]:
+    """
+    Redact records lazily, yielding results in input order
+
+    Records are read in micro-batches of batch_size and each batch is
+    submitted to the backend as soon as it is full. At most
+    max_pending_batches batches are in flight: once the window is full the
+    next record is read only after the caller has taken the oldest batch's
+    results, so a slow consumer holds back the source instead of letting
+    results pile up.
+
+    Args:
+        records: Strings, or mappings with the text under text_key; consumed lazily
+        batch_size: Records per backend call (one nlp.pipe batch)
+        max_pending_batches: Batches submitted but not yet yielded
+        backend: Warm engines to share with other stages; by default one is
+                 built here from workers/cache_path and closed at the end
+        workers: Analyzer processes for a backend built here
+        cache_path: Analysis cache for a backend built here
+        cache_max_bytes: Size bound for that cache
+        text_key: Key of the text in mapping records
+
+    Yields:
+        (record, anonymized_text, detected_entities)
+    """
+    backend, owned = _open_backend(backend, workers, batch_size, cache_path, cache_max_bytes)
+    executor = ThreadPoolExecutor(max_workers=max_pending_batches)
+    pending = collections.deque()
+    try:
+        for batch in _chunked(records, batch_size):
+            texts = [_record_text(record, text_key) for record in batch]
+            pending.append((batch, executor.submit(backend.anonymize, texts)))
+            if len(pending) >= max_pending_batches:
+                oldest_batch, oldest = pending.popleft()
+                for record, (anonymized_text, detected_entities) in zip(oldest_batch, oldest.result()):
+                    yield record, anonymized_text, detected_entities
+        while pending:
+            oldest_batch, oldest = pending.popleft()
+            for record, (anonymized_text, detected_entities) in zip(oldest_batch, oldest.result()):
+                yield record, anonymized_text, detected_entities
+    finally:
+        # The consumer may stop early; drop batches nobody will read
+        for _, future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+        if owned:
+            backend.close()
+
+
+async def _abatched(records: Union[Iterable[Any], AsyncIterable[Any]], size: int) -> AsyncIterator[List[Any]]:
+    """Yield consecutive lists of at most size items from a sync or async iterable"""
+    batch = []
+    if hasattr(records, "__aiter__"):
+        async for record in records:
+            batch.append(record)
+            if len(batch) == size:
+                yield batch
+                batch = []
+    else:
+        for record in records:
+            batch.append(record)
+            if len(batch) == size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def deidentify_stream_async(
+    records: Union[Iterable[Any], AsyncIterable[Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_pending_batches: int = DEFAULT_MAX_PENDING_BATCHES,
+    backend: Optional[DeidBackend] = None,
+    workers: int = 1,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    text_key: str = "query_text"
+) -> AsyncIterator[Tuple[Any, str, List[Dict[str, Any]]]]:
+    """
+    Async counterpart of deidentify_stream
+
+    A producer task batches `records` (sync or async) and hands each batch
+    to the backend on a thread, so the event loop keeps running while spaCy
+    works. Batches travel to the consumer through an asyncio.Queue of
+    max_pending_batches entries, and a semaphore of the same size is taken
+    before each submission and released once the batch has been yielded;
+    when the consumer falls behind, the producer stops pulling records.
+
+    Args and yields are those of deidentify_stream. A plain iterable is
+    iterated on the event loop, so it should not block for long per record.
+    """
+    loop = asyncio.get_running_loop()
+    backend, owned = _open_backend(backend, workers, batch_size, cache_path, cache_max_bytes)
+    executor = ThreadPoolExecutor(max_workers=max_pending_batches)
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_pending_batches)
+    slots = asyncio.Semaphore(max_pending_batches)
+
+    async def produce() -> None:
+        try:
+            async for batch in _abatched(records, batch_size):
+                await slots.acquire()
+                texts = [_record_text(record, text_key) for record in batch]
+                await queue.put((batch, loop.run_in_executor(executor, backend.anonymize, texts)))
+        except Exception as error:
+            await queue.put(error)
+            return
+        await queue.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            batch, future = item
+            results = await future
+            for record, (anonymized_text, detected_entities) in zip(batch, results):
+                yield record, anonymized_text, detected_entities
+            slots.release()
+    finally:
+        producer.cancel()
+        while not queue.empty():
+            item = queue.get_nowait()
+            if isinstance(item, tuple):
+                item[1].cancel()
+        await loop.run_in_executor(None, executor.shutdown, True)
+        if owned:
+            backend.close()
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Stream a query CSV through Presidio into JSON lines")
+    parser.add_argument("--input", default=os.path.join(data_dir, "positive_queries.csv"),
+                        help="CSV with a query_text column (default: %(default)s)")
+    parser.add_argument("--output", default="-",
+                        help="JSON-lines output, or - for stdout (default: %(default)s)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Records per micro-batch (default: %(default)s)")
+    parser.add_argument("--max-pending", type=int, default=DEFAULT_MAX_PENDING_BATCHES,
+                        help="Micro-batches in flight before reading stops (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of analyzer processes (default: 1, in-process)")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database; unchanged queries skip the NLP pass")
+    args = parser.parse_args()
+
+    # Keep stdout clean when the results themselves are streamed there
+    log = sys.stderr if args.output == "-" else sys.stdout
+    out = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    print(f"Streaming {args.input} (batch {args.batch_size}, {args.max_pending} pending, "
+          f"{args.workers} workers)...", file=log)
+    started = time.perf_counter()
+    count = 0
+    try:
+        results = deidentify_stream(
+            iter_csv_rows(args.input), args.batch_size, args.max_pending,
+            workers=args.workers, cache_path=args.cache
+        )
+        for row, anonymized_text, detected_entities in results:
+            out.write(json.dumps({
+                "query_id": row.get("query_id"),
+                "anonymized_text": anonymized_text,
+                "detected_entities": detected_entities,
+            }) + "\n")
+            count += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+    print(f"✓ {count} queries in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.1f} queries/sec)", file=log)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,457 @@
+#!/usr/bin/env python3
+"""
+Tiered PHI Detection Cascade
+A lean regex pass on every query, the spaCy NER analyzer only where a query
+can hold names, places or dates, and an optional LLM pass for queries
+left with spans in an uncertain score band
+"""
+
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import regex
+from presidio_analyzer import (
+    AnalyzerEngine,
+    EntityRecognizer,
+    Pattern,
+    PatternRecognizer,
+    RecognizerRegistry,
+    RecognizerResult,
+)
+from presidio_analyzer.predefined_recognizers import PhoneRecognizer
+from spacy.lang.en.stop_words import STOP_WORDS
+
+from span_aligner import align_tags
+
+CASCADE_TIERS = ("regex", "ner", "llm")
+
+# Spans scored in [low, high) are escalated to the LLM tier: above the
+# analyzer threshold, below the dedicated patterns and the spaCy NER score
+DEFAULT_UNCERTAIN_BAND = (0.35, 0.6)
+
+# LemmaContextAwareEnhancer defaults, reproduced by the regex tier
+CONTEXT_SIMILARITY_FACTOR = 0.35
+MIN_SCORE_WITH_CONTEXT_SIMILARITY = 0.4
+CONTEXT_PREFIX_COUNT = 5
+
+WORD = regex.compile(r"\w+")
+
+# Words the spaCy NER can turn into PERSON, LOCATION or DATE_TIME spans:
+# capitalised words, month names followed by a day, plausible years
+NER_CANDIDATE = regex.compile(
+    r"\b(?P<word>\p{Lu}\p{Ll}+)"
+    r"|\b(?i:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+\d"
+    r"|\b(?:19|20)\d{2}\b"
+)
+
+LLM_SYSTEM_PROMPT = (
+    "You are a HIPAA de-identification assistant. List every protected health "
+    "identifier in the user's text (names, locations, dates, phone numbers, "
+    "email addresses, record, account and license numbers, other unique "
+    "identifiers), copied verbatim, as a JSON array of objects with "
+    '"identifier_type" and "value" keys. Answer [] when there is none.'
+)
+LLM_USER_PREFIX = "Identify the PHI in this query:\n"
+
+
+class PhonePatternRecognizer(PatternRecognizer):
+    """Regex stand-in for PhoneRecognizer covering North American formats"""
+    def __init__(self):
+        patterns = [
+            Pattern("PHONE_PARENTHESIZED", r"(?:\+?1[-.\s]?)?\(\d{3}\)\s?\d{3}[-.\s]\d{4}\b", PhoneRecognizer.SCORE),  # (555) 123-4567
+            Pattern("PHONE_SEPARATED", r"(?:\+?1[-.\s])?\b\d{3}[-.\s]\d{3}[-.\s]\d{4}\b", PhoneRecognizer.SCORE),  # 555-123-4567
+        ]
+        super().__init__(
+            supported_entity="PHONE_NUMBER",
+            patterns=patterns,
+            context=PhoneRecognizer.CONTEXT,
+            name="PhonePatternRecognizer"
+        )
+
+
+class RegexTier:
+    """
+    The pattern recognizers of an analyzer without the analyzer around them
+
+    Each pattern is compiled once and scanned with finditer exactly as
+    PatternRecognizer does, including validate_result/invalidate_result, but
+    without the per-match explanation objects, timing and deep copies.
+    Context enhancement follows LemmaContextAwareEnhancer with its lemma
+    window approximated by the preceding non-stop words. Patterns scoring
+    below the threshold only count once context lifts them, so they are not
+    scanned at all when none of their recognizer's context words occur in
+    the text.
+    """
+
+    def __init__(self, recognizers: List[PatternRecognizer], score_threshold: float):
+        self.score_threshold = score_threshold
+        self.entries = []
+        for recognizer in recognizers:
+            validates = type(recognizer).validate_result is not PatternRecognizer.validate_result
+            context = [word.lower() for word in recognizer.context or []]
+            for pattern in recognizer.patterns:
+                weak = pattern.score < score_threshold and not validates
+                if weak and not context:
+                    continue
+                compiled = regex.compile(pattern.regex, recognizer.global_regex_flags)
+                self.entries.append((recognizer, pattern, compiled, context if weak else None))
+
+    def _score(
+        self,
+        recognizer: PatternRecognizer,
+        pattern: Pattern,
+        text: str,
+        start: int,
+        end: int,
+        keywords: List[Tuple[int, str]]
+    ) -> float:
+        """Final score of pattern matching text[start:end], 0.0 when rejected"""
+        matched = text[start:end]
+        score = pattern.score
+        validation_result = recognizer.validate_result(matched)
+        if validation_result is not None:
+            score = EntityRecognizer.MAX_SCORE if validation_result else EntityRecognizer.MIN_SCORE
+        if recognizer.invalidate_result(matched):
+            score = EntityRecognizer.MIN_SCORE
+        if score <= EntityRecognizer.MIN_SCORE:
+            return score
+
+        if recognizer.context:
+            window = [word for word_start, word in keywords if word_start <= start][-(CONTEXT_PREFIX_COUNT + 1):]
+            if any(context_word.lower() in word for context_word in recognizer.context for word in window):
+                score = max(score + CONTEXT_SIMILARITY_FACTOR, MIN_SCORE_WITH_CONTEXT_SIMILARITY)
+                score = min(score, EntityRecognizer.MAX_SCORE)
+        return score
+
+    def analyze(self, text: str) -> List[RecognizerResult]:
+        """Pattern spans of one text scoring at least the threshold"""
+        results = []
+        lowered = text.lower()
+        keywords = [
+            (match.start(), match.group().lower())
+            for match in WORD.finditer(text)
+            if match.group().lower() not in STOP_WORDS
+        ]
+        for recognizer, pattern, compiled, weak_context in self.entries:
+            if weak_context is not None and not any(word in lowered for word in weak_context):
+                continue
+            for match in compiled.finditer(text):
+                start, end = match.span()
+                if start == end:
+                    continue
+                score = self._score(recognizer, pattern, text, start, end, keywords)
+                if score <= EntityRecognizer.MIN_SCORE or score < self.score_threshold:
+                    continue
+                results.append(RecognizerResult(
+                    entity_type=recognizer.supported_entities[0],
+                    start=start,
+                    end=end,
+                    score=score,
+                    recognition_metadata={
+                        RecognizerResult.RECOGNIZER_NAME_KEY: recognizer.name,
+                        RecognizerResult.RECOGNIZER_IDENTIFIER_KEY: recognizer.id,
+                    }
+                ))
+        return EntityRecognizer.remove_duplicates(results)
+
+
+def needs_ner(text: str, regex_results: List[RecognizerResult]) -> bool:
+    """
+    True when the NER tier could add a span the regex tier did not find
+
+    Capitalised stop words ("What", "May") and anything inside a regex span
+    (the year of "12/12/2023") do not count.
+    """
+    for match in NER_CANDIDATE.finditer(text):
+        word = match.group("word")
+        if word is not None and word.lower() in STOP_WORDS:
+            continue
+        start, end = match.span()
+        if any(result.start <= start and end <= result.end for result in regex_results):
+            continue
+        return True
+    return False
+
+
+def parse_llm_detections(content: str) -> List[Dict[str, str]]:
+    """
+    Read the JSON array of {"identifier_type", "value"} objects in an LLM answer
+
+    Code fences and prose around the array are ignored.
+
+    Raises:
+        ValueError: If the answer holds no JSON array
+    """
+    start = content.find("[")
+    end = content.rfind("]")
+    if start < 0 or end < start:
+        raise ValueError(f"No JSON array in LLM answer: {content[:80]!r}")
+    detections = json.loads(content[start:end + 1])
+    return [
+        {"identifier_type": str(item["identifier_type"]), "value": item["value"]}
+        for item in detections
+        if isinstance(item, dict) and isinstance(item.get("value"), str) and "identifier_type" in item
+    ]
+
+
+class AzureOpenAIPhiDetector:
+    """Asks an Azure OpenAI chat deployment to list the PHI in one query"""
+
+    def __init__(self, client: Any, deployment: str, max_tokens: int = 512):
+        self.client = client
+        self.deployment = deployment
+        self.max_tokens = max_tokens
+
+    @classmethod
+    def from_env(
+        cls,
+        suffix: str = "4o",
+        api_version: str = "2023-07-01-preview",
+        cache_path: Optional[str] = None,
+        cache_mode: str = "read-through"
+    ) -> "AzureOpenAIPhiDetector":
+        """
+        Build a detector from the AZURE_OPENAI_*_<suffix> variables used in Methods.ipynb
+
+        Pointing AZURE_OPENAI_ENDPOINT_<suffix> at mock_azure_openai_server.py
+        exercises the tier without network access. With cache_path, answers
+        go through llm_response_cache.py; replaying needs only the deployment.
+        """
+        from openai import AzureOpenAI
+        from llm_response_cache import CachedAzureOpenAI, LlmResponseCache
+
+        replay = cache_path is not None and cache_mode == "replay"
+        names = [f"AZURE_OPENAI_{name}_{suffix}" for name in ("API_KEY", "ENDPOINT", "DEPLOYMENT")]
+        missing = [name for name in (names[2:] if replay else names) if not os.environ.get(name)]
+        if missing:
+            raise ValueError(f"LLM tier needs {', '.join(missing)}")
+        deployment = os.environ[names[2]]
+        client = None
+        if not replay:
+            client = AzureOpenAI(
+                api_key=os.environ[names[0]], azure_endpoint=os.environ[names[1]], api_version=api_version
+            )
+        if cache_path is not None:
+            client = CachedAzureOpenAI(client, LlmResponseCache(cache_path), cache_mode)
+        return cls(client, deployment)
+
+    def __call__(self, text: str) -> Tuple[List[Dict[str, str]], Dict[str, int]]:
+        """
+        Returns:
+            Tuple of (detections, token usage)
+        """
+        response = self.client.chat.completions.create(
+            model=self.deployment,
+            messages=[
+                {"role": "system", "content": LLM_SYSTEM_PROMPT},
+                {"role": "user", "content": LLM_USER_PREFIX + text},
+            ],
+            temperature=0.0,
+            max_tokens=self.max_tokens
+        )
+        usage = {
+            "prompt_tokens": response.usage.prompt_tokens if response.usage else 0,
+            "completion_tokens": response.usage.completion_tokens if response.usage else 0,
+        }
+        return parse_llm_detections(response.choices[0].message.content or ""), usage
+
+
+def new_cascade_stats() -> Dict[str, Any]:
+    """Empty routing counters: queries, spans and milliseconds per tier"""
+    stats: Dict[str, Any] = {"queries": 0}
+    for tier in CASCADE_TIERS:
+        stats.update({f"{tier}_queries": 0, f"{tier}_spans": 0, f"{tier}_ms": 0.0})
+    stats.update({"llm_failures": 0, "llm_prompt_tokens": 0, "llm_completion_tokens": 0})
+    return stats
+
+
+class DetectionCascade:
+    """
+    Presidio analysis split into tiers of increasing cost
+
+    Tier one runs every pattern recognizer of the analyzer (built-in and the
+    custom MRN/ID ones, with PhoneRecognizer's phonenumbers scan replaced by
+    PhonePatternRecognizer) through RegexTier. Tier two is the analyzer's
+    remaining recognizers (the spaCy NER) and runs only on queries with a
+    capitalised word, month or year the regex spans do not cover. Tier three
+    is an optional LLM, asked only about queries holding a span whose score
+    falls in uncertain_band; its spans are added to the others.
+    """
+
+    def __init__(
+        self,
+        analyzer: AnalyzerEngine,
+        score_threshold: float,
+        ner_gate: bool = True,
+        uncertain_band: Tuple[float, float] = DEFAULT_UNCERTAIN_BAND,
+        llm: Optional[Callable[[str], Tuple[List[Dict[str, str]], Dict[str, int]]]] = None
+    ):
+        pattern_recognizers = []
+        ner_recognizers = []
+        for recognizer in analyzer.registry.recognizers:
+            if isinstance(recognizer, PatternRecognizer) and recognizer.patterns:
+                pattern_recognizers.append(recognizer)
+            elif isinstance(recognizer, PhoneRecognizer):
+                pattern_recognizers.append(PhonePatternRecognizer())
+            else:
+                ner_recognizers.append(recognizer)
+
+        self.score_threshold = score_threshold
+        self.ner_gate = ner_gate
+        self.uncertain_band = tuple(uncertain_band)
+        self.llm = llm
+        self.regex_tier = RegexTier(pattern_recognizers, score_threshold)
+        self.ner_analyzer = AnalyzerEngine(
+            registry=RecognizerRegistry(ner_recognizers),
+            nlp_engine=analyzer.nlp_engine,
+            supported_languages=["en"]
+        )
+        self.stats = new_cascade_stats()
+
+    def _is_uncertain(self, results: List[RecognizerResult]) -> bool:
+        low, high = self.uncertain_band
+        return any(low <= result.score < high for result in results)
+
+    def _run_llm(self, text: str) -> List[RecognizerResult]:
+        """LLM spans located in text; a failed call or answer leaves the query as it was"""
+        started = time.perf_counter()
+        self.stats["llm_queries"] += 1
+        try:
+            detections, usage = self.llm(text)
+        except Exception as error:
+            print(f"  LLM tier failed, keeping regex/NER spans: {error}")
+            self.stats["llm_failures"] += 1
+            return []
+        finally:
+            self.stats["llm_ms"] += (time.perf_counter() - started) * 1000
+        self.stats["llm_prompt_tokens"] += usage.get("prompt_tokens", 0)
+        self.stats["llm_completion_tokens"] += usage.get("completion_tokens", 0)
+
+        entities, _ = align_tags(text, [
+            {"type": detection["identifier_type"], "value": detection["value"]}
+            for detection in detections
+        ])
+        return [
+            RecognizerResult(
+                entity_type=entity["type"],
+                start=entity["start"],
+                end=entity["end"],
+                score=EntityRecognizer.MAX_SCORE,
+                recognition_metadata={RecognizerResult.RECOGNIZER_NAME_KEY: "LlmTier"}
+            )
+            for entity in entities
+            if entity["end"] > entity["start"]
+        ]
+
+    def analyze_batch(self, texts: List[str], batch_size: int = 32) -> List[List[RecognizerResult]]:
+        """
+        Analyze a list of texts through the tiers
+
+        Returns:
+            List of analyzer results, one list per input text
+        """
+        self.stats["queries"] += len(texts)
+
+        started = time.perf_counter()
+        batch_results = [self.regex_tier.analyze(text) for text in texts]
+        self.stats["regex_ms"] += (time.perf_counter() - started) * 1000
+        self.stats["regex_queries"] += len(texts)
+        self.stats["regex_spans"] += sum(len(results) for results in batch_results)
+
+        started = time.perf_counter()
+        escalated = [
+            i for i, text in enumerate(texts)
+            if not self.ner_gate or needs_ner(text, batch_results[i])
+        ]
+        nlp_batches = self.ner_analyzer.nlp_engine.process_batch(
+            [texts[i] for i in escalated], language="en", batch_size=batch_size
+        )
+        for i, (text, nlp_artifacts) in zip(escalated, nlp_batches):
+            ner_results = self.ner_analyzer.analyze(
+                text=text,
+                language="en",
+                entities=None,
+                score_threshold=self.score_threshold,
+                nlp_artifacts=nlp_artifacts
+            )
+            self.stats["ner_spans"] += len(ner_results)
+            batch_results[i] = EntityRecognizer.remove_duplicates(batch_results[i] + ner_results)
+        self.stats["ner_ms"] += (time.perf_counter() - started) * 1000
+        self.stats["ner_queries"] += len(escalated)
+
+        if self.llm is not None:
+            for i, text in enumerate(texts):
+                if self._is_uncertain(batch_results[i]):
+                    llm_results = self._run_llm(text)
+                    self.stats["llm_spans"] += len(llm_results)
+                    batch_results[i] = EntityRecognizer.remove_duplicates(batch_results[i] + llm_results)
+        return batch_results
+
+    def take_stats(self) -> Dict[str, Any]:
+        """Return routing counters since the last call and reset them"""
+        stats, self.stats = self.stats, new_cascade_stats()
+        return stats
+
+
+def build_detection_cascade(analyzer: AnalyzerEngine, config: Dict[str, Any], score_threshold: float) -> DetectionCascade:
+    """
+    Build a cascade from a picklable config (so pool workers can build their own)
+
+    Args:
+        analyzer: Fully initialized analyzer whose recognizers are split into tiers
+        config: Optional keys ner_gate (bool), uncertain_band ([low, high]),
+                llm (true to build AzureOpenAIPhiDetector.from_env()) and
+                llm_cache / llm_cache_mode (its response cache)
+        score_threshold: Minimum score kept
+    """
+    llm = None
+    if config.get("llm"):
+        llm = AzureOpenAIPhiDetector.from_env(
+            cache_path=config.get("llm_cache"),
+            cache_mode=config.get("llm_cache_mode", "read-through")
+        )
+    return DetectionCascade(
+        analyzer,
+        score_threshold,
+        ner_gate=config.get("ner_gate", True),
+        uncertain_band=config.get("uncertain_band", DEFAULT_UNCERTAIN_BAND),
+        llm=llm
+    )
+
+
+def add_cascade_stats(totals: Dict[str, Any], stats: Dict[str, Any]) -> None:
+    """Add one take_stats() result to running totals"""
+    for name, value in stats.items():
+        totals[name] = totals.get(name, 0) + value
+
+
+def summarize_cascade_stats(stats: Dict[str, Any], config: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the aggregate_summary.json "detection_cascade" section from routing totals"""
+    queries = stats.get("queries", 0)
+    tiers = {}
+    for tier in CASCADE_TIERS:
+        routed = stats.get(f"{tier}_queries", 0)
+        total_ms = stats.get(f"{tier}_ms", 0.0)
+        tiers[tier] = {
+            "queries": routed,
+            "share": routed / queries if queries else 0.0,
+            "spans": stats.get(f"{tier}_spans", 0),
+            "total_ms": round(total_ms, 3),
+            "mean_ms_per_routed_query": round(total_ms / routed, 4) if routed else 0.0,
+        }
+    tiers["llm"].update({
+        "enabled": bool(config.get("llm")),
+        "failures": stats.get("llm_failures", 0),
+        "prompt_tokens": stats.get("llm_prompt_tokens", 0),
+        "completion_tokens": stats.get("llm_completion_tokens", 0),
+    })
+    total_ms = sum(stats.get(f"{tier}_ms", 0.0) for tier in CASCADE_TIERS)
+    return {
+        "queries": queries,
+        "ner_gate": config.get("ner_gate", True),
+        "uncertain_band": list(config.get("uncertain_band", DEFAULT_UNCERTAIN_BAND)),
+        "mean_ms_per_query": round(total_ms / queries, 4) if queries else 0.0,
+        "tiers": tiers,
+    }
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Checkpoints for Resumable Evaluation Runs
+Periodically saves a run's running totals and last committed row atomically,
+so a killed run can continue from its checkpoint and the traces written after it
+"""
+
+import hashlib
+import itertools
+import json
+import os
+import uuid
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from eval_shards import shard_label
+
+CHECKPOINT_FORMAT_VERSION = 1
+CHECKPOINTS_DIR = "checkpoints"
+DEFAULT_CHECKPOINT_EVERY = 500
+
+# Bytes of the input CSV hashed to recognise it on resume
+FINGERPRINT_BYTES = 1024 * 1024
+
+
+def write_json_atomic(path: str, data: Any, durable: bool = False, **dump_kwargs: Any) -> None:
+    """
+    Write JSON under a temporary name and rename it into place
+
+    A crash leaves either the previous file or the complete new one, never a
+    truncated file. With durable, the data is fsynced before the rename so
+    the file also survives a power loss.
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, **dump_kwargs)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def input_fingerprint(csv_file: str) -> Dict[str, Any]:
+    """Size and leading-bytes hash of an input file"""
+    with open(csv_file, 'rb') as f:
+        head = f.read(FINGERPRINT_BYTES)
+    return {"size": os.path.getsize(csv_file), "head_sha256": hashlib.sha256(head).hexdigest()}
+
+
+def checkpoint_path(output_dir: str, query_type: str, shard: Optional[Tuple[int, int]] = None) -> str:
+    """output_dir/checkpoints/<query_type>[_<shard label>].json"""
+    name = query_type if shard is None else f"{query_type}_{shard_label(shard)}"
+    return os.path.join(output_dir, CHECKPOINTS_DIR, f"{name}.json")
+
+
+def read_trace(output_dir: str, query_id: Any, trace_store: Optional[Any] = None) -> Optional[Dict[str, Any]]:
+    """Trace of query_id from the trace store or output_dir/query_<id>_trace.json, or None"""
+    if trace_store is not None:
+        return trace_store.get(query_id)
+    trace_file = os.path.join(output_dir, f"query_{query_id}_trace.json")
+    try:
+        with open(trace_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except json.JSONDecodeError:
+        # Truncated by a crash before trace writes were atomic
+        return None
+
+
+class RunCheckpoint:
+    """
+    Checkpoint of one evaluation run (or one shard of it)
+
+    Holds the raw running totals, the analysis cache and cascade counters and
+    the number of input rows committed, i.e. whose traces are written and
+    whose counts are in the totals. save() is called at chunk boundaries
+    only, where the cache and cascade counters cover exactly the committed
+    rows. started_at is kept across resumes, so traces older than the run
+    are never mistaken for its own.
+    """
+
+    def __init__(
+        self,
+        output_dir: str,
+        query_type: str,
+        csv_file: str,
+        shard: Optional[Tuple[int, int]] = None,
+        every: int = DEFAULT_CHECKPOINT_EVERY
+    ):
+        self.path = checkpoint_path(output_dir, query_type, shard)
+        self.query_type = query_type
+        self.csv_file = csv_file
+        self.shard = shard
+        self.every = every
+        self.started_at = datetime.now().isoformat()
+        self.rows = 0
+        self.saved_rows = 0
+        self.last_query_id: Optional[str] = None
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """
+        Read the checkpoint of this run for resuming
+
+        Returns:
+            The checkpoint dict, or None when there is none
+
+        Raises:
+            ValueError: If the checkpoint belongs to another run or input
+        """
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        if state.get("format_version") != CHECKPOINT_FORMAT_VERSION:
+            raise ValueError(f"{self.path}: unsupported checkpoint format {state.get('format_version')!r}")
+        if state["query_type"] != self.query_type or state["shard"] != (list(self.shard) if self.shard else None):
+            raise ValueError(f"{self.path} was written for a different query type or shard")
+        if state["input"] != input_fingerprint(self.csv_file):
+            raise ValueError(
+                f"{self.csv_file} has changed since {self.path} was written; "
+                "rerun without --resume to start over"
+            )
+        self.started_at = state["started_at"]
+        self.rows = self.saved_rows = state["rows"]
+        self.last_query_id = state["last_query_id"]
+        return state
+
+    def advance(self, query_id: Any) -> None:
+        """Record one more committed row"""
+        self.rows += 1
+        self.last_query_id = str(query_id)
+
+    def due(self) -> bool:
+        return self.rows - self.saved_rows >= self.every
+
+    def save(
+        self,
+        totals: Dict[str, Any],
+        cache_stats: Optional[Dict[str, int]] = None,
+        cascade_stats: Optional[Dict[str, Any]] = None,
+        complete: bool = False
+    ) -> None:
+        """Atomically replace the checkpoint with the current state"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        write_json_atomic(self.path, {
+            "format_version": CHECKPOINT_FORMAT_VERSION,
+            "query_type": self.query_type,
+            "shard": list(self.shard) if self.shard else None,
+            "input": input_fingerprint(self.csv_file),
+            "started_at": self.started_at,
+            "written_at": datetime.now().isoformat(),
+            "rows": self.rows,
+            "last_query_id": self.last_query_id,
+            "complete": complete,
+            "totals": totals,
+            "analysis_cache": cache_stats,
+            "detection_cascade": cascade_stats,
+        }, durable=True, indent=2)
+        self.saved_rows = self.rows
+
+    def reconcile(
+        self,
+        rows: Iterable[Dict[str, Any]],
+        load_trace: Callable[[Any], Optional[Dict[str, Any]]],
+        add_trace: Callable[[Dict[str, Any]], None]
+    ) -> Tuple[int, Iterator[Dict[str, Any]]]:
+        """
+        Fold in the traces written after the checkpoint
+
+        Traces are written in row order, so the rows after the checkpoint
+        whose traces this run already wrote form a prefix of `rows`. Each
+        such trace is counted with add_trace instead of being re-evaluated;
+        the first row without one (or with a trace older than the run)
+        is where evaluation continues.
+
+        Returns:
+            Tuple of (rows reconciled, iterator over the rows still to evaluate)
+        """
+        rows = iter(rows)
+        reconciled = 0
+        for query_row in rows:
+            trace = load_trace(query_row['query_id'])
+            if trace is None or trace.get("timestamp", "") < self.started_at:
+                return reconciled, itertools.chain([query_row], rows)
+            add_trace(trace)
+            self.advance(query_row['query_id'])
+            reconciled += 1
+        return reconciled, iter(())
@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Sharded Evaluation Runs
+Splits an evaluation into query_id-hashed shards that write partial summaries
+of raw counts, claims shards with lock files and merges partials into a summary
+"""
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+PARTIAL_FORMAT_VERSION = 1
+PARTIALS_DIR = "partials"
+CLAIMS_DIR = "claims"
+
+# A claim whose lock file has not been touched for this long belongs to a
+# dead node and may be taken over
+DEFAULT_STALE_AFTER = 15 * 60
+
+
+def parse_shard(spec: str) -> Tuple[int, int]:
+    """Parse "i/N" (0 <= i < N) into (index, count)"""
+    try:
+        index, count = (int(part) for part in spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard must look like i/N, got {spec!r}") from None
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard index must be in [0, {count}) for {spec!r}")
+    return index, count
+
+
+def shard_of(query_id: Any, count: int) -> int:
+    """Shard of a query: SHA-256 of its query_id, so every node agrees without coordination"""
+    digest = hashlib.sha256(str(query_id).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def iter_shard(rows: Iterable[Dict[str, Any]], shard: Tuple[int, int]) -> Iterator[Dict[str, Any]]:
+    """Yield only the rows whose query_id hashes to this shard"""
+    index, count = shard
+    for row in rows:
+        if shard_of(row['query_id'], count) == index:
+            yield row
+
+
+def shard_label(shard: Tuple[int, int]) -> str:
+    """File-name form of a shard, e.g. shard_00003_of_00010"""
+    return f"shard_{shard[0]:05d}_of_{shard[1]:05d}"
+
+
+def partial_path(output_dir: str, query_type: str, shard: Tuple[int, int]) -> str:
+    """Where a shard's partial summary lives"""
+    return os.path.join(output_dir, PARTIALS_DIR, f"{query_type}_{shard_label(shard)}.json")
+
+
+def write_partial(
+    output_dir: str,
+    query_type: str,
+    shard: Tuple[int, int],
+    totals: Dict[str, Any],
+    analysis_cache: Optional[Dict[str, int]] = None,
+    cascade_stats: Optional[Dict[str, Any]] = None,
+    cascade_config: Optional[Dict[str, Any]] = None,
+    outputs: Optional[Dict[str, str]] = None
+) -> str:
+    """
+    Write one shard's raw counts
+
+    The file is written atomically and fsynced (see
+    eval_checkpoint.write_json_atomic), so a reader never sees half a
+    partial, a partial that exists survives a power loss, and a re-run
+    straggler simply replaces it with identical counts.
+
+    Args:
+        output_dir: Evaluation output directory (partials/ is created in it)
+        query_type: "positive", "negative", or "unified" for the shared-pass
+                    counters of run_presidio_unified.py (empty totals)
+        shard: (index, count)
+        totals: Running totals from update_positive_totals / update_negative_totals
+        analysis_cache: Cache counters, if the run used a cache
+        cascade_stats: Raw detection cascade routing counters
+        cascade_config: Cascade config those counters were collected with
+        outputs: For a unified partial, the positive and negative output
+                 directories whose summaries the merged one points to
+
+    Returns:
+        Path of the partial summary
+    """
+    partial = {
+        "format_version": PARTIAL_FORMAT_VERSION,
+        "query_type": query_type,
+        "shard": shard[0],
+        "num_shards": shard[1],
+        "written_at": datetime.now().isoformat(),
+        "host": socket.gethostname(),
+        "totals": totals,
+    }
+    if analysis_cache is not None:
+        partial["analysis_cache"] = analysis_cache
+    if cascade_config is not None:
+        partial["detection_cascade"] = {"config": cascade_config, "stats": cascade_stats or {}}
+    if outputs is not None:
+        partial["outputs"] = outputs
+
+    # Imported here: eval_checkpoint imports shard_label from this module
+    from eval_checkpoint import write_json_atomic
+
+    path = partial_path(output_dir, query_type, shard)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_json_atomic(path, partial, durable=True, indent=2)
+    return path
+
+
+def add_totals(totals: Dict[str, Any], other: Dict[str, Any]) -> None:
+    """Add raw counts into totals; nested dicts (e.g. false_redactions_by_type) are added per key"""
+    for name, value in other.items():
+        if isinstance(value, dict):
+            add_totals(totals.setdefault(name, {}), value)
+        else:
+            totals[name] = totals.get(name, 0) + value
+
+
+def load_partials(paths: Iterable[str]) -> List[Dict[str, Any]]:
+    """Read partial summaries; a directory stands for every partial in its partials/ folder"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, PARTIALS_DIR, "*.json"))))
+        else:
+            files.append(path)
+    partials = []
+    for file in files:
+        with open(file, 'r', encoding='utf-8') as f:
+            partial = json.load(f)
+        if partial.get("format_version") != PARTIAL_FORMAT_VERSION:
+            raise ValueError(f"{file} is not a version {PARTIAL_FORMAT_VERSION} partial summary")
+        partial["path"] = file
+        partials.append(partial)
+    return partials
+
+
+def merge_partials(partials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Combine partial summaries of one query type into a final aggregate
+
+    Counts are summed and the derived rates (recall, perfect_rate,
+    false_positive_rate, specificity) are computed once from the sums by the
+    same builders an unsharded run uses. Shards that have no partial yet are
+    listed under shards.missing.
+
+    Raises:
+        ValueError: On an empty list, mixed query types or shard counts,
+                    the same shard twice, or different cascade configs
+    """
+    # Imported here: both runners import this module for their --shard mode
+    from detection_cascade import add_cascade_stats, summarize_cascade_stats
+    from run_presidio_evaluation import build_positive_aggregate
+    from run_presidio_negative import build_negative_aggregate
+
+    if not partials:
+        raise ValueError("No partial summaries to merge")
+    query_types = {partial["query_type"] for partial in partials}
+    counts = {partial["num_shards"] for partial in partials}
+    if len(query_types) > 1 or len(counts) > 1:
+        raise ValueError(f"Partials mix query types {sorted(query_types)} or shard counts {sorted(counts)}")
+    query_type, count = query_types.pop(), counts.pop()
+
+    seen: Dict[int, str] = {}
+    totals: Dict[str, Any] = {}
+    cache_stats: Optional[Dict[str, Any]] = None
+    cascade_stats: Dict[str, Any] = {}
+    cascade_config = None
+    for partial in partials:
+        if partial["shard"] in seen:
+            raise ValueError(f"Shard {partial['shard']}/{count} appears in both {seen[partial['shard']]} "
+                             f"and {partial['path']}")
+        seen[partial["shard"]] = partial["path"]
+        add_totals(totals, partial["totals"])
+        if "analysis_cache" in partial:
+            cache_stats = cache_stats if cache_stats is not None else {}
+            add_totals(cache_stats, partial["analysis_cache"])
+        if "detection_cascade" in partial:
+            config = partial["detection_cascade"]["config"]
+            if cascade_config is not None and config != cascade_config:
+                raise ValueError(f"{partial['path']} was run with a different cascade config")
+            cascade_config = config
+            add_cascade_stats(cascade_stats, partial["detection_cascade"]["stats"])
+
+    if query_type == "unified":
+        # Only shared-pass counters; the per-set counts are in the positive
+        # and negative partials of the same run
+        outputs = partials[0].get("outputs", {})
+        aggregate = {
+            "query_type": "unified",
+            "positive_summary": os.path.join(outputs["positive"], "aggregate_summary.json"),
+            "negative_summary": os.path.join(outputs["negative"], "aggregate_summary.json"),
+        }
+    elif query_type == "negative":
+        aggregate = build_negative_aggregate(totals)
+    else:
+        aggregate = build_positive_aggregate(totals, query_type)
+    if cache_stats is not None:
+        aggregate["analysis_cache"] = cache_stats
+    if cascade_config is not None:
+        aggregate["detection_cascade"] = summarize_cascade_stats(cascade_stats, cascade_config)
+    aggregate["shards"] = {
+        "count": count,
+        "merged": len(seen),
+        "missing": [index for index in range(count) if index not in seen],
+    }
+    return aggregate
+
+
+class ShardClaim:
+    """
+    Lock file marking a shard as being worked on
+
+    The lock is created with O_EXCL, so exactly one node gets it, and a
+    background thread touches it every heartbeat seconds. A lock left
+    untouched for stale_after seconds belongs to a dead node: it is moved
+    aside with a rename, which only one contender wins, and claimed afresh.
+    The moved file is checked again, since a contender that lost the stat
+    race would otherwise move aside a lock the winner has just created.
+    """
+
+    def __init__(self, path: str, stale_after: float = DEFAULT_STALE_AFTER):
+        self.path = path
+        self.stale_after = stale_after
+        self.heartbeat = max(1.0, min(60.0, stale_after / 4))
+        self.token = uuid.uuid4().hex
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _break_if_stale(self) -> bool:
+        """Remove a stale lock; True if the claim is worth retrying"""
+        try:
+            age = time.time() - os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return True
+        if age <= self.stale_after:
+            return False
+        aside = f"{self.path}.stale.{self.token}"
+        try:
+            os.rename(self.path, aside)
+        except FileNotFoundError:
+            # Another node broke it first and is claiming it now
+            return False
+        try:
+            # Between the stat and the rename another node may have broken
+            # the same lock and claimed the shard afresh; a fresh lock goes
+            # back under its name (a link, so a newer claim is not clobbered)
+            fresh = time.time() - os.stat(aside).st_mtime <= self.stale_after
+            if fresh:
+                try:
+                    os.link(aside, self.path)
+                except FileExistsError:
+                    pass
+        finally:
+            os.remove(aside)
+        return not fresh
+
+    def acquire(self) -> bool:
+        """Claim the shard; False if a live node holds it"""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            except FileExistsError:
+                if not self._break_if_stale():
+                    return False
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"token": self.token, "host": socket.gethostname(), "pid": os.getpid(),
+                           "claimed_at": datetime.now().isoformat()}, f)
+            self._thread = threading.Thread(target=self._beat, daemon=True)
+            self._thread.start()
+            return True
+        return False
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.heartbeat):
+            try:
+                os.utime(self.path)
+            except FileNotFoundError:
+                # Moved aside for a moment by a node checking it for
+                # staleness; it is put back if still fresh
+                continue
+
+    def owned(self) -> bool:
+        """True while the lock file still carries this claim's token"""
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("token") == self.token
+        except (FileNotFoundError, ValueError):
+            return False
+
+    def release(self) -> None:
+        """Stop the heartbeat and remove the lock if another node has not taken it over"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        if self.owned():
+            os.remove(self.path)
+
+
+def shard_runs(
+    shard: Optional[Tuple[int, int]],
+    claim_count: Optional[int],
+    targets: List[Tuple[str, str]],
+    stale_after: float = DEFAULT_STALE_AFTER
+) -> Iterator[Optional[Tuple[int, int]]]:
+    """
+    Shards a runner should evaluate, one per iteration
+
+    Yields None for an unsharded run, the one shard given, or with
+    --claim N every shard of N that has no partial yet and is not claimed
+    by a live node. A claimed shard stays locked until the caller asks for
+    the next one.
+
+    Args:
+        shard: Parsed --shard, or None
+        claim_count: N for claim mode, or None
+        targets: (output_dir, query_type) of every partial a shard writes;
+                 a shard is done once all of them exist, and its lock lives
+                 in the first output_dir's claims/ folder
+        stale_after: Seconds without heartbeat before a claim is taken over
+    """
+    if claim_count is None:
+        yield shard
+        return
+
+    job = "+".join(query_type for _, query_type in targets)
+    claims_dir = os.path.join(targets[0][0], CLAIMS_DIR)
+    for index in range(claim_count):
+        shard = (index, claim_count)
+
+        def done() -> bool:
+            return all(os.path.exists(partial_path(output_dir, query_type, shard))
+                       for output_dir, query_type in targets)
+
+        if done():
+            continue
+        claim = ShardClaim(os.path.join(claims_dir, f"{job}_{shard_label(shard)}.lock"), stale_after)
+        if not claim.acquire():
+            continue
+        try:
+            # Another node may have finished it between the check and the claim
+            if not done():
+                yield shard
+        finally:
+            claim.release()
+
+
+def shard_status(output_dir: str, query_type: str, count: int) -> Dict[str, List[int]]:
+    """Group shards of a run into done, claimed and pending"""
+    status: Dict[str, List[int]] = {"done": [], "claimed": [], "pending": []}
+    for index in range(count):
+        shard = (index, count)
+        if os.path.exists(partial_path(output_dir, query_type, shard)):
+            status["done"].append(index)
+        elif glob.glob(os.path.join(output_dir, CLAIMS_DIR, f"*{shard_label(shard)}.lock")):
+            status["claimed"].append(index)
+        else:
+            status["pending"].append(index)
+    return status
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Merge or inspect sharded evaluation runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    merge_parser = subparsers.add_parser("merge", help="Combine partial summaries into aggregate_summary.json")
+    merge_parser.add_argument("output_dir", help="Evaluation output directory; its partials/ are merged")
+    merge_parser.add_argument("--partials", nargs="+", default=None,
+                              help="Partial summaries or directories to merge instead (default: <output_dir>)")
+    merge_parser.add_argument("--query-type", default=None,
+                              help="Merge only partials of this query type")
+    merge_parser.add_argument("--allow-missing", action="store_true",
+                              help="Write the summary even if some shards have no partial yet")
+
+    status_parser = subparsers.add_parser("status", help="Show done, claimed and pending shards")
+    status_parser.add_argument("output_dir", help="Evaluation output directory")
+    status_parser.add_argument("query_type", help="positive or negative")
+    status_parser.add_argument("num_shards", type=int, help="N of the --shard/--claim runs")
+    args = parser.parse_args()
+
+    if args.command == "status":
+        status = shard_status(args.output_dir, args.query_type, args.num_shards)
+        for state, indices in status.items():
+            print(f"{state:<8} {len(indices):>6}  {' '.join(map(str, indices[:20]))}"
+                  f"{' ...' if len(indices) > 20 else ''}")
+        return
+
+    partials = load_partials(args.partials or [args.output_dir])
+    if args.query_type:
+        partials = [partial for partial in partials if partial["query_type"] == args.query_type]
+    try:
+        aggregate = merge_partials(partials)
+    except ValueError as error:
+        parser.error(str(error))
+    missing = aggregate["shards"]["missing"]
+    if missing and not args.allow_missing:
+        parser.error(f"{len(missing)} of {aggregate['shards']['count']} shards have no partial yet "
+                     f"(first: {missing[:10]}); rerun them or pass --allow-missing")
+
+    if aggregate["query_type"] == "unified":
+        from run_presidio_unified import save_unified_summary
+        summary_file = save_unified_summary(args.output_dir, aggregate)
+        print(f"✓ Merged {aggregate['shards']['merged']} unified partials into {summary_file}")
+        return
+
+    from run_presidio_evaluation import save_aggregate_summary
+    summary_file = save_aggregate_summary(args.output_dir, aggregate)
+    print(f"✓ Merged {aggregate['shards']['merged']} partials "
+          f"({aggregate['total_queries_processed']} {aggregate['query_type']} queries) into {summary_file}")
+    for name in ("recall", "perfect_rate", "false_positive_rate", "specificity"):
+        if name in aggregate:
+            print(f"  {name}: {aggregate[name]:.2%}")
+
+
+if __name__ == "__main__":
+    main()
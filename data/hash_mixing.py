@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Vectorized 64-bit Hash Mixing
+splitmix64 finalizer over numpy uint64 arrays, shared by the MinHash
+near-duplicate index and the PHI egress guard
+"""
+
+import numpy as np
+
+# splitmix64 finalizer constants
+MIX_SHIFTS = (np.uint64(30), np.uint64(27), np.uint64(31))
+MIX_MULTIPLIERS = (np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+
+
+def splitmix64(values: np.ndarray) -> np.ndarray:
+    """
+    splitmix64 finalizer over a uint64 array (wrapping arithmetic)
+
+    A bijection on 64-bit integers that mixes every input bit into every
+    output bit, so nearby or structured inputs come out uniformly spread.
+    """
+    mixed = values ^ (values >> MIX_SHIFTS[0])
+    mixed *= MIX_MULTIPLIERS[0]
+    mixed ^= mixed >> MIX_SHIFTS[1]
+    mixed *= MIX_MULTIPLIERS[1]
+    mixed ^= mixed >> MIX_SHIFTS[2]
+    return mixed
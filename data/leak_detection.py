@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Multi-Pattern PHI Leak Detection
+Compiles all PHI values into one trie automaton and scans an output text once,
+returning every occurrence with its span in the original text
+"""
+
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+_END = ''  # Trie key marking the end of a pattern
+
+
+def _is_punctuation(ch: str) -> bool:
+    return unicodedata.category(ch).startswith('P')
+
+
+def fold_text(text: str, normalize: bool = False) -> Tuple[str, Optional[List[int]]]:
+    """
+    Case-fold text for matching, optionally normalizing whitespace and punctuation
+
+    With normalize=True, punctuation is dropped and every whitespace run
+    becomes a single space, so "St. Vincent's" matches "St Vincents" and
+    "Anna  S." matches "anna s".
+
+    Returns:
+        Tuple of (folded_text, positions) where positions[i] is the index in
+        `text` of folded character i, or None when the mapping is the identity
+    """
+    if not normalize:
+        folded = text.lower()
+        if len(folded) == len(text):
+            return folded, None
+
+    chars = []
+    positions = []
+    previous_space = True
+    for i, ch in enumerate(text):
+        if normalize:
+            if ch.isspace():
+                if not previous_space:
+                    chars.append(' ')
+                    positions.append(i)
+                previous_space = True
+                continue
+            if _is_punctuation(ch):
+                continue
+        for folded_ch in ch.lower():
+            chars.append(folded_ch)
+            positions.append(i)
+        previous_space = False
+
+    if normalize and chars and chars[-1] == ' ':
+        chars.pop()
+        positions.pop()
+    return ''.join(chars), positions
+
+
+def _trie_to_regex(node: Dict[str, Any]) -> str:
+    """Render a trie as a regex that matches any pattern stored in it"""
+    alternatives = []
+    for ch, child in sorted(node.items()):
+        if ch == _END:
+            continue
+        # Collapse single-child chains so nesting depth tracks branch points
+        chain = re.escape(ch)
+        while len(child) == 1 and _END not in child:
+            (next_ch, child), = child.items()
+            chain += re.escape(next_ch)
+        alternatives.append(chain + _trie_to_regex(child))
+
+    if not alternatives:
+        return ''
+    if len(alternatives) == 1 and _END not in node:
+        return alternatives[0]
+    group = '(?:' + '|'.join(alternatives) + ')'
+    return group + '?' if _END in node else group
+
+
+class PhiMatcher:
+    """
+    Automaton over a fixed set of PHI values
+
+    Values are case-folded (and optionally normalized) into a trie, and the
+    trie is compiled into a single regular expression. A scan runs that
+    expression once over the output to find every position where some value
+    starts, then walks the trie from those positions to report all values
+    ending there, including overlapping and nested ones.
+
+    A matcher built for a single text (compiled=False) skips the regex and
+    walks the trie from every position instead; compiling costs more than
+    the scan when the pattern set is only used once.
+    """
+
+    def __init__(self, values: List[str], normalize: bool = False, compiled: bool = True):
+        self.values = list(values)
+        self.normalize = normalize
+        self.trie: Dict[str, Any] = {}
+        # Values that fold to the empty string occur in every text
+        self.empty_patterns: List[int] = []
+
+        for index, value in enumerate(self.values):
+            folded, _ = fold_text(value, normalize)
+            if not folded:
+                self.empty_patterns.append(index)
+                continue
+            node = self.trie
+            for ch in folded:
+                node = node.setdefault(ch, {})
+            node.setdefault(_END, []).append(index)
+
+        self.regex = None
+        if compiled and self.trie:
+            self.regex = re.compile(f'(?=(?:{_trie_to_regex(self.trie)}))')
+
+    def _iter_matches(self, folded: str):
+        """Yield (pattern_index, folded_start, folded_end) for every occurrence"""
+        if not self.trie:
+            return
+        if self.regex is not None:
+            starts = (match.start() for match in self.regex.finditer(folded))
+        else:
+            starts = (i for i, ch in enumerate(folded) if ch in self.trie)
+        for start in starts:
+            node = self.trie
+            position = start
+            while position < len(folded):
+                node = node.get(folded[position])
+                if node is None:
+                    break
+                position += 1
+                for index in node.get(_END, ()):
+                    yield index, start, position
+
+    def scan(self, text: str) -> List[Dict[str, Any]]:
+        """
+        Find every occurrence of every value in text
+
+        Returns:
+            List of hits ordered by start offset, each with pattern index,
+            value, and start/end offsets into the original text
+        """
+        folded, positions = fold_text(text, self.normalize)
+        hits = []
+        for index, start, end in self._iter_matches(folded):
+            if positions is not None:
+                original_start = positions[start]
+                original_end = positions[end - 1] + 1
+            else:
+                original_start, original_end = start, end
+            hits.append({
+                "pattern": index,
+                "value": self.values[index],
+                "start": original_start,
+                "end": original_end,
+                "text": text[original_start:original_end],
+            })
+        for index in self.empty_patterns:
+            hits.append({"pattern": index, "value": self.values[index], "start": 0, "end": 0, "text": ""})
+        hits.sort(key=lambda hit: (hit["start"], hit["end"], hit["pattern"]))
+        return hits
+
+    def matched(self, text: str) -> Set[int]:
+        """Return the indices of values that occur anywhere in text"""
+        folded, _ = fold_text(text, self.normalize)
+        found = set(self.empty_patterns)
+        for index, _, _ in self._iter_matches(folded):
+            found.add(index)
+        return found
+
+
+def find_phi_leaks(
+    anonymized_query: str,
+    ground_truth_entities: List[Dict[str, Any]],
+    normalize: bool = False,
+    matcher: Optional[PhiMatcher] = None
+) -> Dict[str, Any]:
+    """
+    Leak check over ground-truth PHI in the detect_phi_leaks result format
+
+    Args:
+        anonymized_query: Output text to check
+        ground_truth_entities: Entities with 'type' and 'value' keys
+        normalize: Also match across whitespace/punctuation differences
+        matcher: Precompiled matcher over the entity values, to reuse
+                 across many outputs checked against the same PHI. Without
+                 one, each folded value is looked up in the folded output
+                 with a substring test: building an automaton for a single
+                 output costs far more than the scan it saves.
+
+    Returns:
+        Dict with leaked_phi_count, leaked_phi_details and status
+    """
+    if matcher is not None:
+        found = matcher.matched(anonymized_query)
+    else:
+        folded, _ = fold_text(anonymized_query, normalize)
+        found = {
+            index for index, entity in enumerate(ground_truth_entities)
+            if fold_text(entity['value'], normalize)[0] in folded
+        }
+
+    leaked_phi = [
+        {
+            "type": entity['type'],
+            "value": entity['value'],
+            "start": entity.get('start', -1),
+            "end": entity.get('end', -1)
+        }
+        for index, entity in enumerate(ground_truth_entities)
+        if index in found
+    ]
+
+    return {
+        "leaked_phi_count": len(leaked_phi),
+        "leaked_phi_details": leaked_phi,
+        "status": "LEAK_DETECTED" if leaked_phi else "NO_LEAK"
+    }
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Record/Replay Cache for Azure OpenAI Chat Completions
+Wraps an AzureOpenAI or AsyncAzureOpenAI client so every chat completion is
+stored in a compressed, size-bounded SQLite store and can be served offline
+"""
+
+import argparse
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+from openai.types.chat import ChatCompletion
+
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# record: always call the endpoint and store the answer
+# replay: answer only from the store, never touch the network
+# read-through: answer from the store, call the endpoint on a miss
+CACHE_MODES = ("record", "replay", "read-through")
+
+# Request fields that make up the cache key; any other request argument is
+# folded in as well, except per-call transport settings
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens", "seed")
+TRANSPORT_FIELDS = ("timeout", "extra_headers", "extra_query", "extra_body")
+
+
+def request_key(request: Dict[str, Any]) -> str:
+    """
+    Hash the parts of a chat completion request that determine its answer
+
+    (deployment, messages, temperature, max_tokens, seed) plus any other
+    sampling argument, as canonical JSON; a missing field hashes as null.
+    """
+    fields = {name: request.get(name) for name in KEY_FIELDS}
+    fields["other"] = {
+        name: value for name, value in request.items()
+        if name not in KEY_FIELDS and name not in TRANSPORT_FIELDS
+    }
+    encoded = json.dumps(fields, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class LlmResponseCache:
+    """
+    On-disk store of chat completion responses keyed by (request key, occurrence)
+
+    Responses are stored as zlib-compressed JSON; the least recently used
+    ones are evicted once the compressed payload exceeds max_bytes. The
+    payload size is summed once on open and tracked from then on.
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.recorded = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " request_key TEXT NOT NULL,"
+            " occurrence INTEGER NOT NULL,"
+            " model TEXT,"
+            " payload BLOB NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " recorded_at INTEGER NOT NULL,"
+            " last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (request_key, occurrence))"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.total_bytes = self.conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        """Close the underlying database connection"""
+        self.conn.close()
+
+    def get(self, key: str, occurrence: int) -> Optional[Dict[str, Any]]:
+        """Stored response as a dict, or None"""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT payload FROM responses WHERE request_key = ? AND occurrence = ?",
+                (key, occurrence)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE responses SET last_used = ? WHERE request_key = ? AND occurrence = ?",
+                    (time.time_ns(), key, occurrence)
+                )
+        return json.loads(zlib.decompress(row[0]))
+
+    def put(self, key: str, occurrence: int, model: Optional[str], response: Dict[str, Any]) -> None:
+        """Store a response dict, then evict down to max_bytes"""
+        payload = zlib.compress(json.dumps(response, separators=(",", ":")).encode("utf-8"), 9)
+        now = time.time_ns()
+        with self.lock:
+            with self.conn:
+                replaced = self.conn.execute(
+                    "SELECT size FROM responses WHERE request_key = ? AND occurrence = ?",
+                    (key, occurrence)
+                ).fetchone()
+                if replaced is not None:
+                    self.total_bytes -= replaced[0]
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO responses"
+                    " (request_key, occurrence, model, payload, size, recorded_at, last_used)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (key, occurrence, model, payload, len(payload), now, now)
+                )
+            self.total_bytes += len(payload)
+            self.recorded += 1
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        excess = self.total_bytes - self.max_bytes
+        with self.conn:
+            rows = self.conn.execute(
+                "SELECT request_key, occurrence, size FROM responses ORDER BY last_used"
+            )
+            doomed = []
+            for key, occurrence, size in rows:
+                if excess <= 0:
+                    break
+                doomed.append((key, occurrence))
+                excess -= size
+                self.total_bytes -= size
+            self.conn.executemany(
+                "DELETE FROM responses WHERE request_key = ? AND occurrence = ?", doomed
+            )
+        self.evictions += len(doomed)
+
+    def take_stats(self) -> Dict[str, int]:
+        """Return the hit/miss/record/eviction counters since the last call and reset them"""
+        with self.lock:
+            stats = {
+                "hits": self.hits,
+                "misses": self.misses,
+                "recorded": self.recorded,
+                "evictions": self.evictions,
+            }
+            self.hits = self.misses = self.recorded = self.evictions = 0
+        return stats
+
+
+class _CachedClientBase:
+    """
+    Shared mode handling of the sync and async wrappers
+
+    Identical requests are told apart by occurrence: the Nth identical
+    request sent through a wrapper maps to the Nth stored response. A rerun
+    of the generation notebook, which sends the same prompt once per batch
+    at temperature 0.9, therefore replays every batch in its original order
+    instead of the first answer over and over. Each wrapper counts from
+    zero, so a new wrapper replays a run from its start.
+    """
+
+    def __init__(self, client: Any, cache: LlmResponseCache, mode: str = "read-through"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode!r}; expected one of {', '.join(CACHE_MODES)}")
+        if client is None and mode != "replay":
+            raise ValueError(f"Cache mode {mode!r} needs a client to call the endpoint")
+        self.client = client
+        self.cache = cache
+        self.mode = mode
+        self.occurrence_lock = threading.Lock()
+        self.next_occurrence: Dict[str, int] = {}
+        self.released: Dict[str, List[int]] = {}
+
+    def __getattr__(self, name: str) -> Any:
+        # Everything but chat completions goes straight to the wrapped client
+        return getattr(self.client, name)
+
+    def _claim(self, key: str) -> int:
+        """Occurrence number for the next request with this key"""
+        with self.occurrence_lock:
+            released = self.released.get(key)
+            if released:
+                return heapq.heappop(released)
+            occurrence = self.next_occurrence.get(key, 0)
+            self.next_occurrence[key] = occurrence + 1
+            return occurrence
+
+    def _release(self, key: str, occurrence: int) -> None:
+        """Hand back an occurrence whose request failed, so its retry reuses it"""
+        with self.occurrence_lock:
+            heapq.heappush(self.released.setdefault(key, []), occurrence)
+
+    def _lookup(self, request: Dict[str, Any]) -> Tuple[str, int, Optional[ChatCompletion]]:
+        """Claim an occurrence and return (key, occurrence, cached response or None)"""
+        if request.get("stream"):
+            raise ValueError("Streaming completions cannot be cached")
+        key = request_key(request)
+        occurrence = self._claim(key)
+        if self.mode != "record":
+            cached = self.cache.get(key, occurrence)
+            if cached is not None:
+                return key, occurrence, ChatCompletion.model_validate(cached)
+        if self.mode == "replay":
+            self._release(key, occurrence)
+            raise LookupError(
+                f"No recorded response for this {request.get('model')} request "
+                f"(occurrence {occurrence}); record it first with mode 'record' or 'read-through'"
+            )
+        return key, occurrence, None
+
+    def _store(self, request: Dict[str, Any], key: str, occurrence: int, response: ChatCompletion) -> None:
+        self.cache.put(key, occurrence, request.get("model"), response.model_dump(mode="json"))
+
+
+class CachedAzureOpenAI(_CachedClientBase):
+    """
+    Drop-in wrapper for AzureOpenAI: client.chat.completions.create is cached
+
+    In replay mode the wrapped client may be None, so no credentials or
+    network are needed. A failed call hands its occurrence back, so a retry
+    of the same request lines up with what was recorded.
+    """
+
+    def __init__(self, client: Any, cache: LlmResponseCache, mode: str = "read-through"):
+        super().__init__(client, cache, mode)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, **request: Any) -> ChatCompletion:
+        key, occurrence, cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        try:
+            response = self.client.chat.completions.create(**request)
+        except Exception:
+            self._release(key, occurrence)
+            raise
+        self._store(request, key, occurrence, response)
+        return response
+
+
+class AsyncCachedAzureOpenAI(_CachedClientBase):
+    """Drop-in wrapper for AsyncAzureOpenAI; see CachedAzureOpenAI"""
+
+    def __init__(self, client: Any, cache: LlmResponseCache, mode: str = "read-through"):
+        super().__init__(client, cache, mode)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **request: Any) -> ChatCompletion:
+        key, occurrence, cached = self._lookup(request)
+        if cached is not None:
+            return cached
+        try:
+            response = await self.client.chat.completions.create(**request)
+        except Exception:
+            self._release(key, occurrence)
+            raise
+        self._store(request, key, occurrence, response)
+        return response
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Inspect an LLM response cache")
+    parser.add_argument("cache", help="Path to the cache database")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(args.cache)
+    entries, total_bytes = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+    ).fetchone()
+    requests = conn.execute("SELECT COUNT(DISTINCT request_key) FROM responses").fetchone()[0]
+    models = conn.execute(
+        "SELECT model, COUNT(*) FROM responses GROUP BY model ORDER BY COUNT(*) DESC"
+    ).fetchall()
+    conn.close()
+
+    print(f"Responses: {entries} ({requests} distinct requests)")
+    print(f"Compressed size: {total_bytes / (1024 * 1024):.1f} MB")
+    for model, count in models:
+        print(f"  {model}: {count}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,639 @@
+#!/usr/bin/env python3
+"""
+Near-Duplicate Detection for Generated Queries
+MinHash signatures over PHI-masked query shingles with a persistent,
+incrementally growing LSH index, usable inline during generation or as a
+batch pass over an existing dataset file
+"""
+
+import argparse
+import json
+import os
+import re
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from dataset_index import DatasetReader, parse_phi_tags
+from hash_mixing import splitmix64
+
+INDEX_FORMAT = "near_duplicate_index/1"
+META_FILE = "meta.json"
+SIGNATURES_FILE = "signatures.u16"
+LABELS_FILE = "labels.txt"
+BAND_TABLE_FILE = "bands.npy"
+
+QUERY_MARKER = "===QUERY==="
+TAGS_MARKER = "===PHI_TAGS==="
+
+DEFAULT_THRESHOLD = 0.8
+DEFAULT_NUM_PERM = 128
+DEFAULT_SHINGLE_SIZE = 3
+DEFAULT_SEED = 1
+
+# b-bit MinHash: only the low 16 bits of each minimum are kept
+SIGNATURE_DTYPE = np.uint16
+SIGNATURE_MASK = np.uint64(0xFFFF)
+BAND_TABLE_DTYPE = np.dtype([("key", "<u8"), ("id", "<u4")])
+# Entries outside the sorted band table are folded in once they reach this
+# many, or a tenth of the table, whichever is larger
+COMPACT_MIN_ENTRIES = 10000
+
+TOKEN_PATTERN = re.compile(r"\{[A-Z_]+\}|[^\W\d_]+|\d+")
+
+
+def mask_phi(query_text: str, phi_entities: Iterable[Dict[str, Any]]) -> str:
+    """
+    Lowercase the query and replace every PHI value with {IDENTIFIER_TYPE}
+
+    Longer values are replaced first, so "April 12, 2023" is masked as one
+    DATE rather than leaving "april 12, {DATE}" behind for a tagged year.
+    """
+    masked = query_text.lower()
+    values: Dict[str, str] = {}
+    for tag in phi_entities:
+        value = str(tag.get('value') or '').lower()
+        if value:
+            values.setdefault(value, str(tag.get('identifier_type') or 'PHI'))
+    for value in sorted(values, key=len, reverse=True):
+        masked = masked.replace(value, "{" + values[value] + "}")
+    return masked
+
+
+def shingle_hashes(masked_text: str, shingle_size: int = DEFAULT_SHINGLE_SIZE) -> List[int]:
+    """
+    32-bit hashes of the distinct word shingles of a masked query
+
+    Digit runs (ages, doses, lab values) collapse to "#" so a skeleton
+    repeated with different numbers still shares its shingles.
+    """
+    tokens = ["#" if token[0].isdigit() else token for token in TOKEN_PATTERN.findall(masked_text)]
+    if len(tokens) < shingle_size:
+        grams = {" ".join(tokens)} if tokens else set()
+    else:
+        grams = {" ".join(tokens[i:i + shingle_size]) for i in range(len(tokens) - shingle_size + 1)}
+    return [zlib.crc32(gram.encode('utf-8')) for gram in grams]
+
+
+def lsh_bands(threshold: float, num_perm: int) -> Tuple[int, int]:
+    """
+    Pick (bands, rows) with bands * rows == num_perm for a Jaccard threshold
+
+    Chooses the highest LSH S-curve midpoint (1/bands)^(1/rows) that is not
+    above the threshold: pairs at the threshold become candidates with high
+    probability, and the extra candidates are removed by signature
+    comparison.
+    """
+    best = (num_perm, 1)
+    best_midpoint = -1.0
+    for rows in range(1, num_perm + 1):
+        if num_perm % rows:
+            continue
+        bands = num_perm // rows
+        midpoint = (1.0 / bands) ** (1.0 / rows)
+        if best_midpoint < midpoint <= threshold:
+            best, best_midpoint = (bands, rows), midpoint
+    return best
+
+
+class MinHasher:
+    """
+    Vectorized MinHash
+
+    Permutation i hashes a shingle as splitmix64(splitmix64(x) ^ seed_i).
+    The splitmix64 finalizer is a bijection on 64-bit integers that mixes
+    every input bit into every output bit; the inner pass spreads the 32-bit
+    shingle hash over 64 bits before the per-permutation seed is applied.
+    """
+
+    def __init__(self, num_perm: int = DEFAULT_NUM_PERM, seed: int = DEFAULT_SEED):
+        self.num_perm = num_perm
+        rng = np.random.RandomState(seed)
+        self.seeds = rng.randint(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64)
+        self.band_multipliers = rng.randint(1, 1 << 62, size=num_perm, dtype=np.uint64) | np.uint64(1)
+
+    def signatures(self, hash_lists: Sequence[List[int]]) -> np.ndarray:
+        """
+        MinHash signatures for several shingle-hash lists at once
+
+        Returns:
+            (len(hash_lists), num_perm) uint16 array; queries without any
+            shingle get an all-0xFFFF signature
+        """
+        signatures = np.full((len(hash_lists), self.num_perm), 0xFFFF, dtype=SIGNATURE_DTYPE)
+        lengths = np.array([len(hashes) for hashes in hash_lists], dtype=np.int64)
+        filled = np.flatnonzero(lengths)
+        if not len(filled):
+            return signatures
+        flat = np.fromiter(
+            (h for hashes in hash_lists for h in hashes), dtype=np.uint64, count=int(lengths.sum())
+        )
+        permuted = splitmix64(splitmix64(flat)[:, None] ^ self.seeds)
+        starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))[filled]
+        minima = np.minimum.reduceat(permuted, starts, axis=0)
+        signatures[filled] = (minima & SIGNATURE_MASK).astype(SIGNATURE_DTYPE)
+        return signatures
+
+
+class NearDuplicateIndex:
+    """
+    Persistent MinHash LSH index rooted at a directory
+
+    Layout:
+        meta.json        format and hashing parameters
+        signatures.u16   append-only (entries, num_perm) uint16 signatures
+        labels.txt       one label per entry, e.g. "synthetic_dataset.txt:17"
+        bands.npy        per-band (key, id) table sorted by key, covering
+                         the first entries; memory-mapped on open
+
+    Entries appended after the last compaction are re-banded when the index
+    is opened and kept in memory until close() folds them into bands.npy.
+    A lookup is a binary search per band, so checking a batch does not
+    depend on scanning the corpus.
+
+    Usage:
+        with NearDuplicateIndex("dedup_index") as index:
+            matches = index.check_queries(queries, labels)
+    """
+
+    def __init__(
+        self,
+        root_dir: str,
+        threshold: Optional[float] = None,
+        num_perm: int = DEFAULT_NUM_PERM,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        seed: int = DEFAULT_SEED
+    ):
+        """
+        Open or create an index
+
+        num_perm, shingle_size and seed only apply to a new index; an
+        existing index keeps the parameters in its meta.json. threshold
+        defaults to the stored one and may be raised or lowered per run,
+        but the LSH banding stays the one chosen at creation.
+        """
+        self.root_dir = root_dir
+        os.makedirs(root_dir, exist_ok=True)
+        meta_path = os.path.join(root_dir, META_FILE)
+        if os.path.exists(meta_path):
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                self.meta = json.load(f)
+            if self.meta.get("format") != INDEX_FORMAT:
+                raise ValueError(f"{root_dir} is not a {INDEX_FORMAT} index")
+        else:
+            created_threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+            bands, rows = lsh_bands(created_threshold, num_perm)
+            self.meta = {
+                "format": INDEX_FORMAT,
+                "threshold": created_threshold,
+                "num_perm": num_perm,
+                "bands": bands,
+                "rows": rows,
+                "shingle_size": shingle_size,
+                "seed": seed,
+            }
+            with open(meta_path, 'w', encoding='utf-8') as f:
+                json.dump(self.meta, f, indent=2)
+
+        self.threshold = self.meta["threshold"] if threshold is None else threshold
+        self.num_perm = self.meta["num_perm"]
+        self.bands = self.meta["bands"]
+        self.rows = self.meta["rows"]
+        self.shingle_size = self.meta["shingle_size"]
+        self.hasher = MinHasher(self.num_perm, self.meta["seed"])
+        self._row_bytes = self.num_perm * np.dtype(SIGNATURE_DTYPE).itemsize
+
+        self._stored = self._recover()
+        self._signatures = None
+        if self._stored:
+            self._signatures = np.memmap(
+                self._path(SIGNATURES_FILE), dtype=SIGNATURE_DTYPE, mode='r', shape=(self._stored, self.num_perm)
+            )
+
+        self._table = None
+        self._table_entries = 0
+        table_path = self._path(BAND_TABLE_FILE)
+        if os.path.exists(table_path):
+            table = np.load(table_path, mmap_mode='r')
+            if table.shape[0] == self.bands and table.shape[1] <= self._stored:
+                self._table = table
+                self._table_entries = table.shape[1]
+
+        # Stored entries newer than bands.npy: sorted per band in memory
+        self._tail_table = None
+        if self._stored > self._table_entries:
+            tail_ids = np.arange(self._table_entries, self._stored, dtype=np.uint32)
+            self._tail_table = self._sorted_table(self._band_keys(self._signatures[self._table_entries:]), tail_ids)
+
+        # Entries added by this process
+        self._new_signatures: List[np.ndarray] = []
+        self._new_labels: List[str] = []
+        self._new_buckets: List[Dict[int, List[int]]] = [{} for _ in range(self.bands)]
+        self._labels: Optional[List[str]] = None
+
+        self._signature_file = open(self._path(SIGNATURES_FILE), 'ab')
+        self._label_file = open(self._path(LABELS_FILE), 'a', encoding='utf-8')
+
+    def __enter__(self) -> 'NearDuplicateIndex':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return self._stored + len(self._new_signatures)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.root_dir, name)
+
+    def _recover(self) -> int:
+        """
+        Truncate partial writes so signatures.u16 and labels.txt hold the
+        same number of complete entries
+
+        Returns:
+            Number of stored entries
+        """
+        signatures_path = self._path(SIGNATURES_FILE)
+        labels_path = self._path(LABELS_FILE)
+        signature_count = os.path.getsize(signatures_path) // self._row_bytes if os.path.exists(signatures_path) else 0
+
+        label_count = 0
+        label_ends = []
+        if os.path.exists(labels_path):
+            with open(labels_path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    offset += len(line)
+                    if line.endswith(b'\n'):
+                        label_count += 1
+                        if label_count > signature_count:
+                            break
+                        label_ends.append(offset)
+
+        count = min(signature_count, label_count)
+        if os.path.exists(signatures_path):
+            with open(signatures_path, 'rb+') as f:
+                f.truncate(count * self._row_bytes)
+        if os.path.exists(labels_path):
+            with open(labels_path, 'rb+') as f:
+                f.truncate(label_ends[count - 1] if count else 0)
+        return count
+
+    def _band_keys(self, signatures: np.ndarray) -> np.ndarray:
+        """(bands, n) uint64 bucket key of every band of every signature"""
+        used = self.bands * self.rows
+        keys = np.empty((self.bands, len(signatures)), dtype=np.uint64)
+        multipliers = self.hasher.band_multipliers[:used].reshape(self.bands, self.rows)
+        # Chunked so a compaction never widens the whole corpus to uint64 at once
+        for start in range(0, len(signatures), 65536):
+            chunk = np.asarray(signatures[start:start + 65536, :used], dtype=np.uint64)
+            chunk = chunk.reshape(len(chunk), self.bands, self.rows)
+            keys[:, start:start + len(chunk)] = (chunk * multipliers).sum(axis=2).T
+        return keys
+
+    def _sorted_table(self, keys: np.ndarray, ids: np.ndarray) -> np.ndarray:
+        """Per-band (key, id) records sorted by key"""
+        table = np.empty(keys.shape, dtype=BAND_TABLE_DTYPE)
+        for band in range(self.bands):
+            order = np.argsort(keys[band], kind='stable')
+            table[band]["key"] = keys[band][order]
+            table[band]["id"] = ids[order]
+        return table
+
+    def _signature_rows(self, ids: np.ndarray) -> np.ndarray:
+        """Signatures of the given (sorted) entry ids, stored or added by this process"""
+        rows = np.empty((len(ids), self.num_perm), dtype=SIGNATURE_DTYPE)
+        stored = ids < self._stored
+        if stored.any():
+            rows[stored] = self._signatures[ids[stored]]
+        for i in np.flatnonzero(~stored):
+            rows[i] = self._new_signatures[ids[i] - self._stored]
+        return rows
+
+    def _table_candidates(self, table: Optional[np.ndarray], keys: np.ndarray) -> List[List[np.ndarray]]:
+        """Ids sharing a bucket with each query, per query and band, from one sorted table"""
+        candidates: List[List[np.ndarray]] = [[] for _ in range(keys.shape[1])]
+        if table is None or not table.shape[1]:
+            return candidates
+        for band in range(self.bands):
+            band_keys = table[band]["key"]
+            lows = np.searchsorted(band_keys, keys[band], side='left')
+            highs = np.searchsorted(band_keys, keys[band], side='right')
+            for query, (low, high) in enumerate(zip(lows, highs)):
+                if high > low:
+                    candidates[query].append(table[band]["id"][low:high])
+        return candidates
+
+    def _best_match(self, signature: np.ndarray, candidate_ids: List[np.ndarray]) -> Optional[Tuple[int, float]]:
+        if not candidate_ids:
+            return None
+        ids = np.unique(np.concatenate(candidate_ids).astype(np.int64))
+        similarity = (self._signature_rows(ids) == signature).mean(axis=1)
+        best = int(np.argmax(similarity))
+        if similarity[best] < self.threshold:
+            return None
+        return int(ids[best]), float(similarity[best])
+
+    def signatures_for(self, queries: Sequence[Tuple[str, Iterable[Dict[str, Any]]]]) -> np.ndarray:
+        """MinHash signatures of (query_text, phi_entities) pairs"""
+        return self.hasher.signatures([
+            shingle_hashes(mask_phi(query_text, phi_entities), self.shingle_size)
+            for query_text, phi_entities in queries
+        ])
+
+    def check(
+        self,
+        signatures: np.ndarray,
+        labels: Optional[Sequence[str]] = None,
+        add: bool = True
+    ) -> List[Optional[Tuple[int, float]]]:
+        """
+        Look up a batch of signatures and add the ones without a match
+
+        Queries are checked in order, so a near-duplicate of an earlier
+        query in the same batch is caught too (only when add=True).
+
+        Args:
+            signatures: (n, num_perm) signatures from signatures_for
+            labels: One label per query, stored for added entries
+            add: Add unmatched queries to the index
+
+        Returns:
+            Per query, None when it is new, else (entry_id, estimated
+            Jaccard similarity) of the closest indexed query
+        """
+        keys = self._band_keys(signatures)
+        table_hits = self._table_candidates(self._table, keys)
+        tail_hits = self._table_candidates(self._tail_table, keys)
+
+        matches: List[Optional[Tuple[int, float]]] = []
+        for query, signature in enumerate(signatures):
+            candidate_ids = table_hits[query] + tail_hits[query]
+            for band in range(self.bands):
+                bucket = self._new_buckets[band].get(int(keys[band, query]))
+                if bucket:
+                    candidate_ids.append(np.array(bucket, dtype=np.int64))
+            match = self._best_match(signature, candidate_ids)
+            matches.append(match)
+            if match is None and add:
+                label = labels[query] if labels is not None else str(len(self))
+                self._add(signature, keys[:, query], label)
+        return matches
+
+    def check_queries(
+        self,
+        queries: Sequence[Tuple[str, Iterable[Dict[str, Any]]]],
+        labels: Optional[Sequence[str]] = None,
+        add: bool = True
+    ) -> List[Optional[Tuple[int, float]]]:
+        """check() for (query_text, phi_entities) pairs"""
+        return self.check(self.signatures_for(queries), labels, add)
+
+    def _add(self, signature: np.ndarray, keys: np.ndarray, label: str) -> int:
+        entry_id = len(self)
+        self._new_signatures.append(np.array(signature, dtype=SIGNATURE_DTYPE))
+        self._new_labels.append(label)
+        for band in range(self.bands):
+            self._new_buckets[band].setdefault(int(keys[band]), []).append(entry_id)
+        self._signature_file.write(signature.astype(SIGNATURE_DTYPE).tobytes())
+        self._label_file.write(label.replace('\n', ' ') + '\n')
+        return entry_id
+
+    def label(self, entry_id: int) -> str:
+        """Label stored with an entry"""
+        if entry_id >= self._stored:
+            return self._new_labels[entry_id - self._stored]
+        if self._labels is None:
+            with open(self._path(LABELS_FILE), 'r', encoding='utf-8') as f:
+                self._labels = [line.rstrip('\n') for _, line in zip(range(self._stored), f)]
+        return self._labels[entry_id]
+
+    def filter_blocks(self, generated_text: str, source: str = "generated") -> Tuple[str, int]:
+        """
+        Drop near-duplicate ===QUERY=== blocks from a generated batch
+
+        Kept blocks are added to the index, so later batches are checked
+        against them. Malformed blocks are passed through untouched.
+
+        Args:
+            generated_text: Model output with one or more blocks
+            source: Label prefix for the added entries ("<source>:<n>")
+
+        Returns:
+            Tuple of (text of the kept blocks, number of blocks dropped)
+        """
+        blocks = [QUERY_MARKER + block for block in generated_text.split(QUERY_MARKER)[1:]]
+        parsed = []
+        for i, block in enumerate(blocks):
+            body = block[len(QUERY_MARKER):]
+            if TAGS_MARKER not in body:
+                continue
+            query_text, tags_text = body.split(TAGS_MARKER, 1)
+            if query_text.strip():
+                parsed.append((i, query_text.strip(), parse_phi_tags(tags_text)))
+
+        matches = self.check_queries(
+            [(query_text, entities) for _, query_text, entities in parsed],
+            [f"{source}:{i}" for i, _, _ in parsed]
+        )
+        dropped = {i for (i, _, _), match in zip(parsed, matches) if match is not None}
+        kept = [block.strip() for i, block in enumerate(blocks) if i not in dropped]
+        return "\n\n".join(kept), len(dropped)
+
+    def flush(self) -> None:
+        """Flush appended signatures and labels to the OS"""
+        self._signature_file.flush()
+        self._label_file.flush()
+
+    def compact(self) -> None:
+        """Fold every entry into a rewritten, sorted bands.npy"""
+        self.flush()
+        total = len(self)
+        if total == self._table_entries:
+            return
+        signatures = np.memmap(
+            self._path(SIGNATURES_FILE), dtype=SIGNATURE_DTYPE, mode='r', shape=(total, self.num_perm)
+        )
+        new_ids = np.arange(self._table_entries, total, dtype=np.uint32)
+        new_keys = self._band_keys(signatures[self._table_entries:])
+        table = np.empty((self.bands, total), dtype=BAND_TABLE_DTYPE)
+        for band in range(self.bands):
+            keys = new_keys[band]
+            ids = new_ids
+            if self._table is not None:
+                keys = np.concatenate((self._table[band]["key"], keys))
+                ids = np.concatenate((self._table[band]["id"], ids))
+            order = np.argsort(keys, kind='stable')
+            table[band]["key"] = keys[order]
+            table[band]["id"] = ids[order]
+
+        temp_path = self._path(BAND_TABLE_FILE + ".tmp")
+        with open(temp_path, 'wb') as f:
+            np.save(f, table)
+        os.replace(temp_path, self._path(BAND_TABLE_FILE))
+
+        self._table = np.load(self._path(BAND_TABLE_FILE), mmap_mode='r')
+        self._table_entries = total
+        self._tail_table = None
+        self._signatures = signatures
+        self._stored = total
+        if self._labels is not None:
+            self._labels.extend(self._new_labels)
+        self._new_signatures = []
+        self._new_labels = []
+        self._new_buckets = [{} for _ in range(self.bands)]
+
+    def close(self) -> None:
+        """Flush, compact when enough entries sit outside bands.npy, and close"""
+        if self._signature_file.closed:
+            return
+        pending = len(self) - self._table_entries
+        if pending and pending >= max(COMPACT_MIN_ENTRIES, self._table_entries // 10):
+            self.compact()
+        self._signature_file.close()
+        self._label_file.close()
+
+
+def scan_dataset(
+    index: NearDuplicateIndex,
+    dataset_file: str,
+    batch_size: int = 1000,
+    add: bool = True,
+    report_file: Optional[str] = None,
+    unique_output: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Check every query of a dataset file against the index
+
+    Args:
+        index: Open NearDuplicateIndex
+        dataset_file: ===QUERY=== / ===PHI_TAGS=== dataset to scan
+        batch_size: Queries hashed and looked up together
+        add: Add unmatched queries (labelled "<file name>:<block number>")
+        report_file: TSV of near-duplicates: block, matched label,
+                     similarity, query text
+        unique_output: Copy of the dataset without the near-duplicate blocks
+
+    Returns:
+        Dict with scanned/duplicate counts, index size and batch latencies
+    """
+    source = os.path.basename(dataset_file)
+    duplicates = 0
+    scanned = 0
+    batch_seconds: List[float] = []
+    report = open(report_file, 'w', encoding='utf-8') if report_file else None
+    unique = open(unique_output, 'w', encoding='utf-8') if unique_output else None
+    if report:
+        report.write("block\tmatched\tsimilarity\tquery_text\n")
+
+    try:
+        with DatasetReader(dataset_file) as reader:
+            for start in range(0, len(reader), batch_size):
+                records = [reader[n] for n in range(start, min(start + batch_size, len(reader)))]
+                checked = [
+                    (start + offset, record) for offset, record in enumerate(records)
+                    if not record['malformed'] and record['query_text']
+                ]
+                started = time.perf_counter()
+                matches = index.check_queries(
+                    [(record['query_text'], record['phi_entities']) for _, record in checked],
+                    [f"{source}:{n}" for n, _ in checked],
+                    add
+                )
+                batch_seconds.append(time.perf_counter() - started)
+                scanned += len(checked)
+
+                dropped = set()
+                for (n, record), match in zip(checked, matches):
+                    if match is None:
+                        continue
+                    duplicates += 1
+                    dropped.add(n)
+                    if report:
+                        query_text = record['query_text'].replace('\t', ' ').replace('\n', ' ')
+                        report.write(f"{n}\t{index.label(match[0])}\t{match[1]:.3f}\t{query_text}\n")
+
+                if unique:
+                    for n in range(start, start + len(records)):
+                        if n not in dropped:
+                            query_text, tags_text = reader.raw_block(n)
+                            unique.write(QUERY_MARKER + query_text)
+                            if tags_text is not None:
+                                unique.write(TAGS_MARKER + tags_text)
+    finally:
+        for handle in (report, unique):
+            if handle is not None:
+                handle.close()
+
+    batch_seconds.sort()
+    return {
+        "scanned": scanned,
+        "near_duplicates": duplicates,
+        "duplicate_rate": duplicates / scanned if scanned else 0.0,
+        "index_entries": len(index),
+        "batch_size": batch_size,
+        "batch_p50_ms": round(batch_seconds[len(batch_seconds) // 2] * 1000, 2) if batch_seconds else 0.0,
+        "batch_max_ms": round(batch_seconds[-1] * 1000, 2) if batch_seconds else 0.0,
+    }
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Near-duplicate detection over PHI-masked query skeletons")
+    parser.add_argument("--index", required=True,
+                        help="Index directory (created on first use)")
+    parser.add_argument("--threshold", type=float, default=None,
+                        help=f"Estimated Jaccard similarity that counts as a near-duplicate "
+                             f"(default: stored, or {DEFAULT_THRESHOLD} for a new index)")
+    parser.add_argument("--num-perm", type=int, default=DEFAULT_NUM_PERM,
+                        help="MinHash permutations for a new index (default: %(default)s)")
+    parser.add_argument("--shingle-size", type=int, default=DEFAULT_SHINGLE_SIZE,
+                        help="Words per shingle for a new index (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scan_parser = subparsers.add_parser("scan", help="Check a dataset file and add its new queries")
+    scan_parser.add_argument("dataset", help="Dataset file in ===QUERY===/===PHI_TAGS=== format")
+    scan_parser.add_argument("--batch-size", type=int, default=1000,
+                             help="Queries per lookup batch (default: %(default)s)")
+    scan_parser.add_argument("--read-only", action="store_true",
+                             help="Only check against the index; do not add (duplicates within the file are not caught)")
+    scan_parser.add_argument("--report", default=None,
+                             help="Write near-duplicates as TSV to this file")
+    scan_parser.add_argument("--unique-output", default=None,
+                             help="Write the dataset without near-duplicate blocks to this file")
+
+    subparsers.add_parser("stats", help="Print index parameters and size")
+    subparsers.add_parser("compact", help="Fold all entries into the sorted band table")
+
+    args = parser.parse_args()
+
+    with NearDuplicateIndex(args.index, args.threshold, args.num_perm, args.shingle_size) as index:
+        if args.command == "scan":
+            print(f"Scanning {args.dataset} against {len(index):,} indexed queries "
+                  f"(threshold {index.threshold}, {index.bands} bands x {index.rows} rows)...")
+            started = time.perf_counter()
+            result = scan_dataset(
+                index, args.dataset, args.batch_size, not args.read_only, args.report, args.unique_output
+            )
+            elapsed = time.perf_counter() - started
+            print(f"\n✓ {result['scanned']:,} queries in {elapsed:.1f}s")
+            print(f"  Near-duplicates: {result['near_duplicates']:,} ({result['duplicate_rate']:.2%})")
+            print(f"  Index entries: {result['index_entries']:,}")
+            print(f"  Lookup per {result['batch_size']}-query batch: "
+                  f"p50 {result['batch_p50_ms']} ms, max {result['batch_max_ms']} ms")
+            if args.report:
+                print(f"  Report written to {args.report}")
+            if args.unique_output:
+                print(f"  Deduplicated dataset written to {args.unique_output}")
+        elif args.command == "compact":
+            index.compact()
+            print(f"Compacted {len(index):,} entries into {os.path.join(args.index, BAND_TABLE_FILE)}")
+        else:
+            print(json.dumps(dict(index.meta, entries=len(index), threshold=index.threshold), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+Hashed PHI Egress Guard
+Salted Bloom filter over normalized PHI n-grams in a memory-mapped file,
+checking outbound payloads at each pipeline stage without plaintext PHI
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from dataset_index import DatasetReader
+from hash_mixing import splitmix64
+from span_metrics import load_trace_records
+
+GUARD_MAGIC = b'PHIGRD02'
+# magic, salt (zeros when not stored), salt stored, hash count, max n-gram
+# length, filter bits, items, realized per-probe false-positive rate
+HEADER = struct.Struct('<8s16s?IIQQd')
+HEADER_SIZE = 64
+
+# Environment variable the CLI reads the salt from when --salt is not given
+SALT_ENV = "PHI_GUARD_SALT"
+
+DEFAULT_FALSE_POSITIVE_RATE = 1e-6
+DEFAULT_MAX_NGRAM = 8
+BUILD_BATCH_SIZE = 50000
+# Hashes probed for every key at once before short-circuiting
+FIRST_ROUND_PROBES = 3
+# Surviving keys below this count take all their remaining probes in one round
+FINAL_ROUND_THRESHOLD = 16
+
+# Punctuation and symbols separate tokens, so "St. Jude's" and "st jude s"
+# agree and "Dr. Hart" is still found in "Dr. Hart’s"
+_SEPARATOR_PATTERN = re.compile(r"[^\w]+")
+_NGRAM_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+# Probe i of a key mixes the key with i times this odd constant
+_PROBE_MULTIPLIER = np.uint64(0xD6E8FEB86659FD93)
+
+
+def normalize_tokens(text: str) -> List[str]:
+    """Case-folded word tokens, split at whitespace, punctuation and symbols"""
+    return _SEPARATOR_PATTERN.sub(" ", text.lower()).split()
+
+
+def _token_hashes(tokens: List[str], keyed_hasher: Any) -> np.ndarray:
+    """
+    Keyed BLAKE2b of every token as a uint64 array
+
+    keyed_hasher is an empty blake2b already keyed with the salt; copying it
+    skips the key block for each token, and repeated tokens are hashed once.
+    """
+    digests: Dict[str, bytes] = {}
+    for token in tokens:
+        if token not in digests:
+            hasher = keyed_hasher.copy()
+            hasher.update(token.encode("utf-8"))
+            digests[token] = hasher.digest()
+    return np.frombuffer(b"".join([digests[token] for token in tokens]), dtype="<u8").astype(np.uint64)
+
+
+def _keyed_hasher(salt: bytes) -> Any:
+    return hashlib.blake2b(digest_size=8, key=salt)
+
+
+# Powers of _NGRAM_MULTIPLIER and of its inverse mod 2**64, grown on demand
+_powers = np.ones(1, dtype=np.uint64)
+_inverse_powers = np.ones(1, dtype=np.uint64)
+
+
+def _multiplier_powers(count: int) -> Tuple[np.ndarray, np.ndarray]:
+    """First `count` powers of the n-gram multiplier and of its inverse"""
+    global _powers, _inverse_powers
+    if len(_powers) < count:
+        size = max(count, 2 * len(_powers))
+        inverse = np.uint64(pow(int(_NGRAM_MULTIPLIER), -1, 2 ** 64))
+        _powers = np.full(size, _NGRAM_MULTIPLIER, dtype=np.uint64)
+        _inverse_powers = np.full(size, inverse, dtype=np.uint64)
+        _powers[0] = _inverse_powers[0] = 1
+        np.multiply.accumulate(_powers, out=_powers)
+        np.multiply.accumulate(_inverse_powers, out=_inverse_powers)
+    return _powers[:count], _inverse_powers[:count]
+
+
+def _prefix_sums(token_hashes: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Q[i] = sum_{j<i} h[j] * M^-j (wrapping), and the powers M^i to undo the scaling"""
+    powers, inverse_powers = _multiplier_powers(len(token_hashes) + 1)
+    prefix = np.zeros(len(token_hashes) + 1, dtype=np.uint64)
+    np.cumsum(token_hashes * inverse_powers[:len(token_hashes)], out=prefix[1:])
+    return prefix, powers
+
+
+def _window_keys(
+    token_hashes: np.ndarray,
+    doc_ends: np.ndarray,
+    max_ngram: int
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Keys of every run of 1..max_ngram tokens
+
+    The key of tokens [s, s+n) is mix(sum h[s+j] * M^(n-1-j) + n). With the
+    prefix sums Q[i] = sum_{j<i} h[j] * M^-j (M is odd, so invertible mod
+    2^64) that is (Q[s+n] - Q[s]) * M^(s+n-1), and all runs come out of one
+    vectorized expression.
+
+    Args:
+        token_hashes: Token hashes of one or more documents laid end to end
+        doc_ends: For every token, the end offset of its document; runs
+                  never cross a document boundary
+        max_ngram: Longest run
+
+    Returns:
+        Tuple of (run starts, run lengths, keys)
+    """
+    total = len(token_hashes)
+    prefix, powers = _prefix_sums(token_hashes)
+    starts = np.arange(total)[:, None]
+    ends = starts + np.arange(1, max_ngram + 1)[None, :]
+    valid = ends <= doc_ends[:, None]
+    starts = np.broadcast_to(starts, ends.shape)[valid]
+    ends = ends[valid]
+    lengths = ends - starts
+    keys = splitmix64((prefix[ends] - prefix[starts]) * powers[ends - 1] + lengths.astype(np.uint64))
+    return starts, lengths, keys
+
+
+def _probe_positions(keys: np.ndarray, bit_mask: np.uint64, steps: np.ndarray) -> np.ndarray:
+    """
+    (keys, steps) filter bit positions, each probe hashed independently
+
+    Double hashing (key + i * stride) is not used: masked to the filter
+    size a stride has only bits / 2 values, so an absent key sharing a
+    stored key's stride walks a shifted copy of that key's probes and
+    reuses most of its bits, which raised the false-positive rate ~200x.
+    """
+    return splitmix64(keys[:, None] ^ (steps[None, :] * _PROBE_MULTIPLIER)) & bit_mask
+
+
+def _value_keys(token_lists: List[List[str]], salt: bytes) -> np.ndarray:
+    """One key per token list: the key of its full token sequence"""
+    lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    hashes = _token_hashes([token for tokens in token_lists for token in tokens], _keyed_hasher(salt))
+    prefix, powers = _prefix_sums(hashes)
+    ends = offsets + lengths
+    return splitmix64((prefix[ends] - prefix[offsets]) * powers[ends - 1] + lengths.astype(np.uint64))
+
+
+def bloom_parameters(items: int, false_positive_rate: float) -> Tuple[int, int]:
+    """
+    (bits, hash_count) for `items` keys at the given per-probe rate
+
+    The hash count is the optimum for the rate; the bit count is rounded
+    up to a power of two so probes reduce with a mask instead of a modulo,
+    which only lowers the realized rate.
+    """
+    items = max(items, 1)
+    optimal_bits = max(64, math.ceil(-items * math.log(false_positive_rate) / (math.log(2) ** 2)))
+    hash_count = max(1, round(optimal_bits / items * math.log(2)))
+    return 1 << (optimal_bits - 1).bit_length(), hash_count
+
+
+class PhiEgressGuard:
+    """
+    Read-only Bloom filter over salted PHI n-gram hashes
+
+    Every PHI value is normalized to tokens and stored as one key for its
+    whole token sequence (values longer than max_ngram tokens by their first
+    max_ngram tokens). A payload is flagged when any run of up to max_ngram
+    of its tokens hashes to a stored key, so a check is one linear pass over
+    the payload's tokens. Matching is whole-token: "987654321" is caught in
+    "ID: 987654321" but not inside "ID987654321", and "123-45-6789" is
+    caught as "123 45 6789".
+
+    The file holds only filter bits and hashing parameters. Token hashes are
+    keyed with a random salt that by default is not written to the file, so
+    a copied guard cannot be probed for candidate PHI without the salt kept
+    elsewhere. store_salt=True embeds it for convenience, which lets anyone
+    holding the file test guesses (names, dates, MRNs) offline. The bits are
+    memory-mapped read-only, so any number of processes share one copy
+    through the page cache.
+
+    Usage:
+        PhiEgressGuard.build("phi.guard", values)
+        guard = PhiEgressGuard("phi.guard")
+        result = guard.check(payload, stage="search_api")
+    """
+
+    def __init__(self, path: str, salt: Optional[bytes] = None):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, stored_salt, salt_stored, hash_count, max_ngram,
+         bits, items, false_positive_rate) = HEADER.unpack_from(self._mmap)
+        if magic != GUARD_MAGIC:
+            self.close()
+            if magic[:6] == GUARD_MAGIC[:6]:
+                raise ValueError(f"{path} uses an older probe scheme; rebuild it")
+            raise ValueError(f"{path} is not a PHI egress guard file")
+        if salt is None:
+            if not salt_stored:
+                self.close()
+                raise ValueError(f"{path} was built without its salt; pass salt= to open it "
+                                 f"(on the command line: --salt or ${SALT_ENV})")
+            salt = stored_salt
+        self.salt = salt
+        self._hasher = _keyed_hasher(salt)
+        self.hash_count = hash_count
+        self.max_ngram = max_ngram
+        self.num_bits = bits
+        self._bit_mask = np.uint64(bits - 1)
+        self.items = items
+        self.false_positive_rate = false_positive_rate
+        self.filter = np.frombuffer(self._mmap, dtype=np.uint8, count=(bits + 7) // 8, offset=HEADER_SIZE)
+        # Per stage: payloads checked and payloads flagged
+        self.stage_stats: Dict[str, Counter] = {}
+
+    def __enter__(self) -> 'PhiEgressGuard':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Release the memory map"""
+        self.filter = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        self._file.close()
+
+    @classmethod
+    def build(
+        cls,
+        path: str,
+        values: Iterable[str],
+        false_positive_rate: float = DEFAULT_FALSE_POSITIVE_RATE,
+        max_ngram: int = DEFAULT_MAX_NGRAM,
+        salt: Optional[bytes] = None,
+        store_salt: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Hash PHI values into a new guard file
+
+        Values are hashed as they stream in; only their 64-bit keys are kept
+        until the filter is sized, never the text.
+
+        Args:
+            path: Guard file to write (replaced atomically)
+            values: PHI strings, from ground truth or analyzer detections
+            false_positive_rate: Designed rate per probed n-gram; a payload
+                                 of T tokens probes about T * max_ngram of them
+            max_ngram: Longest token run stored and probed
+            salt: 16-byte hashing salt (default: random)
+            store_salt: Write the salt into the file, so openers need not
+                        supply it; anyone with the file can then check
+                        guessed PHI values against it
+
+        Returns:
+            Dict with items, bits, hash_count, max_ngram, file_bytes and
+            the salt (hex) when it was not stored
+        """
+        salt = salt if salt is not None else os.urandom(16)
+        if len(salt) != 16:
+            raise ValueError("salt must be 16 bytes")
+
+        keys = []
+        batch: List[List[str]] = []
+        empty = 0
+        for value in values:
+            tokens = normalize_tokens(value)[:max_ngram]
+            if not tokens:
+                empty += 1
+                continue
+            batch.append(tokens)
+            if len(batch) == BUILD_BATCH_SIZE:
+                keys.append(np.unique(_value_keys(batch, salt)))
+                batch = []
+        if batch:
+            keys.append(_value_keys(batch, salt))
+        keys = np.unique(np.concatenate(keys)) if keys else np.zeros(0, dtype=np.uint64)
+
+        bits, hash_count = bloom_parameters(len(keys), false_positive_rate)
+        filter_bits = np.zeros((bits + 7) // 8, dtype=np.uint8)
+        if len(keys):
+            positions = _probe_positions(keys, np.uint64(bits - 1), np.arange(hash_count, dtype=np.uint64))
+            np.bitwise_or.at(filter_bits, positions >> np.uint64(3),
+                             (np.uint8(1) << (positions & np.uint64(7)).astype(np.uint8)))
+        # Realized rate: the chance that hash_count independent probes all
+        # land on set bits, from the filter's actual fill
+        realized = (int(np.unpackbits(filter_bits).sum()) / bits) ** hash_count
+
+        header = HEADER.pack(GUARD_MAGIC, salt if store_salt else bytes(16), store_salt,
+                             hash_count, max_ngram, bits, len(keys), realized)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(header.ljust(HEADER_SIZE, b"\0"))
+            f.write(filter_bits.tobytes())
+        os.replace(tmp_path, path)
+
+        info = {
+            "items": int(len(keys)),
+            "skipped_empty": empty,
+            "bits": bits,
+            "hash_count": hash_count,
+            "max_ngram": max_ngram,
+            "false_positive_rate": realized,
+            "file_bytes": HEADER_SIZE + len(filter_bits),
+        }
+        if not store_salt:
+            info["salt"] = salt.hex()
+        return info
+
+    def _contains(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Boolean membership of each key
+
+        Probes run one hash at a time over the keys still alive. At most
+        half of the filter's bits are set, so each round drops at least half
+        of the absent keys and a check costs about two probes per key; the
+        last few survivors take all their remaining probes in one round
+        rather than in rounds of near-empty array operations.
+        """
+        step = min(FIRST_ROUND_PROBES, self.hash_count)
+        alive = np.flatnonzero(self._bits_set(keys, np.arange(step, dtype=np.uint64)).all(axis=1))
+        while step < self.hash_count and len(alive) >= FINAL_ROUND_THRESHOLD:
+            alive = alive[self._bits_set(keys[alive], np.array([step], dtype=np.uint64))[:, 0]]
+            step += 1
+        if step < self.hash_count and len(alive):
+            remaining = np.arange(step, self.hash_count, dtype=np.uint64)
+            alive = alive[self._bits_set(keys[alive], remaining).all(axis=1)]
+
+        found = np.zeros(len(keys), dtype=bool)
+        found[alive] = True
+        return found
+
+    def _bits_set(self, keys: np.ndarray, steps: np.ndarray) -> np.ndarray:
+        """(keys, steps) booleans: whether each probed filter bit is set"""
+        positions = _probe_positions(keys, self._bit_mask, steps)
+        bits = self.filter[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)
+        return (bits & 1).astype(bool)
+
+    def _scan(self, token_lists: List[List[str]]) -> List[List[Tuple[int, int]]]:
+        """Flagged (token_start, token_count) spans per token list"""
+        spans: List[List[Tuple[int, int]]] = [[] for _ in token_lists]
+        lengths = np.array([len(tokens) for tokens in token_lists], dtype=np.int64)
+        if not lengths.sum():
+            return spans
+        ends = np.cumsum(lengths)
+        offsets = ends - lengths
+        doc_ends = np.repeat(ends, lengths)
+        hashes = _token_hashes([token for tokens in token_lists for token in tokens], self._hasher)
+        starts, run_lengths, keys = _window_keys(hashes, doc_ends, self.max_ngram)
+
+        found = self._contains(keys)
+        if found.any():
+            docs = np.searchsorted(ends, starts[found], side="right")
+            for doc, start, n in zip(docs.tolist(), starts[found].tolist(), run_lengths[found].tolist()):
+                spans[doc].append((start - int(offsets[doc]), n))
+        for doc_spans in spans:
+            doc_spans.sort()
+        return spans
+
+    def _result(self, spans: List[Tuple[int, int]], stage: Optional[str]) -> Dict[str, Any]:
+        stats = self.stage_stats.setdefault(stage or "default", Counter())
+        stats["checked"] += 1
+        if spans:
+            stats["flagged"] += 1
+        return {
+            "stage": stage,
+            "leaked_ngram_count": len(spans),
+            "leaked_spans": [{"token_start": start, "token_count": n} for start, n in spans],
+            "status": "LEAK_DETECTED" if spans else "NO_LEAK",
+        }
+
+    def check(self, payload: str, stage: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Check one outbound payload
+
+        Args:
+            payload: Text about to leave the stage
+            stage: Pipeline stage name for stage_stats
+
+        Returns:
+            Dict with stage, leaked_ngram_count, leaked_spans (token
+            positions in normalize_tokens(payload)) and status
+        """
+        return self._result(self._scan([normalize_tokens(payload)])[0], stage)
+
+    def check_many(self, payloads: List[str], stage: Optional[str] = None) -> List[Dict[str, Any]]:
+        """check() over a batch of payloads in one vectorized pass"""
+        all_spans = self._scan([normalize_tokens(payload) for payload in payloads])
+        return [self._result(spans, stage) for spans in all_spans]
+
+    def stage_report(self) -> Dict[str, Dict[str, Any]]:
+        """Checked/flagged counts and flag rate per stage"""
+        return {
+            stage: {
+                "checked": stats["checked"],
+                "flagged": stats["flagged"],
+                "flag_rate": stats["flagged"] / stats["checked"] if stats["checked"] else 0,
+            }
+            for stage, stats in self.stage_stats.items()
+        }
+
+
+def iter_phi_values(source: str, path: str) -> Iterable[str]:
+    """
+    Stream PHI strings for a guard
+
+    Args:
+        source: "dataset" (PHI_TAGS values), "csv" (phi_entities values of
+                positive_queries.csv) or "traces" (text of the analyzer's
+                detections in a trace directory or trace store)
+        path: Dataset file, CSV file or trace location
+    """
+    if source == "dataset":
+        with DatasetReader(path) as reader:
+            for record in reader.iter_queries():
+                for tag in record['phi_entities']:
+                    if 'value' in tag:
+                        yield tag['value']
+    elif source == "csv":
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                for entity in json.loads(row.get('phi_entities') or '[]'):
+                    yield entity['value']
+    elif source == "traces":
+        for trace in load_trace_records([path]).values():
+            for entity in trace.get("presidio_entities_detected", []):
+                yield entity["text"]
+    else:
+        raise ValueError(f"Unknown PHI source: {source}")
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Hashed PHI egress guard for pipeline stage outputs")
+    parser.add_argument("--guard", default=os.path.join(data_dir, "phi_egress.guard"),
+                        help="Guard file (default: %(default)s)")
+    parser.add_argument("--salt", default=os.environ.get(SALT_ENV),
+                        help=f"Salt as hex (default: ${SALT_ENV}); build generates one when omitted")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Hash PHI values into a guard file")
+    build_parser.add_argument("--source", choices=["dataset", "csv", "traces"], default="dataset",
+                              help="Where PHI values come from (default: %(default)s)")
+    build_parser.add_argument("--input", default=os.path.join(data_dir, "synthetic_dataset.txt"),
+                              help="Dataset, positive_queries.csv or trace location (default: %(default)s)")
+    build_parser.add_argument("--fp-rate", type=float, default=DEFAULT_FALSE_POSITIVE_RATE,
+                              help="False-positive rate per probed n-gram (default: %(default)s)")
+    build_parser.add_argument("--max-ngram", type=int, default=DEFAULT_MAX_NGRAM,
+                              help="Longest token run stored and probed (default: %(default)s)")
+    build_parser.add_argument("--store-salt", action="store_true",
+                              help="Write the salt into the guard file. INSECURE: anyone with the "
+                                   "file can then test guessed PHI values against it offline")
+
+    check_parser = subparsers.add_parser("check", help="Check payloads, one per line")
+    check_parser.add_argument("payloads", help="Text file with one outbound payload per line")
+    check_parser.add_argument("--stage", default=None, help="Stage name to report under")
+    check_parser.add_argument("--batch-size", type=int, default=256,
+                              help="Payloads per vectorized check (default: %(default)s)")
+    check_parser.add_argument("--show", type=int, default=10,
+                              help="Print the line numbers of up to this many flagged payloads")
+    args = parser.parse_args()
+    salt = bytes.fromhex(args.salt) if args.salt else None
+
+    if args.command == "build":
+        print(f"Hashing {args.source} PHI from {args.input}...")
+        started = time.perf_counter()
+        info = PhiEgressGuard.build(
+            args.guard, iter_phi_values(args.source, args.input),
+            args.fp_rate, args.max_ngram, salt, store_salt=args.store_salt
+        )
+        print(f"✓ {info['items']:,} distinct PHI keys in {time.perf_counter() - started:.1f}s "
+              f"-> {args.guard} ({info['file_bytes']:,} bytes, {info['hash_count']} hashes)")
+        print(f"  False-positive rate per probe: {info['false_positive_rate']:.2e}")
+        if info["skipped_empty"]:
+            print(f"  Skipped {info['skipped_empty']} values with no tokens after normalization")
+        if "salt" in info and not args.salt:
+            print(f"  Salt (not stored; keep it apart from the file and pass --salt or ${SALT_ENV} "
+                  f"to check): {info['salt']}")
+        elif args.store_salt:
+            print("  WARNING: the salt is stored in the guard file; treat the file as PHI")
+        return
+
+    try:
+        guard = PhiEgressGuard(args.guard, salt)
+    except ValueError as error:
+        parser.error(str(error))
+    with guard:
+        with open(args.payloads, 'r', encoding='utf-8') as f:
+            payloads = [line.rstrip("\n") for line in f]
+        started = time.perf_counter()
+        flagged = []
+        for batch_start in range(0, len(payloads), args.batch_size):
+            batch = payloads[batch_start:batch_start + args.batch_size]
+            for offset, result in enumerate(guard.check_many(batch, args.stage)):
+                if result["status"] == "LEAK_DETECTED":
+                    flagged.append(batch_start + offset + 1)
+        elapsed = time.perf_counter() - started
+        print(f"✓ {len(payloads):,} payloads in {elapsed:.2f}s ({len(payloads) / max(elapsed, 1e-9):,.0f} checks/sec)")
+        print(f"  Flagged: {len(flagged):,}")
+        if flagged[:args.show]:
+            print(f"  First flagged lines: {', '.join(str(n) for n in flagged[:args.show])}")
+        json.dump(guard.stage_report(), sys.stdout, indent=2)
+        print()
+
+
+if __name__ == "__main__":
+    main()
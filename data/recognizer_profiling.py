@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+Per-Recognizer Profiling for the Presidio Analyzer
+Wraps every recognizer in an analyzer registry to time each call per query,
+rolls the timings up across a run and writes collapsed-stack flame graph input
+"""
+
+import heapq
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from presidio_analyzer import AnalyzerEngine, PatternRecognizer
+
+NLP_ENGINE_FRAME = "nlp_engine"
+OVERHEAD_FRAME = "engine_overhead"
+
+
+class _TimedRegex:
+    """Stand-in for a compiled pattern regex that times finditer"""
+
+    def __init__(self, compiled: Any, record: Callable[[float], None]):
+        self.compiled = compiled
+        self.record = record
+
+    def finditer(self, *args: Any, **kwargs: Any) -> Iterator[Any]:
+        started = time.perf_counter()
+        matches = self.compiled.finditer(*args, **kwargs)
+        self.record(time.perf_counter() - started)
+        while True:
+            started = time.perf_counter()
+            try:
+                match = next(matches)
+            except StopIteration:
+                self.record(time.perf_counter() - started)
+                return
+            self.record(time.perf_counter() - started)
+            yield match
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.compiled, name)
+
+
+class RecognizerProfiler:
+    """
+    Times the NLP engine, every recognizer and every regex pattern per query
+
+    Each analyzer.analyze call produces one profile, appended to
+    self.profiles in call order:
+
+        {
+            "total_ms": ...,            analyze wall time plus its NLP time
+            "nlp_engine_ms": ...,       spaCy pipeline for this text
+            "engine_overhead_ms": ...,  context enhancement, dedup, filtering
+            "recognizers": {name: {"calls", "total_ms", "max_ms", "results",
+                                   "patterns": {pattern_name: ms}}}
+        }
+
+    With nlp_engine.process_batch, spaCy processes texts in nlp.pipe
+    batches, so the first text of each batch carries that batch's NLP cost.
+    """
+
+    def __init__(self):
+        self.profiles: List[Dict[str, Any]] = []
+        self._current: Optional[Dict[str, Any]] = None
+        self._pending_nlp = 0.0
+
+    def instrument(self, analyzer: AnalyzerEngine) -> AnalyzerEngine:
+        """Wrap the analyzer, its NLP engine and its registry recognizers in place"""
+        for recognizer in analyzer.registry.recognizers:
+            self._wrap_recognizer(recognizer)
+        self._wrap_nlp_engine(analyzer.nlp_engine)
+
+        original_analyze = analyzer.analyze
+
+        def profiled_analyze(*args: Any, **kwargs: Any) -> Any:
+            self._current = {
+                "batch_nlp_seconds": self._pending_nlp,
+                "inline_nlp_seconds": 0.0,
+                "recognizers": {},
+            }
+            self._pending_nlp = 0.0
+            started = time.perf_counter()
+            try:
+                return original_analyze(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                self.profiles.append(self._finish(self._current, elapsed))
+                self._current = None
+
+        analyzer.analyze = profiled_analyze
+        return analyzer
+
+    def take_profiles(self) -> List[Dict[str, Any]]:
+        """Return the profiles recorded since the last call and clear them"""
+        profiles, self.profiles = self.profiles, []
+        return profiles
+
+    def _recognizer_entry(self, name: str) -> Optional[Dict[str, Any]]:
+        if self._current is None:
+            return None
+        return self._current["recognizers"].setdefault(
+            name, {"calls": 0, "seconds": 0.0, "max_seconds": 0.0, "results": 0, "patterns": {}}
+        )
+
+    def _wrap_recognizer(self, recognizer: Any) -> None:
+        name = recognizer.name
+        original = recognizer.analyze
+
+        if isinstance(recognizer, PatternRecognizer):
+            # One call populates each pattern's compiled regex so it can be wrapped
+            original("warm up 123456", entities=recognizer.supported_entities, nlp_artifacts=None)
+            for pattern in recognizer.patterns:
+                if getattr(pattern, "compiled_regex", None) is None:
+                    continue
+
+                def record_pattern(seconds: float, pattern_name: str = pattern.name) -> None:
+                    entry = self._recognizer_entry(name)
+                    if entry is not None:
+                        entry["patterns"][pattern_name] = entry["patterns"].get(pattern_name, 0.0) + seconds
+
+                pattern.compiled_regex = _TimedRegex(pattern.compiled_regex, record_pattern)
+
+        def profiled_recognizer_analyze(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            results = original(*args, **kwargs)
+            elapsed = time.perf_counter() - started
+            entry = self._recognizer_entry(name)
+            if entry is not None:
+                entry["calls"] += 1
+                entry["seconds"] += elapsed
+                entry["max_seconds"] = max(entry["max_seconds"], elapsed)
+                entry["results"] += len(results or [])
+            return results
+
+        recognizer.analyze = profiled_recognizer_analyze
+
+    def _wrap_nlp_engine(self, nlp_engine: Any) -> None:
+        original_process_text = nlp_engine.process_text
+        original_process_batch = nlp_engine.process_batch
+
+        def profiled_process_text(*args: Any, **kwargs: Any) -> Any:
+            started = time.perf_counter()
+            try:
+                return original_process_text(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                if self._current is not None:
+                    self._current["inline_nlp_seconds"] += elapsed
+                else:
+                    self._pending_nlp += elapsed
+
+        def profiled_process_batch(*args: Any, **kwargs: Any) -> Iterator[Any]:
+            outputs = iter(original_process_batch(*args, **kwargs))
+            while True:
+                started = time.perf_counter()
+                try:
+                    output = next(outputs)
+                except StopIteration:
+                    return
+                # Charged to the analyze call that consumes this output
+                self._pending_nlp += time.perf_counter() - started
+                yield output
+
+        nlp_engine.process_text = profiled_process_text
+        nlp_engine.process_batch = profiled_process_batch
+
+    @staticmethod
+    def _finish(current: Dict[str, Any], analyze_seconds: float) -> Dict[str, Any]:
+        """Convert one query's raw timings to the millisecond profile format"""
+        # process_text runs inside analyze; batched NLP time was spent before it
+        nlp_seconds = current["batch_nlp_seconds"] + current["inline_nlp_seconds"]
+        total_seconds = analyze_seconds + current["batch_nlp_seconds"]
+        recognizers = {}
+        recognizer_seconds = 0.0
+        for name, entry in current["recognizers"].items():
+            recognizer_seconds += entry["seconds"]
+            recognizers[name] = {
+                "calls": entry["calls"],
+                "total_ms": round(entry["seconds"] * 1000, 4),
+                "max_ms": round(entry["max_seconds"] * 1000, 4),
+                "results": entry["results"],
+                "patterns": {
+                    pattern_name: round(seconds * 1000, 4)
+                    for pattern_name, seconds in entry["patterns"].items()
+                },
+            }
+        return {
+            "total_ms": round(total_seconds * 1000, 4),
+            "nlp_engine_ms": round(nlp_seconds * 1000, 4),
+            "engine_overhead_ms": round(max(0.0, total_seconds - nlp_seconds - recognizer_seconds) * 1000, 4),
+            "recognizers": recognizers,
+        }
+
+
+class RecognizerProfileTotals:
+    """
+    Running roll-up of per-query recognizer profiles
+
+    Sums calls, time and results per recognizer (and per pattern) across
+    queries, keeps the per-call maximum, and remembers the slowest queries
+    for collapsed-stack output.
+    """
+
+    def __init__(self, keep_hottest: int = 20):
+        self.keep_hottest = keep_hottest
+        self.queries = 0
+        self.total_ms = 0.0
+        self.nlp_engine_ms = 0.0
+        self.engine_overhead_ms = 0.0
+        self.recognizers: Dict[str, Dict[str, Any]] = {}
+        self._hottest: List[Tuple[float, int, str, Dict[str, Any]]] = []
+
+    def add(self, query_id: str, profile: Optional[Dict[str, Any]]) -> None:
+        """Fold one query's profile into the totals"""
+        if not profile:
+            return
+        self.queries += 1
+        self.total_ms += profile["total_ms"]
+        self.nlp_engine_ms += profile["nlp_engine_ms"]
+        self.engine_overhead_ms += profile["engine_overhead_ms"]
+
+        for name, entry in profile["recognizers"].items():
+            totals = self.recognizers.setdefault(
+                name, {"calls": 0, "total_ms": 0.0, "max_ms": 0.0, "results": 0, "patterns": {}}
+            )
+            totals["calls"] += entry["calls"]
+            totals["total_ms"] += entry["total_ms"]
+            totals["max_ms"] = max(totals["max_ms"], entry["max_ms"])
+            totals["results"] += entry["results"]
+            for pattern_name, ms in entry["patterns"].items():
+                totals["patterns"][pattern_name] = totals["patterns"].get(pattern_name, 0.0) + ms
+
+        if self.keep_hottest > 0:
+            item = (profile["total_ms"], self.queries, str(query_id), profile)
+            if len(self._hottest) < self.keep_hottest:
+                heapq.heappush(self._hottest, item)
+            else:
+                heapq.heappushpop(self._hottest, item)
+
+    def summary(self) -> Dict[str, Any]:
+        """Aggregate section for aggregate_summary.json, slowest recognizers first"""
+        recognizers = {}
+        for name, totals in sorted(self.recognizers.items(), key=lambda item: -item[1]["total_ms"]):
+            recognizers[name] = {
+                "calls": totals["calls"],
+                "total_ms": round(totals["total_ms"], 3),
+                "mean_ms": round(totals["total_ms"] / totals["calls"], 4) if totals["calls"] else 0.0,
+                "max_ms": round(totals["max_ms"], 4),
+                "results": totals["results"],
+                "share_of_analysis": round(totals["total_ms"] / self.total_ms, 4) if self.total_ms else 0.0,
+            }
+            if totals["patterns"]:
+                recognizers[name]["patterns_ms"] = {
+                    pattern_name: round(ms, 3)
+                    for pattern_name, ms in sorted(totals["patterns"].items(), key=lambda item: -item[1])
+                }
+        return {
+            "queries_profiled": self.queries,
+            "total_ms": round(self.total_ms, 3),
+            "nlp_engine_ms": round(self.nlp_engine_ms, 3),
+            "engine_overhead_ms": round(self.engine_overhead_ms, 3),
+            "recognizers": recognizers,
+            "hottest_queries": [
+                {"query_id": query_id, "total_ms": total_ms}
+                for total_ms, _, query_id, _ in sorted(self._hottest, reverse=True)
+            ],
+        }
+
+    def write_collapsed_stacks(self, output_file: str) -> int:
+        """
+        Write the hottest queries in collapsed-stack format
+
+        One line per frame path with its self time in microseconds, e.g.
+        "query_17;MedicalRecordNumberRecognizer;MRN_PATTERN_1 42", ready for
+        flamegraph.pl or speedscope.
+
+        Returns:
+            Number of queries written
+        """
+        hottest = sorted(self._hottest, reverse=True)
+        with open(output_file, 'w', encoding='utf-8') as f:
+            for _, _, query_id, profile in hottest:
+                root = f"query_{query_id}"
+                lines = [
+                    (f"{root};{NLP_ENGINE_FRAME}", profile["nlp_engine_ms"]),
+                    (f"{root};{OVERHEAD_FRAME}", profile["engine_overhead_ms"]),
+                ]
+                for name, entry in profile["recognizers"].items():
+                    pattern_ms = sum(entry["patterns"].values())
+                    lines.append((f"{root};{name}", max(0.0, entry["total_ms"] - pattern_ms)))
+                    for pattern_name, ms in entry["patterns"].items():
+                        lines.append((f"{root};{name};{pattern_name}", ms))
+                for stack, ms in lines:
+                    microseconds = int(round(ms * 1000))
+                    if microseconds > 0:
+                        f.write(f"{stack.replace(' ', '_')} {microseconds}\n")
+        return len(hottest)
@@ -5,15 +5,40 @@ Evaluates Presidio on synthetic PHI dataset with trace logging
 Matches GPT-4o trace structure for comparison
 """
 
+import argparse
 import json
 import csv
+import collections
+import itertools
+import multiprocessing
 import os
 import re
 from datetime import datetime
-from typing import List, Dict, Any, Tuple
-from presidio_analyzer import AnalyzerEngine, Pattern, PatternRecognizer
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig
+from typing import List, Dict, Any, Iterable, Iterator, Optional, Tuple
+from presidio_analyzer import AnalyzerEngine, Pattern, PatternRecognizer, RecognizerResult
+from analysis_cache import AnalysisCache, DEFAULT_MAX_BYTES
+from detection_cascade import (
+    DEFAULT_UNCERTAIN_BAND,
+    DetectionCascade,
+    add_cascade_stats,
+    build_detection_cascade,
+    summarize_cascade_stats,
+)
+from entity_batch import EntityBatch, QueryEntities
+from eval_checkpoint import DEFAULT_CHECKPOINT_EVERY, RunCheckpoint, read_trace, write_json_atomic
+from eval_shards import DEFAULT_STALE_AFTER, iter_shard, parse_shard, shard_label, shard_runs, write_partial
+from leak_detection import find_phi_leaks
+from recognizer_profiling import RecognizerProfiler, RecognizerProfileTotals
+from span_redactor import SpanRedactor
+from trace_store import TraceStore
+
+
+# Analyzer settings recorded in every trace and folded into the cache key
+ANALYZER_CONFIG = {
+    "language": "en",
+    "score_threshold": 0.35,
+    "custom_recognizers": ["MedicalRecordNumberRecognizer", "UniqueIdentifierRecognizer"]
+}
 
 
 class MedicalRecordNumberRecognizer(PatternRecognizer):
@@ -56,32 +81,40 @@ def initialize_presidio_analyzer() -> AnalyzerEngine:
     return analyzer
 
 
+# Presidio entity types and the HIPAA PHI categories they are reported as
+PRESIDIO_TO_HIPAA = {
+    "PERSON": "NAME",
+    "LOCATION": "GEOGRAPHIC_LOCATION",
+    "GPE": "GEOGRAPHIC_LOCATION",  # Geopolitical entity
+    "DATE_TIME": "DATE",
+    "EMAIL_ADDRESS": "EMAIL_ADDRESS",
+    "PHONE_NUMBER": "PHONE_NUMBER",
+    "US_SSN": "SOCIAL_SECURITY_NUMBER",
+    "MEDICAL_LICENSE": "CERTIFICATE_LICENSE_NUMBER",
+    "URL": "WEB_URL",
+    "IP_ADDRESS": "IP_ADDRESS",
+    "MEDICAL_RECORD_NUMBER": "MEDICAL_RECORD_NUMBER",
+    "UNIQUE_IDENTIFIER": "UNIQUE_IDENTIFIER",
+    "CREDIT_CARD": "ACCOUNT_NUMBER",
+    "US_BANK_NUMBER": "ACCOUNT_NUMBER",
+    "CRYPTO": "UNIQUE_IDENTIFIER",
+}
+
+
 def map_presidio_entity_to_hipaa(entity_type: str) -> str:
     """Map Presidio entity types to HIPAA PHI categories"""
-    mapping = {
-        "PERSON": "NAME",
-        "LOCATION": "GEOGRAPHIC_LOCATION",
-        "GPE": "GEOGRAPHIC_LOCATION",  # Geopolitical entity
-        "DATE_TIME": "DATE",
-        "EMAIL_ADDRESS": "EMAIL_ADDRESS",
-        "PHONE_NUMBER": "PHONE_NUMBER",
-        "US_SSN": "SOCIAL_SECURITY_NUMBER",
-        "MEDICAL_LICENSE": "CERTIFICATE_LICENSE_NUMBER",
-        "URL": "WEB_URL",
-        "IP_ADDRESS": "IP_ADDRESS",
-        "MEDICAL_RECORD_NUMBER": "MEDICAL_RECORD_NUMBER",
-        "UNIQUE_IDENTIFIER": "UNIQUE_IDENTIFIER",
-        "CREDIT_CARD": "ACCOUNT_NUMBER",
-        "US_BANK_NUMBER": "ACCOUNT_NUMBER",
-        "CRYPTO": "UNIQUE_IDENTIFIER",
-    }
-    return mapping.get(entity_type, entity_type)
+    return PRESIDIO_TO_HIPAA.get(entity_type, entity_type)
+
+
+def initialize_presidio_redactor() -> SpanRedactor:
+    """Redaction engine with a [REDACTED_<HIPAA>] token precomputed per known entity type"""
+    return SpanRedactor(map_presidio_entity_to_hipaa, PRESIDIO_TO_HIPAA)
 
 
 def anonymize_with_presidio(
     text: str,
     analyzer: AnalyzerEngine,
-    anonymizer: AnonymizerEngine
+    redactor: SpanRedactor
 ) -> Tuple[str, List[Dict[str, Any]]]:
     """
     Analyze and anonymize text using Presidio
@@ -94,9 +127,136 @@ def anonymize_with_presidio(
         text=text,
         language="en",
         entities=None,  # Detect all entity types
-        score_threshold=0.35  # Lower threshold to catch more potential PHI
+        score_threshold=ANALYZER_CONFIG["score_threshold"]  # Lower threshold to catch more potential PHI
+    )
+
+    return redact_analyzer_results(text, analyzer_results, redactor)
+
+
+def analyze_batch_with_presidio(
+    texts: List[str],
+    analyzer: AnalyzerEngine,
+    batch_size: int = 32,
+    cache: Optional[AnalysisCache] = None,
+    score_threshold: float = ANALYZER_CONFIG["score_threshold"]
+) -> List[List[RecognizerResult]]:
+    """
+    Analyze a list of texts, running the spaCy stage once per batch
+
+    The NLP engine processes the whole list with nlp.pipe, then every
+    recognizer (spaCy, built-in patterns, custom medical patterns) runs on
+    the precomputed NLP artifacts. Results are identical to calling
+    analyzer.analyze on each text.
+
+    Args:
+        texts: Query texts to analyze
+        analyzer: Initialized Presidio analyzer
+        batch_size: Number of texts per nlp.pipe batch
+        cache: Analysis cache; only texts it misses are analyzed. Its
+               analyzer config must carry the same score_threshold.
+        score_threshold: Minimum score kept (0.0 keeps every candidate span)
+
+    Returns:
+        List of analyzer results, one list per input text
+    """
+    if cache is not None:
+        batch_results = cache.get_many(texts)
+        missing = [i for i, results in enumerate(batch_results) if results is None]
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            analyzed = analyze_batch_with_presidio(
+                missing_texts, analyzer, batch_size, score_threshold=score_threshold
+            )
+            cache.put_many(missing_texts, analyzed)
+            for i, results in zip(missing, analyzed):
+                batch_results[i] = results
+        return batch_results
+
+    batch_results = []
+    nlp_batches = analyzer.nlp_engine.process_batch(
+        texts, language="en", batch_size=batch_size
     )
+    for text, nlp_artifacts in nlp_batches:
+        batch_results.append(analyzer.analyze(
+            text=text,
+            language="en",
+            entities=None,
+            score_threshold=score_threshold,
+            nlp_artifacts=nlp_artifacts
+        ))
+    return batch_results
+
+
+def anonymize_batch_with_presidio(
+    texts: List[str],
+    analyzer: AnalyzerEngine,
+    redactor: SpanRedactor,
+    batch_size: int = 32,
+    cache: Optional[AnalysisCache] = None,
+    cascade: Optional[DetectionCascade] = None
+) -> List[Tuple[str, List[Dict[str, Any]]]]:
+    """
+    Batched equivalent of anonymize_with_presidio
+
+    With a cascade, its tiers replace the analyzer pass (see detection_cascade.py).
+
+    Returns:
+        List of (anonymized_text, detected_entities), one per input text
+    """
+    batch_results = _analyze_texts(texts, analyzer, batch_size, cache, cascade)
+    return [
+        redact_analyzer_results(text, analyzer_results, redactor)
+        for text, analyzer_results in zip(texts, batch_results)
+    ]
 
+
+def anonymize_batch_columnar(
+    texts: List[str],
+    analyzer: AnalyzerEngine,
+    redactor: SpanRedactor,
+    batch_size: int = 32,
+    cache: Optional[AnalysisCache] = None,
+    cascade: Optional[DetectionCascade] = None
+) -> Tuple[List[str], EntityBatch]:
+    """
+    anonymize_batch_with_presidio with the detected entities kept columnar
+
+    Returns:
+        Tuple of (anonymized texts, EntityBatch holding one query per input text)
+    """
+    batch_results = _analyze_texts(texts, analyzer, batch_size, cache, cascade)
+    entities = EntityBatch(map_presidio_entity_to_hipaa)
+    anonymized_texts = []
+    for text, analyzer_results in zip(texts, batch_results):
+        entities.add_query(text, analyzer_results)
+        anonymized_texts.append(redactor.redact(text, analyzer_results))
+    return anonymized_texts, entities
+
+
+def _analyze_texts(
+    texts: List[str],
+    analyzer: AnalyzerEngine,
+    batch_size: int,
+    cache: Optional[AnalysisCache],
+    cascade: Optional[DetectionCascade]
+) -> List[List[RecognizerResult]]:
+    """Analyzer results per text, from the cascade tiers when one is given"""
+    if cascade is not None:
+        return cascade.analyze_batch(texts, batch_size)
+    return analyze_batch_with_presidio(texts, analyzer, batch_size, cache)
+
+
+def redact_analyzer_results(
+    text: str,
+    analyzer_results: List[RecognizerResult],
+    redactor: SpanRedactor
+) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Build the detected entity list and the redacted text from analyzer results
+
+    Returns:
+        Tuple of (anonymized_text, detected_entities)
+    """
     # Convert results to detailed entity list
     detected_entities = []
     for result in analyzer_results:
@@ -110,23 +270,207 @@ def anonymize_with_presidio(
             "recognizer": result.recognition_metadata.get("recognizer_name", "Unknown")
         })
 
-    # Create operator config for anonymization
-    operators = {}
-    for result in analyzer_results:
-        hipaa_type = map_presidio_entity_to_hipaa(result.entity_type)
-        operators[result.entity_type] = OperatorConfig(
-            "replace",
-            {"new_value": f"[REDACTED_{hipaa_type}]"}
+    # Splice [REDACTED_<HIPAA>] tokens over the resolved spans
+    return redactor.redact(text, analyzer_results), detected_entities
+
+
+# Per-process Presidio engines, built once by _init_worker in each pool worker
+_worker_analyzer = None
+_worker_redactor = None
+_worker_cache = None
+_worker_profiler = None
+_worker_cascade = None
+
+
+def _init_worker(
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    profile_recognizers: bool = False,
+    cascade_config: Optional[Dict[str, Any]] = None
+) -> None:
+    """Build warm Presidio engines (and cache connection) once per worker process"""
+    global _worker_analyzer, _worker_redactor, _worker_cache, _worker_profiler, _worker_cascade
+    _worker_analyzer = initialize_presidio_analyzer()
+    _worker_redactor = initialize_presidio_redactor()
+    if cache_path:
+        _worker_cache = AnalysisCache(cache_path, _worker_analyzer, ANALYZER_CONFIG, cache_max_bytes)
+    if profile_recognizers:
+        _worker_profiler = RecognizerProfiler()
+        _worker_profiler.instrument(_worker_analyzer)
+    if cascade_config is not None:
+        _worker_cascade = build_detection_cascade(
+            _worker_analyzer, cascade_config, ANALYZER_CONFIG["score_threshold"]
         )
 
-    # Anonymize
-    anonymized_result = anonymizer.anonymize(
-        text=text,
-        analyzer_results=analyzer_results,
-        operators=operators
+
+def _anonymize_chunk_in_worker(
+    texts: List[str]
+) -> Tuple[
+    Tuple[List[str], EntityBatch],
+    Optional[Dict[str, int]],
+    Optional[List[Dict[str, Any]]],
+    Optional[Dict[str, Any]]
+]:
+    """
+    Anonymize one chunk of queries with the worker's warm engines
+
+    Returns:
+        Tuple of ((anonymized texts, entity batch), cache stats or None,
+        recognizer profiles or None, cascade routing stats or None)
+    """
+    results = anonymize_batch_columnar(
+        texts, _worker_analyzer, _worker_redactor, batch_size=len(texts),
+        cache=_worker_cache, cascade=_worker_cascade
     )
+    cache_stats = _worker_cache.take_stats() if _worker_cache is not None else None
+    profiles = _worker_profiler.take_profiles() if _worker_profiler is not None else None
+    routing = _worker_cascade.take_stats() if _worker_cascade is not None else None
+    return results, cache_stats, profiles, routing
+
+
+def _chunked(items: Iterable[Any], size: int) -> Iterator[List[Any]]:
+    """Yield consecutive lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def iter_anonymized(
+    queries: Iterable[Dict[str, Any]],
+    workers: int = 1,
+    chunksize: int = 16,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    cache_stats: Optional[Dict[str, int]] = None,
+    recognizer_profiles: Optional[Dict[str, Dict[str, Any]]] = None,
+    max_pending_chunks: Optional[int] = None,
+    cascade: Optional[Dict[str, Any]] = None,
+    cascade_stats: Optional[Dict[str, Any]] = None
+) -> Iterator[Tuple[Dict[str, Any], str, QueryEntities]]:
+    """
+    Stream queries through Presidio, yielding results in input order
+
+    Presidio is initialized once, either here or once per pool worker.
+    Chunks are collected in submission order, so traces and aggregates are
+    produced in the same row order as a serial run. Each chunk of rows is
+    analyzed as one nlp.pipe batch. With workers, at most max_pending_chunks
+    chunks are in flight; the next chunk is read from `queries` only after
+    the caller has taken the oldest one, so memory stays flat however long
+    the input is and however slowly results are consumed. Detected entities
+    stay in one columnar EntityBatch per chunk; each query gets a view of
+    its rows.
+
+    Args:
+        queries: Rows with a 'query_text' key; consumed lazily
+        workers: Number of analyzer processes (1 = serial, in-process)
+        chunksize: Rows per nlp.pipe batch (and per worker task when workers > 1)
+        cache_path: Analysis cache database; cached queries skip the NLP pass
+        cache_max_bytes: Size bound for the analysis cache
+        cache_stats: Dict of hits/misses/evictions/invalidated counters to add to
+        recognizer_profiles: When given, every recognizer is timed and each
+                             query's profile is stored here under its
+                             query_id before the query is yielded
+        max_pending_chunks: Chunks submitted to the pool but not yet
+                            yielded (default: 2 per worker)
+        cascade: Config for build_detection_cascade; when given, queries go
+                 through the regex/NER/LLM tiers instead of the full analyzer
+        cascade_stats: Dict of per-tier routing counters to add to
+
+    Returns:
+        Iterator of (query_row, anonymized_text, QueryEntities)
+    """
+    profile_recognizers = recognizer_profiles is not None
+    if profile_recognizers and cache_path:
+        raise ValueError("Recognizer profiling times real analyzer calls; run it without the analysis cache")
+    if cascade is not None and (cache_path or profile_recognizers):
+        raise ValueError("The detection cascade replaces the analyzer pass; run it without the cache or profiling")
+
+    pool = None
+    cache = None
+    row_chunks = _chunked(queries, chunksize)
+    if workers > 1:
+        print(f"Starting {workers} Presidio worker processes...")
+        pool = multiprocessing.Pool(
+            processes=workers,
+            initializer=_init_worker,
+            initargs=(cache_path, cache_max_bytes, profile_recognizers, cascade)
+        )
+        max_pending = max_pending_chunks or 2 * workers
+
+        # Pool.imap would drain `queries` as fast as its task thread can;
+        # a bounded window of submitted chunks applies backpressure instead
+        def bounded_chunk_results():
+            pending = collections.deque()
+            for rows in row_chunks:
+                texts = [query_row['query_text'] for query_row in rows]
+                pending.append((rows, pool.apply_async(_anonymize_chunk_in_worker, (texts,))))
+                if len(pending) >= max_pending:
+                    oldest_rows, oldest = pending.popleft()
+                    yield oldest_rows, oldest.get()
+            while pending:
+                oldest_rows, oldest = pending.popleft()
+                yield oldest_rows, oldest.get()
+
+        chunk_results = bounded_chunk_results()
+    else:
+        print(f"Initializing Presidio analyzer...")
+        analyzer = initialize_presidio_analyzer()
+        redactor = initialize_presidio_redactor()
+        if cache_path:
+            cache = AnalysisCache(cache_path, analyzer, ANALYZER_CONFIG, cache_max_bytes)
+        profiler = None
+        if profile_recognizers:
+            profiler = RecognizerProfiler()
+            profiler.instrument(analyzer)
+        detection_cascade = None
+        if cascade is not None:
+            detection_cascade = build_detection_cascade(analyzer, cascade, ANALYZER_CONFIG["score_threshold"])
+        chunk_results = (
+            (
+                rows,
+                (
+                    anonymize_batch_columnar(
+                        [query_row['query_text'] for query_row in rows],
+                        analyzer, redactor, batch_size=chunksize, cache=cache,
+                        cascade=detection_cascade
+                    ),
+                    cache.take_stats() if cache is not None else None,
+                    profiler.take_profiles() if profiler is not None else None,
+                    detection_cascade.take_stats() if detection_cascade is not None else None
+                )
+            )
+            for rows in row_chunks
+        )
 
-    return anonymized_result.text, detected_entities
+    try:
+        for rows, (chunk, chunk_cache_stats, chunk_profiles, chunk_routing) in chunk_results:
+            if chunk_cache_stats and cache_stats is not None:
+                for name, count in chunk_cache_stats.items():
+                    cache_stats[name] = cache_stats.get(name, 0) + count
+            if chunk_routing and cascade_stats is not None:
+                add_cascade_stats(cascade_stats, chunk_routing)
+            if chunk_profiles is not None:
+                for query_row, profile in zip(rows, chunk_profiles):
+                    recognizer_profiles[str(query_row['query_id'])] = profile
+            anonymized_texts, entities = chunk
+            for query_row, anonymized_text, detected_entities in zip(rows, anonymized_texts, entities):
+                yield query_row, anonymized_text, detected_entities
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        if cache is not None:
+            cache.close()
+
+
+def iter_csv_rows(csv_file: str) -> Iterator[Dict[str, str]]:
+    """Lazily yield the rows of a query CSV as dicts"""
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
 
 
 def parse_ground_truth_phi(phi_entities_json: str) -> List[Dict[str, Any]]:
@@ -157,31 +501,17 @@ def detect_phi_leaks(
 ) -> Dict[str, Any]:
     """
     Detect if any ground truth PHI leaked into anonymized output
-    """
-    leaked_phi = []
 
-    for entity in ground_truth_entities:
-        phi_value = entity['value']
-
-        # Check if PHI value appears in anonymized output
-        if phi_value.lower() in anonymized_query.lower():
-            leaked_phi.append({
-                "type": entity['type'],
-                "value": phi_value,
-                "start": entity.get('start', -1),
-                "end": entity.get('end', -1)
-            })
-
-    return {
-        "leaked_phi_count": len(leaked_phi),
-        "leaked_phi_details": leaked_phi,
-        "status": "LEAK_DETECTED" if leaked_phi else "NO_LEAK"
-    }
+    Each query has only a handful of PHI values, so find_phi_leaks tests
+    them as case-folded substrings; leak_detection.PhiMatcher is for large
+    value sets reused across many outputs.
+    """
+    return find_phi_leaks(anonymized_query, ground_truth_entities)
 
 
 def calculate_metrics(
     ground_truth_entities: List[Dict[str, Any]],
-    detected_entities: List[Dict[str, Any]],
+    detected_entities: QueryEntities,
     leak_detection: Dict[str, Any]
 ) -> Dict[str, Any]:
     """Calculate recall, precision, F1 score"""
@@ -195,7 +525,7 @@ def calculate_metrics(
     # For precision, count how many detected entities matched ground truth
     # This is an approximation - matching by text value
     gt_values = {e['value'].lower() for e in ground_truth_entities}
-    detected_values = {e['text'].lower() for e in detected_entities}
+    detected_values = {text.lower() for text in detected_entities.texts()}
 
     true_positives = len(gt_values & detected_values)
     total_detected = len(detected_entities)
@@ -224,10 +554,19 @@ def create_trace_file(
     original_query: str,
     ground_truth_entities: List[Dict[str, Any]],
     anonymized_query: str,
-    detected_entities: List[Dict[str, Any]],
-    output_dir: str
+    detected_entities: QueryEntities,
+    output_dir: str,
+    trace_store: Optional[TraceStore] = None,
+    recognizer_profile: Optional[Dict[str, Any]] = None
 ) -> Dict[str, Any]:
-    """Create trace file matching GPT-4o format with Presidio enhancements"""
+    """
+    Create trace file matching GPT-4o format with Presidio enhancements
+
+    The trace is appended to trace_store when one is given, otherwise it is
+    written to output_dir/query_<id>_trace.json. A recognizer_profile from
+    profiling mode is recorded under the same key. Detected entities are
+    turned into the legacy dicts here, for the trace only.
+    """
 
     # Detect leaks
     leak_detection = detect_phi_leaks(original_query, anonymized_query, ground_truth_entities)
@@ -240,32 +579,122 @@ def create_trace_file(
         "query_id": query_id,
         "timestamp": datetime.now().isoformat(),
         "model": "Presidio-2.2.360",
-        "analyzer_config": {
-            "language": "en",
-            "score_threshold": 0.35,
-            "custom_recognizers": ["MedicalRecordNumberRecognizer", "UniqueIdentifierRecognizer"]
-        },
+        "analyzer_config": ANALYZER_CONFIG,
         "original_query": original_query,
         "ground_truth_phi": format_ground_truth_for_trace(ground_truth_entities),
         "ground_truth_phi_count": len(ground_truth_entities),
         "presidio_output": anonymized_query,
-        "presidio_entities_detected": detected_entities,
+        "presidio_entities_detected": detected_entities.to_dicts(),
         "leak_detection": leak_detection,
         "metrics": metrics
     }
+    if recognizer_profile is not None:
+        trace["recognizer_profile"] = recognizer_profile
 
-    # Save trace file
-    trace_file = os.path.join(output_dir, f"query_{query_id}_trace.json")
-    with open(trace_file, 'w', encoding='utf-8') as f:
-        json.dump(trace, f, indent=2, ensure_ascii=False)
+    # Save trace (renamed into place, so a crash never leaves half a file)
+    if trace_store is not None:
+        trace_store.append(trace)
+    else:
+        trace_file = os.path.join(output_dir, f"query_{query_id}_trace.json")
+        write_json_atomic(trace_file, trace, indent=2, ensure_ascii=False)
 
     return trace
 
 
+def update_positive_totals(totals: Dict[str, int], trace: Dict[str, Any]) -> None:
+    """Add one positive query trace to running totals (created empty if needed)"""
+    for name in ("queries", "total_phi", "successfully_redacted", "leaked", "queries_with_leaks"):
+        totals.setdefault(name, 0)
+    totals["queries"] += 1
+    totals["total_phi"] += trace['metrics']['total_phi_entities']
+    totals["successfully_redacted"] += trace['metrics']['successfully_redacted']
+    totals["leaked"] += trace['metrics']['leaked_failures']
+    if trace['leak_detection']['leaked_phi_count'] > 0:
+        totals["queries_with_leaks"] += 1
+
+
+def build_positive_aggregate(totals: Dict[str, int], query_type: str = "positive") -> Dict[str, Any]:
+    """Build the aggregate_summary.json contents from positive query totals"""
+    total_queries = totals.get("queries", 0)
+    total_phi = totals.get("total_phi", 0)
+    total_redacted = totals.get("successfully_redacted", 0)
+    queries_with_leaks = totals.get("queries_with_leaks", 0)
+
+    return {
+        "evaluation_timestamp": datetime.now().isoformat(),
+        "model": "Presidio-2.2.360",
+        "query_type": query_type,
+        "total_queries_processed": total_queries,
+        "total_phi_entities": total_phi,
+        "successfully_redacted": total_redacted,
+        "leaked_phi": totals.get("leaked", 0),
+        "queries_with_leaks": queries_with_leaks,
+        "queries_perfect_redaction": total_queries - queries_with_leaks,
+        "recall": total_redacted / total_phi if total_phi > 0 else 1.0,
+        "perfect_rate": (total_queries - queries_with_leaks) / total_queries if total_queries else 0
+    }
+
+
+def save_aggregate_summary(output_dir: str, aggregate: Dict[str, Any]) -> str:
+    """Write output_dir/aggregate_summary.json and return its path"""
+    os.makedirs(output_dir, exist_ok=True)
+    summary_file = os.path.join(output_dir, "aggregate_summary.json")
+    write_json_atomic(summary_file, aggregate, indent=2)
+    return summary_file
+
+
+def print_positive_summary(aggregate: Dict[str, Any]) -> None:
+    """Print the completion report for a positive query run"""
+    total_queries = aggregate['total_queries_processed']
+    print(f"\n✓ Completed {total_queries} queries")
+    print(f"  Total PHI: {aggregate['total_phi_entities']}")
+    print(f"  Successfully redacted: {aggregate['successfully_redacted']}")
+    print(f"  Leaked: {aggregate['leaked_phi']}")
+    print(f"  Recall: {aggregate['recall']:.2%}")
+    print(f"  Perfect queries: {aggregate['queries_perfect_redaction']}/{total_queries}")
+    if "analysis_cache" in aggregate:
+        cache_stats = aggregate["analysis_cache"]
+        print(f"  Analysis cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    if "detection_cascade" in aggregate:
+        routing = aggregate["detection_cascade"]
+        print(f"  Detection cascade: {routing['mean_ms_per_query']:.3f} ms/query")
+        for tier, tier_stats in routing["tiers"].items():
+            print(f"    {tier:<6} {tier_stats['queries']:>7} queries ({tier_stats['share']:.1%}), "
+                  f"{tier_stats['spans']} spans, {tier_stats['total_ms']:.1f} ms")
+
+
+def report_recognizer_profile(
+    aggregate: Dict[str, Any],
+    profile_totals: RecognizerProfileTotals,
+    flamegraph_file: Optional[str] = None
+) -> None:
+    """Add the recognizer profile roll-up to an aggregate and write the flame graph input"""
+    aggregate["recognizer_profile"] = profile_totals.summary()
+    print(f"  Recognizer profile ({profile_totals.queries} queries, {profile_totals.total_ms:.0f} ms analyzed):")
+    print(f"    {'nlp_engine':<40} {profile_totals.nlp_engine_ms:10.1f} ms")
+    for name, totals in list(aggregate["recognizer_profile"]["recognizers"].items())[:5]:
+        print(f"    {name:<40} {totals['total_ms']:10.1f} ms  ({totals['calls']} calls, max {totals['max_ms']:.2f} ms)")
+    if flamegraph_file:
+        written = profile_totals.write_collapsed_stacks(flamegraph_file)
+        print(f"  Collapsed stacks for the {written} slowest queries written to {flamegraph_file}")
+
+
 def process_queries(
     csv_file: str,
     output_dir: str,
-    query_type: str = "positive"
+    query_type: str = "positive",
+    workers: int = 1,
+    chunksize: int = 16,
+    trace_store: Optional[TraceStore] = None,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    profile_recognizers: bool = False,
+    flamegraph_file: Optional[str] = None,
+    flamegraph_top: int = 20,
+    cascade: Optional[Dict[str, Any]] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    resume: bool = False,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY
 ) -> Dict[str, Any]:
     """
     Process all queries from CSV and generate trace files
@@ -274,45 +703,79 @@ def process_queries(
         csv_file: Path to CSV file with queries
         output_dir: Directory to save trace files
         query_type: "positive" or "negative"
+        workers: Number of analyzer processes (1 = serial, in-process)
+        chunksize: Rows per nlp.pipe batch (and per worker task when workers > 1)
+        trace_store: Sharded store to append traces to instead of one file per query
+        cache_path: Analysis cache database; cached queries skip the NLP pass
+        cache_max_bytes: Size bound for the analysis cache
+        profile_recognizers: Time every recognizer per query (traces get a
+                             recognizer_profile, the aggregate a roll-up)
+        flamegraph_file: Collapsed-stack output for the slowest queries
+        flamegraph_top: Number of slowest queries kept for flamegraph_file
+        cascade: Detection cascade config (see build_detection_cascade); the
+                 aggregate then gets per-tier routing counts and latency
+        shard: (index, count) to evaluate only the queries hashed to that
+               shard; the raw counts then go to a partial summary for
+               eval_shards.py merge instead of aggregate_summary.json
+        resume: Continue from the run's checkpoint (output_dir/checkpoints)
+                and the traces written after it
+        checkpoint_every: Rows between checkpoints (taken at the next
+                          chunk boundary)
 
     Returns:
-        Aggregate statistics
+        Aggregate statistics (of the shard, when sharded)
     """
-    # Initialize Presidio
-    print(f"Initializing Presidio analyzer...")
-    analyzer = initialize_presidio_analyzer()
-    anonymizer = AnonymizerEngine()
-
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
 
-    # Read queries
-    print(f"Loading queries from {csv_file}...")
-    queries = []
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        queries = list(reader)
+    # Stream queries; rows are read only as the analyzer asks for them
+    print(f"Processing {query_type} queries from {csv_file}...")
+    queries = iter_csv_rows(csv_file)
+    if shard is not None:
+        print(f"  Shard {shard[0]}/{shard[1]}")
+        queries = iter_shard(queries, shard)
+
+    cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidated": 0}
+    recognizer_profiles = {} if profile_recognizers else None
+    profile_totals = RecognizerProfileTotals(flamegraph_top) if profile_recognizers else None
+    cascade_stats: Dict[str, Any] = {}
+    totals: Dict[str, int] = {}
+    checkpoint = RunCheckpoint(output_dir, query_type, csv_file, shard, checkpoint_every)
+    state = checkpoint.load() if resume else None
+    if state is None:
+        if resume:
+            print(f"  No checkpoint at {checkpoint.path}; starting from the first row")
+        # Replace any earlier run's checkpoint before the first trace is written
+        checkpoint.save(totals, cache_stats if cache_path else None, cascade_stats)
+    else:
+        totals = state["totals"]
+        cache_stats.update(state["analysis_cache"] or {})
+        cascade_stats = state["detection_cascade"] or {}
+        queries = itertools.islice(queries, state["rows"], None)
+        reconciled, queries = checkpoint.reconcile(
+            queries,
+            lambda query_id: read_trace(output_dir, query_id, trace_store),
+            lambda trace: update_positive_totals(totals, trace)
+        )
+        print(f"  Resuming after row {checkpoint.rows}: {state['rows']} from the checkpoint, "
+              f"{reconciled} from traces written after it")
 
-    print(f"Processing {len(queries)} {query_type} queries...")
+    results = iter_anonymized(
+        queries, workers, chunksize, cache_path, cache_max_bytes, cache_stats, recognizer_profiles,
+        cascade=cascade, cascade_stats=cascade_stats
+    )
 
     # Process each query
-    total_phi = 0
-    total_redacted = 0
-    total_leaked = 0
-    queries_with_leaks = 0
-
-    for i, query_row in enumerate(queries):
+    for i, (query_row, anonymized_text, detected_entities) in enumerate(results):
         query_id = query_row['query_id']
         query_text = query_row['query_text']
         phi_entities_json = query_row.get('phi_entities', '[]')
 
         # Parse ground truth
         ground_truth_entities = parse_ground_truth_phi(phi_entities_json)
-
-        # Anonymize with Presidio
-        anonymized_text, detected_entities = anonymize_with_presidio(
-            query_text, analyzer, anonymizer
-        )
+        recognizer_profile = None
+        if recognizer_profiles is not None:
+            recognizer_profile = recognizer_profiles.pop(str(query_id), None)
 
         # Create trace file
         trace = create_trace_file(
@@ -321,55 +784,136 @@ def process_queries(
             ground_truth_entities,
             anonymized_text,
             detected_entities,
-            output_dir
+            output_dir,
+            trace_store,
+            recognizer_profile
         )
 
         # Aggregate statistics
-        total_phi += trace['metrics']['total_phi_entities']
-        total_redacted += trace['metrics']['successfully_redacted']
-        total_leaked += trace['metrics']['leaked_failures']
-        if trace['leak_detection']['leaked_phi_count'] > 0:
-            queries_with_leaks += 1
+        update_positive_totals(totals, trace)
+        checkpoint.advance(query_id)
+        if profile_totals is not None:
+            profile_totals.add(query_id, recognizer_profile)
+
+        # Checkpoint only at chunk boundaries, where the cache and cascade
+        # counters cover exactly the committed rows
+        if (i + 1) % chunksize == 0 and checkpoint.due():
+            if trace_store is not None:
+                trace_store.flush()
+            checkpoint.save(totals, cache_stats if cache_path else None, cascade_stats)
 
         # Progress
         if (i + 1) % 50 == 0:
-            print(f"  Processed {i + 1}/{len(queries)} queries...")
+            print(f"  Processed {i + 1} queries...")
 
-    # Calculate aggregate metrics
-    recall = total_redacted / total_phi if total_phi > 0 else 1.0
+    if trace_store is not None:
+        trace_store.flush()
+    checkpoint.save(totals, cache_stats if cache_path else None, cascade_stats, complete=True)
 
-    aggregate = {
-        "evaluation_timestamp": datetime.now().isoformat(),
-        "model": "Presidio-2.2.360",
-        "query_type": query_type,
-        "total_queries_processed": len(queries),
-        "total_phi_entities": total_phi,
-        "successfully_redacted": total_redacted,
-        "leaked_phi": total_leaked,
-        "queries_with_leaks": queries_with_leaks,
-        "queries_perfect_redaction": len(queries) - queries_with_leaks,
-        "recall": recall,
-        "perfect_rate": (len(queries) - queries_with_leaks) / len(queries) if queries else 0
-    }
+    # Calculate aggregate metrics
+    aggregate = build_positive_aggregate(totals, query_type)
+    if cache_path:
+        aggregate["analysis_cache"] = cache_stats
+    if cascade is not None:
+        aggregate["detection_cascade"] = summarize_cascade_stats(cascade_stats, cascade)
 
     # Save aggregate summary
-    summary_file = os.path.join(output_dir, "aggregate_summary.json")
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        json.dump(aggregate, f, indent=2)
-
-    print(f"\n✓ Completed {len(queries)} queries")
-    print(f"  Total PHI: {total_phi}")
-    print(f"  Successfully redacted: {total_redacted}")
-    print(f"  Leaked: {total_leaked}")
-    print(f"  Recall: {recall:.2%}")
-    print(f"  Perfect queries: {len(queries) - queries_with_leaks}/{len(queries)}")
+    print_positive_summary(aggregate)
+    if profile_totals is not None:
+        report_recognizer_profile(aggregate, profile_totals, flamegraph_file)
+    if shard is not None:
+        partial_file = write_partial(
+            output_dir, query_type, shard, totals,
+            cache_stats if cache_path else None, cascade_stats, cascade
+        )
+        print(f"  Partial summary written to {partial_file}")
+    else:
+        save_aggregate_summary(output_dir, aggregate)
 
     return aggregate
 
 
 def main():
     """Main execution"""
-    base_dir = "/Users/jacweath/Desktop/safesearch_/data"
+    parser = argparse.ArgumentParser(description="Presidio HIPAA de-identification evaluation")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of analyzer processes (default: 1, serial)")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="Rows per NLP batch / worker task (default: 16)")
+    parser.add_argument("--trace-store", action="store_true",
+                        help="Append traces to a sharded store (<output>/trace_store) "
+                             "instead of one JSON file per query")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database; unchanged queries skip the NLP pass")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Analysis cache size bound in MB (default: %(default)s)")
+    parser.add_argument("--profile-recognizers", action="store_true",
+                        help="Time every recognizer per query and add the roll-up to aggregate_summary.json")
+    parser.add_argument("--flamegraph", default=None,
+                        help="With --profile-recognizers, write collapsed stacks of the slowest queries here")
+    parser.add_argument("--flamegraph-top", type=int, default=20,
+                        help="Slowest queries to include in --flamegraph (default: 20)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Detect with the regex -> NER -> LLM cascade instead of the full analyzer")
+    parser.add_argument("--no-ner-gate", action="store_true",
+                        help="With --cascade, run the NER tier on every query")
+    parser.add_argument("--uncertain-band", type=float, nargs=2, default=list(DEFAULT_UNCERTAIN_BAND),
+                        metavar=("LOW", "HIGH"),
+                        help="With --llm-tier, scores in [LOW, HIGH) escalate a query (default: %(default)s)")
+    parser.add_argument("--llm-tier", action="store_true",
+                        help="With --cascade, ask Azure OpenAI (AZURE_OPENAI_*_4o) about uncertain queries")
+    parser.add_argument("--llm-cache", default=None,
+                        help="With --llm-tier, record/replay LLM answers in this cache (llm_response_cache.py)")
+    parser.add_argument("--llm-cache-mode", choices=("record", "replay", "read-through"), default="read-through",
+                        help="record, replay (offline) or read-through (default: %(default)s)")
+    parser.add_argument("--data-dir", default="/Users/jacweath/Desktop/safesearch_/data",
+                        help="Directory holding positive_queries.csv and Presidio_positive/ (default: %(default)s)")
+    parser.add_argument("--shard", default=None, metavar="i/N",
+                        help="Evaluate only the queries whose query_id hashes to shard i of N and write "
+                             "a partial summary (combine with: eval_shards.py merge)")
+    parser.add_argument("--claim", type=int, default=None, metavar="N",
+                        help="Split into N shards and evaluate every shard no other node has claimed "
+                             "or finished, using lock files under Presidio_positive/claims")
+    parser.add_argument("--stale-after", type=float, default=DEFAULT_STALE_AFTER,
+                        help="With --claim, seconds without heartbeat before a claim is re-run (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint and the traces written after it")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help="Rows between checkpoints of the running totals (default: %(default)s)")
+    args = parser.parse_args()
+    if args.profile_recognizers and args.cache:
+        parser.error("--profile-recognizers times real analyzer calls and cannot be combined with --cache")
+    if args.cascade and (args.cache or args.profile_recognizers):
+        parser.error("--cascade replaces the analyzer pass and cannot be combined with --cache or --profile-recognizers")
+    if args.llm_tier and not args.cascade:
+        parser.error("--llm-tier needs --cascade")
+    if args.llm_cache and not args.llm_tier:
+        parser.error("--llm-cache needs --llm-tier")
+    if args.shard and args.claim:
+        parser.error("--shard and --claim are alternatives")
+    if (args.shard or args.claim) and args.profile_recognizers:
+        parser.error("--profile-recognizers reports per-run roll-ups and cannot be combined with --shard or --claim")
+    if args.claim is not None and args.claim < 1:
+        parser.error("--claim needs at least one shard")
+    if args.resume and args.profile_recognizers:
+        parser.error("--profile-recognizers roll-ups are not checkpointed and cannot be combined with --resume")
+    if args.checkpoint_every < 1:
+        parser.error("--checkpoint-every must be at least 1")
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+    cascade = None
+    if args.cascade:
+        cascade = {
+            "ner_gate": not args.no_ner_gate,
+            "uncertain_band": args.uncertain_band,
+            "llm": args.llm_tier,
+            "llm_cache": args.llm_cache,
+            "llm_cache_mode": args.llm_cache_mode,
+        }
 
     print("=" * 80)
     print("PRESIDIO HIPAA DE-IDENTIFICATION EVALUATION")
@@ -379,23 +923,56 @@ def main():
     print("\n[1/1] POSITIVE QUERIES (PHI-containing)")
     print("-" * 80)
 
-    positive_csv = os.path.join(base_dir, "positive_queries.csv")
-    positive_output = os.path.join(base_dir, "Presidio_positive")
-
-    positive_results = process_queries(
-        csv_file=positive_csv,
-        output_dir=positive_output,
-        query_type="positive"
-    )
-
-    print("\n" + "=" * 80)
-    print("EVALUATION COMPLETE")
-    print("=" * 80)
-    print(f"\nResults saved to: {positive_output}")
-    print(f"  - {positive_results['total_queries_processed']} trace files")
-    print(f"  - aggregate_summary.json")
-    print(f"\nRecall: {positive_results['recall']:.2%}")
-    print(f"Perfect redaction rate: {positive_results['perfect_rate']:.2%}")
+    positive_csv = os.path.join(args.data_dir, "positive_queries.csv")
+    positive_output = os.path.join(args.data_dir, "Presidio_positive")
+
+    for shard in shard_runs(shard, args.claim, [(positive_output, "positive")], args.stale_after):
+        trace_store = None
+        if args.trace_store:
+            # One store per shard: a store has a single writer
+            store_dir = os.path.join(positive_output, "trace_store")
+            if shard is not None:
+                store_dir = os.path.join(store_dir, shard_label(shard))
+            trace_store = TraceStore(store_dir)
+
+        try:
+            positive_results = process_queries(
+                csv_file=positive_csv,
+                output_dir=positive_output,
+                query_type="positive",
+                workers=args.workers,
+                chunksize=args.chunksize,
+                trace_store=trace_store,
+                cache_path=args.cache,
+                cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+                profile_recognizers=args.profile_recognizers,
+                flamegraph_file=args.flamegraph,
+                flamegraph_top=args.flamegraph_top,
+                cascade=cascade,
+                shard=shard,
+                resume=args.resume,
+                checkpoint_every=args.checkpoint_every
+            )
+        finally:
+            if trace_store is not None:
+                trace_store.close()
+
+        print("\n" + "=" * 80)
+        print("EVALUATION COMPLETE" if shard is None else f"SHARD {shard[0]}/{shard[1]} COMPLETE")
+        print("=" * 80)
+        print(f"\nResults saved to: {positive_output}")
+        if trace_store is not None:
+            print(f"  - {positive_results['total_queries_processed']} traces in {trace_store.root_dir} "
+                  f"(export with: trace_store.py {trace_store.root_dir} export <dir>)")
+        else:
+            print(f"  - {positive_results['total_queries_processed']} trace files")
+        if shard is not None:
+            print(f"  - partials/positive_{shard_label(shard)}.json "
+                  f"(merge with: eval_shards.py merge {positive_output})")
+            continue
+        print(f"  - aggregate_summary.json")
+        print(f"\nRecall: {positive_results['recall']:.2%}")
+        print(f"Perfect redaction rate: {positive_results['perfect_rate']:.2%}")
 
 
 if __name__ == "__main__":
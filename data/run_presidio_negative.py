@@ -4,74 +4,26 @@ Presidio Negative Query Evaluation - False Positive Rate Assessment
 Evaluates Presidio on queries with NO PHI to measure over-redaction
 """
 
-import json
-import csv
+import argparse
+import itertools
 import os
 import re
 from datetime import datetime
-from typing import List, Dict, Any
-from presidio_analyzer import AnalyzerEngine, Pattern, PatternRecognizer
-from presidio_anonymizer import AnonymizerEngine
-from presidio_anonymizer.entities import OperatorConfig
-
-
-class MedicalRecordNumberRecognizer(PatternRecognizer):
-    """Custom recognizer for Medical Record Numbers (MRN)"""
-    def __init__(self):
-        patterns = [
-            Pattern("MRN_PATTERN_1", r"\b\d{6,10}\b", 0.5),
-            Pattern("MRN_PATTERN_2", r"\bMRN[:\s]+\d{6,10}\b", 0.9),
-            Pattern("MRN_PATTERN_3", r"\b[A-Z]{2,3}-\d{5,8}\b", 0.7),
-        ]
-        super().__init__(
-            supported_entity="MEDICAL_RECORD_NUMBER",
-            patterns=patterns,
-            name="MedicalRecordNumberRecognizer"
-        )
-
-
-class UniqueIdentifierRecognizer(PatternRecognizer):
-    """Custom recognizer for unique identifiers"""
-    def __init__(self):
-        patterns = [
-            Pattern("ID_PATTERN_1", r"\bID[:\s]+\d{6,12}\b", 0.9),
-            Pattern("ID_PATTERN_2", r"\(ID:\s*\d{6,12}\)", 0.95),
-        ]
-        super().__init__(
-            supported_entity="UNIQUE_IDENTIFIER",
-            patterns=patterns,
-            name="UniqueIdentifierRecognizer"
-        )
-
-
-def initialize_presidio_analyzer() -> AnalyzerEngine:
-    """Initialize Presidio with custom medical recognizers"""
-    analyzer = AnalyzerEngine()
-    analyzer.registry.add_recognizer(MedicalRecordNumberRecognizer())
-    analyzer.registry.add_recognizer(UniqueIdentifierRecognizer())
-    return analyzer
-
-
-def map_presidio_entity_to_hipaa(entity_type: str) -> str:
-    """Map Presidio entity types to HIPAA PHI categories"""
-    mapping = {
-        "PERSON": "NAME",
-        "LOCATION": "GEOGRAPHIC_LOCATION",
-        "GPE": "GEOGRAPHIC_LOCATION",
-        "DATE_TIME": "DATE",
-        "EMAIL_ADDRESS": "EMAIL_ADDRESS",
-        "PHONE_NUMBER": "PHONE_NUMBER",
-        "US_SSN": "SOCIAL_SECURITY_NUMBER",
-        "MEDICAL_LICENSE": "CERTIFICATE_LICENSE_NUMBER",
-        "URL": "WEB_URL",
-        "IP_ADDRESS": "IP_ADDRESS",
-        "MEDICAL_RECORD_NUMBER": "MEDICAL_RECORD_NUMBER",
-        "UNIQUE_IDENTIFIER": "UNIQUE_IDENTIFIER",
-        "CREDIT_CARD": "ACCOUNT_NUMBER",
-        "US_BANK_NUMBER": "ACCOUNT_NUMBER",
-        "CRYPTO": "UNIQUE_IDENTIFIER",
-    }
-    return mapping.get(entity_type, entity_type)
+from typing import Dict, Any, Optional, Tuple
+from analysis_cache import DEFAULT_MAX_BYTES
+from detection_cascade import DEFAULT_UNCERTAIN_BAND, summarize_cascade_stats
+from entity_batch import QueryEntities
+from eval_checkpoint import DEFAULT_CHECKPOINT_EVERY, RunCheckpoint, read_trace, write_json_atomic
+from eval_shards import DEFAULT_STALE_AFTER, iter_shard, parse_shard, shard_label, shard_runs, write_partial
+from recognizer_profiling import RecognizerProfileTotals
+from run_presidio_evaluation import (
+    ANALYZER_CONFIG,
+    iter_anonymized,
+    iter_csv_rows,
+    report_recognizer_profile,
+    save_aggregate_summary,
+)
+from trace_store import TraceStore
 
 
 def detect_false_redactions(
@@ -99,183 +51,380 @@ def detect_false_redactions(
     }
 
 
-def process_negative_queries(csv_file: str, output_dir: str) -> Dict[str, Any]:
+def create_negative_trace(
+    query_id: str,
+    original_query: str,
+    anonymized_query: str,
+    detected_entities: QueryEntities,
+    output_dir: str,
+    trace_store: Optional[TraceStore] = None,
+    recognizer_profile: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    Create the trace for a query with no PHI
+
+    The trace is appended to trace_store when one is given, otherwise it is
+    written to output_dir/query_<id>_trace.json. A recognizer_profile from
+    profiling mode is recorded under the same key.
+    """
+    # Detect false redactions
+    false_redaction_check = detect_false_redactions(original_query, anonymized_query)
+
+    trace = {
+        "query_id": query_id,
+        "timestamp": datetime.now().isoformat(),
+        "model": "Presidio-2.2.360",
+        "query_type": "NEGATIVE (No PHI)",
+        "analyzer_config": ANALYZER_CONFIG,
+        "original_query": original_query,
+        "presidio_output": anonymized_query,
+        "presidio_entities_detected": detected_entities.to_dicts(),
+        "false_redaction_check": false_redaction_check
+    }
+    if recognizer_profile is not None:
+        trace["recognizer_profile"] = recognizer_profile
+
+    # Save trace (renamed into place, so a crash never leaves half a file)
+    if trace_store is not None:
+        trace_store.append(trace)
+    else:
+        trace_file = os.path.join(output_dir, f"query_{query_id}_trace.json")
+        write_json_atomic(trace_file, trace, indent=2, ensure_ascii=False)
+
+    return trace
+
+
+def update_negative_totals(totals: Dict[str, Any], trace: Dict[str, Any]) -> None:
+    """Add one negative query trace to running totals (created empty if needed)"""
+    for name in ("queries", "correctly_unchanged", "with_false_positives", "false_redactions"):
+        totals.setdefault(name, 0)
+    by_type = totals.setdefault("false_redactions_by_type", {})
+
+    false_redaction_check = trace['false_redaction_check']
+    for redaction_type, count in false_redaction_check['false_redactions_by_type'].items():
+        by_type[redaction_type] = by_type.get(redaction_type, 0) + count
+
+    totals["queries"] += 1
+    totals["false_redactions"] += false_redaction_check['redaction_count']
+    if false_redaction_check['has_false_redactions']:
+        totals["with_false_positives"] += 1
+    else:
+        totals["correctly_unchanged"] += 1
+
+
+def build_negative_aggregate(totals: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the aggregate_summary.json contents from negative query totals"""
+    total_queries = totals.get("queries", 0)
+    queries_correctly_unchanged = totals.get("correctly_unchanged", 0)
+    queries_with_false_positives = totals.get("with_false_positives", 0)
+
+    return {
+        "evaluation_timestamp": datetime.now().isoformat(),
+        "model": "Presidio-2.2.360",
+        "query_type": "negative",
+        "total_queries_processed": total_queries,
+        "queries_correctly_unchanged": queries_correctly_unchanged,
+        "queries_with_false_positives": queries_with_false_positives,
+        "total_false_redactions": totals.get("false_redactions", 0),
+        "false_redactions_by_type": totals.get("false_redactions_by_type", {}),
+        "false_positive_rate": queries_with_false_positives / total_queries if total_queries else 0,
+        "specificity": queries_correctly_unchanged / total_queries if total_queries else 1.0
+    }
+
+
+def print_negative_summary(aggregate: Dict[str, Any]) -> None:
+    """Print the completion report for a negative query run"""
+    print(f"\n✓ Completed {aggregate['total_queries_processed']} negative queries")
+    print(f"  Correctly unchanged: {aggregate['queries_correctly_unchanged']}")
+    print(f"  False positives: {aggregate['queries_with_false_positives']}")
+    print(f"  Total false redactions: {aggregate['total_false_redactions']}")
+    print(f"  False positive rate: {aggregate['false_positive_rate']:.2%}")
+    print(f"  Specificity: {aggregate['specificity']:.2%}")
+    if "analysis_cache" in aggregate:
+        cache_stats = aggregate["analysis_cache"]
+        print(f"  Analysis cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    if "detection_cascade" in aggregate:
+        routing = aggregate["detection_cascade"]
+        print(f"  Detection cascade: {routing['mean_ms_per_query']:.3f} ms/query")
+
+
+def process_negative_queries(
+    csv_file: str,
+    output_dir: str,
+    batch_size: int = 32,
+    trace_store: Optional[TraceStore] = None,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    profile_recognizers: bool = False,
+    flamegraph_file: Optional[str] = None,
+    flamegraph_top: int = 20,
+    cascade: Optional[Dict[str, Any]] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    resume: bool = False,
+    checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY
+) -> Dict[str, Any]:
     """
     Process negative queries (NO PHI) to measure false positive rate
 
     Args:
         csv_file: Path to negative_queries.csv
         output_dir: Directory to save trace files
+        batch_size: Number of queries per spaCy nlp.pipe batch
+        trace_store: Sharded store to append traces to instead of one file per query
+        cache_path: Analysis cache database; cached queries skip the NLP pass
+        cache_max_bytes: Size bound for the analysis cache
+        profile_recognizers: Time every recognizer per query (traces get a
+                             recognizer_profile, the aggregate a roll-up)
+        flamegraph_file: Collapsed-stack output for the slowest queries
+        flamegraph_top: Number of slowest queries kept for flamegraph_file
+        cascade: Detection cascade config (see build_detection_cascade); the
+                 aggregate then gets per-tier routing counts and latency
+        shard: (index, count) to evaluate one query_id-hashed shard and
+               write a partial summary instead of aggregate_summary.json
+        resume: Continue from the run's checkpoint (output_dir/checkpoints)
+                and the traces written after it
+        checkpoint_every: Rows between checkpoints (taken at the next
+                          batch boundary)
 
     Returns:
-        Aggregate statistics
+        Aggregate statistics (of the shard, when sharded)
     """
-    # Initialize Presidio
-    print(f"Initializing Presidio analyzer...")
-    analyzer = initialize_presidio_analyzer()
-    anonymizer = AnonymizerEngine()
-
     # Create output directory
     os.makedirs(output_dir, exist_ok=True)
 
-    # Read negative queries
-    print(f"Loading negative queries from {csv_file}...")
-    queries = []
-    with open(csv_file, 'r', encoding='utf-8') as f:
-        reader = csv.DictReader(f)
-        queries = list(reader)
+    # Stream negative queries; rows are read only as the analyzer asks for them
+    print(f"Processing negative queries (NO PHI expected) from {csv_file}...")
+    queries = iter_csv_rows(csv_file)
+    if shard is not None:
+        print(f"  Shard {shard[0]}/{shard[1]}")
+        queries = iter_shard(queries, shard)
+
+    # Analyze and anonymize, batching the spaCy stage
+    cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidated": 0}
+    recognizer_profiles = {} if profile_recognizers else None
+    profile_totals = RecognizerProfileTotals(flamegraph_top) if profile_recognizers else None
+    cascade_stats: Dict[str, Any] = {}
+    totals: Dict[str, Any] = {}
+    checkpoint = RunCheckpoint(output_dir, "negative", csv_file, shard, checkpoint_every)
+    state = checkpoint.load() if resume else None
+    if state is None:
+        if resume:
+            print(f"  No checkpoint at {checkpoint.path}; starting from the first row")
+        # Replace any earlier run's checkpoint before the first trace is written
+        checkpoint.save(totals, cache_stats if cache_path else None, cascade_stats)
+    else:
+        totals = state["totals"]
+        cache_stats.update(state["analysis_cache"] or {})
+        cascade_stats = state["detection_cascade"] or {}
+        queries = itertools.islice(queries, state["rows"], None)
+        reconciled, queries = checkpoint.reconcile(
+            queries,
+            lambda query_id: read_trace(output_dir, query_id, trace_store),
+            lambda trace: update_negative_totals(totals, trace)
+        )
+        print(f"  Resuming after row {checkpoint.rows}: {state['rows']} from the checkpoint, "
+              f"{reconciled} from traces written after it")
 
-    print(f"Processing {len(queries)} negative queries (NO PHI expected)...")
+    results = iter_anonymized(
+        queries, chunksize=batch_size, cache_path=cache_path,
+        cache_max_bytes=cache_max_bytes, cache_stats=cache_stats,
+        recognizer_profiles=recognizer_profiles, cascade=cascade, cascade_stats=cascade_stats
+    )
 
     # Process each query
-    queries_correctly_unchanged = 0
-    queries_with_false_positives = 0
-    total_false_redactions = 0
-    false_redactions_by_type = {}
-
-    for i, query_row in enumerate(queries):
+    for i, (query_row, anonymized_text, detected_entities) in enumerate(results):
         query_id = query_row['query_id']
-        query_text = query_row['query_text']
-
-        # Analyze for PII/PHI
-        analyzer_results = analyzer.analyze(
-            text=query_text,
-            language="en",
-            entities=None,
-            score_threshold=0.35
+        recognizer_profile = None
+        if recognizer_profiles is not None:
+            recognizer_profile = recognizer_profiles.pop(str(query_id), None)
+
+        trace = create_negative_trace(
+            query_id,
+            query_row['query_text'],
+            anonymized_text,
+            detected_entities,
+            output_dir,
+            trace_store,
+            recognizer_profile
         )
 
-        # Convert results to detailed entity list
-        detected_entities = []
-        for result in analyzer_results:
-            detected_entities.append({
-                "entity_type": result.entity_type,
-                "hipaa_category": map_presidio_entity_to_hipaa(result.entity_type),
-                "start": result.start,
-                "end": result.end,
-                "score": result.score,
-                "text": query_text[result.start:result.end],
-                "recognizer": result.recognition_metadata.get("recognizer_name", "Unknown")
-            })
-
-        # Create operator config for anonymization
-        operators = {}
-        for result in analyzer_results:
-            hipaa_type = map_presidio_entity_to_hipaa(result.entity_type)
-            operators[result.entity_type] = OperatorConfig(
-                "replace",
-                {"new_value": f"[REDACTED_{hipaa_type}]"}
-            )
-
-        # Anonymize
-        anonymized_result = anonymizer.anonymize(
-            text=query_text,
-            analyzer_results=analyzer_results,
-            operators=operators
-        )
-
-        anonymized_text = anonymized_result.text
-
-        # Detect false redactions
-        false_redaction_check = detect_false_redactions(query_text, anonymized_text)
-
-        # Aggregate false redactions by type
-        for redaction_type, count in false_redaction_check['false_redactions_by_type'].items():
-            false_redactions_by_type[redaction_type] = false_redactions_by_type.get(redaction_type, 0) + count
-
-        # Create trace file
-        trace = {
-            "query_id": query_id,
-            "timestamp": datetime.now().isoformat(),
-            "model": "Presidio-2.2.360",
-            "query_type": "NEGATIVE (No PHI)",
-            "analyzer_config": {
-                "language": "en",
-                "score_threshold": 0.35,
-                "custom_recognizers": ["MedicalRecordNumberRecognizer", "UniqueIdentifierRecognizer"]
-            },
-            "original_query": query_text,
-            "presidio_output": anonymized_text,
-            "presidio_entities_detected": detected_entities,
-            "false_redaction_check": false_redaction_check
-        }
-
-        # Save trace file
-        trace_file = os.path.join(output_dir, f"query_{query_id}_trace.json")
-        with open(trace_file, 'w', encoding='utf-8') as f:
-            json.dump(trace, f, indent=2, ensure_ascii=False)
-
         # Update statistics
-        total_false_redactions += false_redaction_check['redaction_count']
-        if false_redaction_check['has_false_redactions']:
-            queries_with_false_positives += 1
-        else:
-            queries_correctly_unchanged += 1
+        update_negative_totals(totals, trace)
+        checkpoint.advance(query_id)
+        if profile_totals is not None:
+            profile_totals.add(query_id, recognizer_profile)
+
+        # Checkpoint only at batch boundaries, where the cache and cascade
+        # counters cover exactly the committed rows
+        if (i + 1) % batch_size == 0 and checkpoint.due():
+            if trace_store is not None:
+                trace_store.flush()
+            checkpoint.save(totals, cache_stats if cache_path else None, cascade_stats)
 
         # Progress
         if (i + 1) % 50 == 0:
-            print(f"  Processed {i + 1}/{len(queries)} queries...")
+            print(f"  Processed {i + 1} queries...")
 
-    # Calculate aggregate metrics
-    false_positive_rate = queries_with_false_positives / len(queries) if queries else 0
-    specificity = queries_correctly_unchanged / len(queries) if queries else 1.0
+    if trace_store is not None:
+        trace_store.flush()
+    checkpoint.save(totals, cache_stats if cache_path else None, cascade_stats, complete=True)
 
-    aggregate = {
-        "evaluation_timestamp": datetime.now().isoformat(),
-        "model": "Presidio-2.2.360",
-        "query_type": "negative",
-        "total_queries_processed": len(queries),
-        "queries_correctly_unchanged": queries_correctly_unchanged,
-        "queries_with_false_positives": queries_with_false_positives,
-        "total_false_redactions": total_false_redactions,
-        "false_redactions_by_type": false_redactions_by_type,
-        "false_positive_rate": false_positive_rate,
-        "specificity": specificity
-    }
+    # Calculate aggregate metrics
+    aggregate = build_negative_aggregate(totals)
+    if cache_path:
+        aggregate["analysis_cache"] = cache_stats
+    if cascade is not None:
+        aggregate["detection_cascade"] = summarize_cascade_stats(cascade_stats, cascade)
 
     # Save aggregate summary
-    summary_file = os.path.join(output_dir, "aggregate_summary.json")
-    with open(summary_file, 'w', encoding='utf-8') as f:
-        json.dump(aggregate, f, indent=2)
-
-    print(f"\n✓ Completed {len(queries)} negative queries")
-    print(f"  Correctly unchanged: {queries_correctly_unchanged}")
-    print(f"  False positives: {queries_with_false_positives}")
-    print(f"  Total false redactions: {total_false_redactions}")
-    print(f"  False positive rate: {false_positive_rate:.2%}")
-    print(f"  Specificity: {specificity:.2%}")
+    print_negative_summary(aggregate)
+    if profile_totals is not None:
+        report_recognizer_profile(aggregate, profile_totals, flamegraph_file)
+    if shard is not None:
+        partial_file = write_partial(
+            output_dir, "negative", shard, totals,
+            cache_stats if cache_path else None, cascade_stats, cascade
+        )
+        print(f"  Partial summary written to {partial_file}")
+    else:
+        save_aggregate_summary(output_dir, aggregate)
 
     return aggregate
 
 
 def main():
     """Main execution"""
-    base_dir = "/Users/jacweath/Desktop/safesearch_/data"
+    parser = argparse.ArgumentParser(description="Presidio negative query evaluation")
+    parser.add_argument("--trace-store", action="store_true",
+                        help="Append traces to a sharded store (<output>/trace_store) "
+                             "instead of one JSON file per query")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database; unchanged queries skip the NLP pass")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Analysis cache size bound in MB (default: %(default)s)")
+    parser.add_argument("--profile-recognizers", action="store_true",
+                        help="Time every recognizer per query and add the roll-up to aggregate_summary.json")
+    parser.add_argument("--flamegraph", default=None,
+                        help="With --profile-recognizers, write collapsed stacks of the slowest queries here")
+    parser.add_argument("--flamegraph-top", type=int, default=20,
+                        help="Slowest queries to include in --flamegraph (default: 20)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Detect with the regex -> NER -> LLM cascade instead of the full analyzer")
+    parser.add_argument("--no-ner-gate", action="store_true",
+                        help="With --cascade, run the NER tier on every query")
+    parser.add_argument("--uncertain-band", type=float, nargs=2, default=list(DEFAULT_UNCERTAIN_BAND),
+                        metavar=("LOW", "HIGH"),
+                        help="With --llm-tier, scores in [LOW, HIGH) escalate a query (default: %(default)s)")
+    parser.add_argument("--llm-tier", action="store_true",
+                        help="With --cascade, ask Azure OpenAI (AZURE_OPENAI_*_4o) about uncertain queries")
+    parser.add_argument("--llm-cache", default=None,
+                        help="With --llm-tier, record/replay LLM answers in this cache (llm_response_cache.py)")
+    parser.add_argument("--llm-cache-mode", choices=("record", "replay", "read-through"), default="read-through",
+                        help="record, replay (offline) or read-through (default: %(default)s)")
+    parser.add_argument("--data-dir", default="/Users/jacweath/Desktop/safesearch_/data",
+                        help="Directory holding negative_queries.csv and Presidio_negative/ (default: %(default)s)")
+    parser.add_argument("--shard", default=None, metavar="i/N",
+                        help="Evaluate only the queries whose query_id hashes to shard i of N and write "
+                             "a partial summary (combine with: eval_shards.py merge)")
+    parser.add_argument("--claim", type=int, default=None, metavar="N",
+                        help="Split into N shards and evaluate every shard no other node has claimed "
+                             "or finished, using lock files under Presidio_negative/claims")
+    parser.add_argument("--stale-after", type=float, default=DEFAULT_STALE_AFTER,
+                        help="With --claim, seconds without heartbeat before a claim is re-run (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted run from its checkpoint and the traces written after it")
+    parser.add_argument("--checkpoint-every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                        help="Rows between checkpoints of the running totals (default: %(default)s)")
+    args = parser.parse_args()
+    if args.profile_recognizers and args.cache:
+        parser.error("--profile-recognizers times real analyzer calls and cannot be combined with --cache")
+    if args.cascade and (args.cache or args.profile_recognizers):
+        parser.error("--cascade replaces the analyzer pass and cannot be combined with --cache or --profile-recognizers")
+    if args.llm_tier and not args.cascade:
+        parser.error("--llm-tier needs --cascade")
+    if args.llm_cache and not args.llm_tier:
+        parser.error("--llm-cache needs --llm-tier")
+    if args.shard and args.claim:
+        parser.error("--shard and --claim are alternatives")
+    if (args.shard or args.claim) and args.profile_recognizers:
+        parser.error("--profile-recognizers reports per-run roll-ups and cannot be combined with --shard or --claim")
+    if args.claim is not None and args.claim < 1:
+        parser.error("--claim needs at least one shard")
+    if args.resume and args.profile_recognizers:
+        parser.error("--profile-recognizers roll-ups are not checkpointed and cannot be combined with --resume")
+    if args.checkpoint_every < 1:
+        parser.error("--checkpoint-every must be at least 1")
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+    cascade = None
+    if args.cascade:
+        cascade = {
+            "ner_gate": not args.no_ner_gate,
+            "uncertain_band": args.uncertain_band,
+            "llm": args.llm_tier,
+            "llm_cache": args.llm_cache,
+            "llm_cache_mode": args.llm_cache_mode,
+        }
 
     print("=" * 80)
     print("PRESIDIO NEGATIVE QUERY EVALUATION (False Positive Assessment)")
     print("=" * 80)
 
-    negative_csv = os.path.join(base_dir, "negative_queries.csv")
-    negative_output = os.path.join(base_dir, "Presidio_negative")
-
-    results = process_negative_queries(
-        csv_file=negative_csv,
-        output_dir=negative_output
-    )
-
-    print("\n" + "=" * 80)
-    print("EVALUATION COMPLETE")
-    print("=" * 80)
-    print(f"\nResults saved to: {negative_output}")
-    print(f"  - {results['total_queries_processed']} trace files")
-    print(f"  - aggregate_summary.json")
-    print(f"\nFalse Positive Rate: {results['false_positive_rate']:.2%}")
-    print(f"Specificity: {results['specificity']:.2%}")
-    print(f"\nComparison to GPT-4o:")
-    print(f"  - GPT-4o false positive rate: 96.80%")
-    print(f"  - Presidio false positive rate: {results['false_positive_rate']:.2%}")
-    print(f"  - Difference: {96.80 - (results['false_positive_rate'] * 100):.2f}%")
+    negative_csv = os.path.join(args.data_dir, "negative_queries.csv")
+    negative_output = os.path.join(args.data_dir, "Presidio_negative")
+
+    for shard in shard_runs(shard, args.claim, [(negative_output, "negative")], args.stale_after):
+        trace_store = None
+        if args.trace_store:
+            # One store per shard: a store has a single writer
+            store_dir = os.path.join(negative_output, "trace_store")
+            if shard is not None:
+                store_dir = os.path.join(store_dir, shard_label(shard))
+            trace_store = TraceStore(store_dir)
+
+        try:
+            results = process_negative_queries(
+                csv_file=negative_csv,
+                output_dir=negative_output,
+                trace_store=trace_store,
+                cache_path=args.cache,
+                cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+                profile_recognizers=args.profile_recognizers,
+                flamegraph_file=args.flamegraph,
+                flamegraph_top=args.flamegraph_top,
+                cascade=cascade,
+                shard=shard,
+                resume=args.resume,
+                checkpoint_every=args.checkpoint_every
+            )
+        finally:
+            if trace_store is not None:
+                trace_store.close()
+
+        print("\n" + "=" * 80)
+        print("EVALUATION COMPLETE" if shard is None else f"SHARD {shard[0]}/{shard[1]} COMPLETE")
+        print("=" * 80)
+        print(f"\nResults saved to: {negative_output}")
+        if trace_store is not None:
+            print(f"  - {results['total_queries_processed']} traces in {trace_store.root_dir} "
+                  f"(export with: trace_store.py {trace_store.root_dir} export <dir>)")
+        else:
+            print(f"  - {results['total_queries_processed']} trace files")
+        if shard is not None:
+            print(f"  - partials/negative_{shard_label(shard)}.json "
+                  f"(merge with: eval_shards.py merge {negative_output})")
+            continue
+        print(f"  - aggregate_summary.json")
+        print(f"\nFalse Positive Rate: {results['false_positive_rate']:.2%}")
+        print(f"Specificity: {results['specificity']:.2%}")
+        print(f"\nComparison to GPT-4o:")
+        print(f"  - GPT-4o false positive rate: 96.80%")
+        print(f"  - Presidio false positive rate: {results['false_positive_rate']:.2%}")
+        print(f"  - Difference: {96.80 - (results['false_positive_rate'] * 100):.2f}%")
 
 
 if __name__ == "__main__":
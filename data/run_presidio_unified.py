@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+"""
+Presidio Unified Evaluation - Positive and Negative Queries in One Pass
+Streams synthetic_dataset.txt once through a single Presidio analyzer and
+scores each query for PHI leaks or over-redaction depending on its labels
+"""
+
+import argparse
+import os
+from typing import List, Dict, Any, Iterator, Optional, Tuple
+from analysis_cache import DEFAULT_MAX_BYTES
+from dataset_index import DatasetReader
+from detection_cascade import DEFAULT_UNCERTAIN_BAND, summarize_cascade_stats
+from eval_checkpoint import write_json_atomic
+from eval_shards import DEFAULT_STALE_AFTER, iter_shard, parse_shard, shard_label, shard_runs, write_partial
+from recognizer_profiling import RecognizerProfileTotals
+from run_presidio_evaluation import (
+    build_positive_aggregate,
+    create_trace_file,
+    iter_anonymized,
+    print_positive_summary,
+    report_recognizer_profile,
+    save_aggregate_summary,
+    update_positive_totals,
+)
+from run_presidio_negative import (
+    build_negative_aggregate,
+    create_negative_trace,
+    print_negative_summary,
+    update_negative_totals,
+)
+from trace_store import TraceStore
+
+# Shared-pass counters of a unified run, next to Presidio_positive/ and Presidio_negative/
+UNIFIED_SUMMARY_FILE = "unified_summary.json"
+
+
+def iter_labeled_queries(dataset_file: str) -> Iterator[Dict[str, Any]]:
+    """
+    Stream well-formed queries from synthetic_dataset.txt
+
+    PHI tags are converted to the {'type', 'value'} entities used in
+    positive_queries.csv, so query_id, query_text and ground truth match the
+    CSV exports row for row.
+    """
+    with DatasetReader(dataset_file) as reader:
+        for record in reader.iter_queries():
+            yield {
+                "query_id": record['query_id'],
+                "query_text": record['query_text'],
+                "phi_entities": [
+                    {"type": tag['identifier_type'], "value": tag['value']}
+                    for tag in record['phi_entities']
+                    if 'identifier_type' in tag and 'value' in tag
+                ],
+            }
+
+
+def evaluate_dataset(
+    queries: Iterator[Dict[str, Any]],
+    positive_output: str,
+    negative_output: str,
+    workers: int = 1,
+    chunksize: int = 16,
+    positive_store: Optional[TraceStore] = None,
+    negative_store: Optional[TraceStore] = None,
+    cache_path: Optional[str] = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    profile_recognizers: bool = False,
+    flamegraph_file: Optional[str] = None,
+    flamegraph_top: int = 20,
+    cascade: Optional[Dict[str, Any]] = None,
+    shard: Optional[Tuple[int, int]] = None,
+    unified_output: Optional[str] = None
+) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """
+    Evaluate positive and negative queries in a single analyzer pass
+
+    Queries with ground truth PHI get the leak/recall trace of
+    run_presidio_evaluation.py; queries without PHI get the over-redaction
+    trace of run_presidio_negative.py. Both aggregate_summary.json files are
+    written at the end. Counters of the shared analyzer pass (analysis
+    cache, detection cascade routing) cannot be attributed to either set
+    and go only into the unified summary.
+
+    Args:
+        queries: Rows with query_id, query_text and a phi_entities list
+        positive_output: Directory for positive query traces and summary
+        negative_output: Directory for negative query traces and summary
+        workers: Number of analyzer processes (1 = serial, in-process)
+        chunksize: Rows per nlp.pipe batch (and per worker task when workers > 1)
+        positive_store: Sharded store for positive traces instead of JSON files
+        negative_store: Sharded store for negative traces instead of JSON files
+        cache_path: Analysis cache database; cached queries skip the NLP pass
+        cache_max_bytes: Size bound for the analysis cache
+        profile_recognizers: Time every recognizer per query; each set's
+                             aggregate gets its own roll-up
+        flamegraph_file: Collapsed-stack output for the slowest queries
+                         across both sets
+        flamegraph_top: Number of slowest queries kept for flamegraph_file
+        cascade: Detection cascade config (see build_detection_cascade);
+                 its routing counts and latency cover both sets
+        shard: (index, count) to evaluate one query_id-hashed shard; each
+               set then gets a partial summary instead of aggregate_summary.json,
+               and the shared-pass counters a unified partial in unified_output
+        unified_output: Directory for unified_summary.json (the shared-pass
+                        counters and the paths of both aggregate summaries)
+
+    Returns:
+        Tuple of (positive_aggregate, negative_aggregate)
+    """
+    os.makedirs(positive_output, exist_ok=True)
+    os.makedirs(negative_output, exist_ok=True)
+    if shard is not None:
+        queries = iter_shard(queries, shard)
+
+    cache_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidated": 0}
+    recognizer_profiles = {} if profile_recognizers else None
+    cascade_stats: Dict[str, Any] = {}
+    results = iter_anonymized(
+        queries, workers, chunksize, cache_path, cache_max_bytes, cache_stats, recognizer_profiles,
+        cascade=cascade, cascade_stats=cascade_stats
+    )
+
+    positive_totals: Dict[str, Any] = {}
+    negative_totals: Dict[str, Any] = {}
+    positive_profile = RecognizerProfileTotals(0) if profile_recognizers else None
+    negative_profile = RecognizerProfileTotals(0) if profile_recognizers else None
+    combined_profile = RecognizerProfileTotals(flamegraph_top) if profile_recognizers else None
+    for i, (query_row, anonymized_text, detected_entities) in enumerate(results):
+        ground_truth_entities: List[Dict[str, Any]] = query_row['phi_entities']
+        recognizer_profile = None
+        if recognizer_profiles is not None:
+            recognizer_profile = recognizer_profiles.pop(str(query_row['query_id']), None)
+            combined_profile.add(query_row['query_id'], recognizer_profile)
+
+        if ground_truth_entities:
+            trace = create_trace_file(
+                query_row['query_id'],
+                query_row['query_text'],
+                ground_truth_entities,
+                anonymized_text,
+                detected_entities,
+                positive_output,
+                positive_store,
+                recognizer_profile
+            )
+            update_positive_totals(positive_totals, trace)
+            if positive_profile is not None:
+                positive_profile.add(query_row['query_id'], recognizer_profile)
+        else:
+            trace = create_negative_trace(
+                query_row['query_id'],
+                query_row['query_text'],
+                anonymized_text,
+                detected_entities,
+                negative_output,
+                negative_store,
+                recognizer_profile
+            )
+            update_negative_totals(negative_totals, trace)
+            if negative_profile is not None:
+                negative_profile.add(query_row['query_id'], recognizer_profile)
+
+        # Progress
+        if (i + 1) % 50 == 0:
+            print(f"  Processed {i + 1} queries...")
+
+    positive_aggregate = build_positive_aggregate(positive_totals)
+    negative_aggregate = build_negative_aggregate(negative_totals)
+
+    print_positive_summary(positive_aggregate)
+    if positive_profile is not None:
+        report_recognizer_profile(positive_aggregate, positive_profile)
+    print_negative_summary(negative_aggregate)
+    if negative_profile is not None:
+        report_recognizer_profile(negative_aggregate, negative_profile)
+    if cache_path:
+        print(f"\nAnalysis cache (both sets): {cache_stats['hits']} hits, {cache_stats['misses']} misses")
+    cascade_summary = summarize_cascade_stats(cascade_stats, cascade) if cascade is not None else None
+    if cascade_summary is not None:
+        print(f"\nDetection cascade (both sets): {cascade_summary['mean_ms_per_query']:.3f} ms/query")
+    if combined_profile is not None and flamegraph_file:
+        written = combined_profile.write_collapsed_stacks(flamegraph_file)
+        print(f"\nCollapsed stacks for the {written} slowest queries written to {flamegraph_file}")
+
+    if shard is not None:
+        for output_dir, query_type, totals in ((positive_output, "positive", positive_totals),
+                                               (negative_output, "negative", negative_totals)):
+            print(f"Partial summary written to {write_partial(output_dir, query_type, shard, totals)}")
+        if unified_output:
+            partial_file = write_partial(
+                unified_output, "unified", shard, {},
+                cache_stats if cache_path else None, cascade_stats, cascade,
+                outputs={"positive": positive_output, "negative": negative_output}
+            )
+            print(f"Partial summary written to {partial_file}")
+    else:
+        unified = {
+            "query_type": "unified",
+            "positive_summary": save_aggregate_summary(positive_output, positive_aggregate),
+            "negative_summary": save_aggregate_summary(negative_output, negative_aggregate),
+        }
+        if cache_path:
+            unified["analysis_cache"] = cache_stats
+        if cascade_summary is not None:
+            unified["detection_cascade"] = cascade_summary
+        if unified_output:
+            save_unified_summary(unified_output, unified)
+
+    return positive_aggregate, negative_aggregate
+
+
+def save_unified_summary(output_dir: str, unified: Dict[str, Any]) -> str:
+    """Write output_dir/unified_summary.json and return its path"""
+    os.makedirs(output_dir, exist_ok=True)
+    summary_file = os.path.join(output_dir, UNIFIED_SUMMARY_FILE)
+    write_json_atomic(summary_file, unified, indent=2)
+    return summary_file
+
+
+def main():
+    """Main execution"""
+    base_dir = "/Users/jacweath/Desktop/safesearch_/data"
+
+    parser = argparse.ArgumentParser(description="Presidio positive + negative evaluation in one pass")
+    parser.add_argument("--dataset", default=os.path.join(base_dir, "synthetic_dataset.txt"),
+                        help="Labeled dataset (default: %(default)s)")
+    parser.add_argument("--output-dir", default=base_dir,
+                        help="Directory holding Presidio_positive/ and Presidio_negative/ "
+                             "(default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of analyzer processes (default: 1, serial)")
+    parser.add_argument("--chunksize", type=int, default=16,
+                        help="Rows per NLP batch / worker task (default: 16)")
+    parser.add_argument("--trace-store", action="store_true",
+                        help="Append traces to sharded stores (<output>/trace_store) "
+                             "instead of one JSON file per query")
+    parser.add_argument("--cache", default=None,
+                        help="Analysis cache database; unchanged queries skip the NLP pass")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Analysis cache size bound in MB (default: %(default)s)")
+    parser.add_argument("--profile-recognizers", action="store_true",
+                        help="Time every recognizer per query and add the roll-up to aggregate_summary.json")
+    parser.add_argument("--flamegraph", default=None,
+                        help="With --profile-recognizers, write collapsed stacks of the slowest queries here")
+    parser.add_argument("--flamegraph-top", type=int, default=20,
+                        help="Slowest queries to include in --flamegraph (default: 20)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Detect with the regex -> NER -> LLM cascade instead of the full analyzer")
+    parser.add_argument("--no-ner-gate", action="store_true",
+                        help="With --cascade, run the NER tier on every query")
+    parser.add_argument("--uncertain-band", type=float, nargs=2, default=list(DEFAULT_UNCERTAIN_BAND),
+                        metavar=("LOW", "HIGH"),
+                        help="With --llm-tier, scores in [LOW, HIGH) escalate a query (default: %(default)s)")
+    parser.add_argument("--llm-tier", action="store_true",
+                        help="With --cascade, ask Azure OpenAI (AZURE_OPENAI_*_4o) about uncertain queries")
+    parser.add_argument("--llm-cache", default=None,
+                        help="With --llm-tier, record/replay LLM answers in this cache (llm_response_cache.py)")
+    parser.add_argument("--llm-cache-mode", choices=("record", "replay", "read-through"), default="read-through",
+                        help="record, replay (offline) or read-through (default: %(default)s)")
+    parser.add_argument("--shard", default=None, metavar="i/N",
+                        help="Evaluate only the queries whose query_id hashes to shard i of N and write "
+                             "partial summaries (combine with: eval_shards.py merge)")
+    parser.add_argument("--claim", type=int, default=None, metavar="N",
+                        help="Split into N shards and evaluate every shard no other node has claimed "
+                             "or finished, using lock files under Presidio_positive/claims")
+    parser.add_argument("--stale-after", type=float, default=DEFAULT_STALE_AFTER,
+                        help="With --claim, seconds without heartbeat before a claim is re-run (default: %(default)s)")
+    args = parser.parse_args()
+    if args.profile_recognizers and args.cache:
+        parser.error("--profile-recognizers times real analyzer calls and cannot be combined with --cache")
+    if args.cascade and (args.cache or args.profile_recognizers):
+        parser.error("--cascade replaces the analyzer pass and cannot be combined with --cache or --profile-recognizers")
+    if args.llm_tier and not args.cascade:
+        parser.error("--llm-tier needs --cascade")
+    if args.llm_cache and not args.llm_tier:
+        parser.error("--llm-cache needs --llm-tier")
+    if args.shard and args.claim:
+        parser.error("--shard and --claim are alternatives")
+    if (args.shard or args.claim) and args.profile_recognizers:
+        parser.error("--profile-recognizers reports per-run roll-ups and cannot be combined with --shard or --claim")
+    if args.claim is not None and args.claim < 1:
+        parser.error("--claim needs at least one shard")
+    shard = None
+    if args.shard:
+        try:
+            shard = parse_shard(args.shard)
+        except ValueError as error:
+            parser.error(str(error))
+    cascade = None
+    if args.cascade:
+        cascade = {
+            "ner_gate": not args.no_ner_gate,
+            "uncertain_band": args.uncertain_band,
+            "llm": args.llm_tier,
+            "llm_cache": args.llm_cache,
+            "llm_cache_mode": args.llm_cache_mode,
+        }
+
+    print("=" * 80)
+    print("PRESIDIO UNIFIED EVALUATION (Positive + Negative, single pass)")
+    print("=" * 80)
+
+    positive_output = os.path.join(args.output_dir, "Presidio_positive")
+    negative_output = os.path.join(args.output_dir, "Presidio_negative")
+
+    targets = [(positive_output, "positive"), (negative_output, "negative"), (args.output_dir, "unified")]
+    for shard in shard_runs(shard, args.claim, targets, args.stale_after):
+        positive_store = None
+        negative_store = None
+        if args.trace_store:
+            # One store per shard: a store has a single writer
+            suffix = [shard_label(shard)] if shard is not None else []
+            positive_store = TraceStore(os.path.join(positive_output, "trace_store", *suffix))
+            negative_store = TraceStore(os.path.join(negative_output, "trace_store", *suffix))
+
+        print(f"Streaming queries from {args.dataset}"
+              f"{'' if shard is None else f' (shard {shard[0]}/{shard[1]})'}...")
+        try:
+            positive_results, negative_results = evaluate_dataset(
+                iter_labeled_queries(args.dataset),
+                positive_output,
+                negative_output,
+                workers=args.workers,
+                chunksize=args.chunksize,
+                positive_store=positive_store,
+                negative_store=negative_store,
+                cache_path=args.cache,
+                cache_max_bytes=args.cache_max_mb * 1024 * 1024,
+                profile_recognizers=args.profile_recognizers,
+                flamegraph_file=args.flamegraph,
+                flamegraph_top=args.flamegraph_top,
+                cascade=cascade,
+                shard=shard,
+                unified_output=args.output_dir
+            )
+        finally:
+            for store in (positive_store, negative_store):
+                if store is not None:
+                    store.close()
+
+        print("\n" + "=" * 80)
+        print("EVALUATION COMPLETE" if shard is None else f"SHARD {shard[0]}/{shard[1]} COMPLETE")
+        print("=" * 80)
+        print(f"\nResults saved to: {positive_output}")
+        print(f"                  {negative_output}")
+        if shard is not None:
+            print(f"\nMerge with: eval_shards.py merge {positive_output}")
+            print(f"            eval_shards.py merge {negative_output}")
+            print(f"            eval_shards.py merge {args.output_dir}")
+            continue
+        print(f"                  {os.path.join(args.output_dir, UNIFIED_SUMMARY_FILE)}")
+        print(f"\nRecall: {positive_results['recall']:.2%}")
+        print(f"Perfect redaction rate: {positive_results['perfect_rate']:.2%}")
+        print(f"False Positive Rate: {negative_results['false_positive_rate']:.2%}")
+        print(f"Specificity: {negative_results['specificity']:.2%}")
+
+
+if __name__ == "__main__":
+    main()
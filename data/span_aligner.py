@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""
+Bulk PHI Span Aligner
+Streams synthetic_dataset.txt once, locates every PHI tag's character offsets
+in its query and writes positive_queries.csv and negative_queries.csv
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import time
+from collections import Counter
+from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dataset_index import DatasetReader
+from leak_detection import PhiMatcher
+
+# How a tag was located, in the order the passes are tried
+ALIGNMENT_KINDS = ("exact", "case", "normalized", "unaligned")
+
+UNALIGNED_REPORT_COLUMNS = ["query_id", "type", "value", "query_text"]
+
+
+def _overlaps(start: int, end: int, spans: List[Tuple[int, int]]) -> bool:
+    return any(start < taken_end and taken_start < end for taken_start, taken_end in spans)
+
+
+def _at_word_boundary(text: str, start: int, end: int) -> bool:
+    """True unless the span cuts into a word on either side"""
+    left = start == 0 or not (text[start - 1].isalnum() and text[start].isalnum())
+    right = end == len(text) or not (text[end - 1].isalnum() and text[end].isalnum())
+    return left and right
+
+
+def _assign_occurrences(
+    tags: List[Dict[str, Any]],
+    pending: List[int],
+    occurrences: Dict[str, List[Tuple[int, int]]],
+    spans: List[Optional[Tuple[int, int]]]
+) -> None:
+    """
+    Give each pending tag one occurrence of its value
+
+    Longer values are placed first so "Anna S." claims its span before a
+    separate "Anna" tag does. Occurrences are expected in preference order
+    (see align_tags). A tag prefers an occurrence no other tag holds;
+    repeated tags of the same value take successive occurrences; a tag nested
+    inside a longer one, or repeated more often than its value occurs, falls
+    back to an occurrence already held.
+    """
+    taken = [span for span in spans if span is not None]
+    for i in sorted(pending, key=lambda i: (-len(tags[i]['value']), i)):
+        candidates = occurrences.get(tags[i]['value'])
+        if not candidates:
+            continue
+        free = [span for span in candidates if span not in taken]
+        disjoint = [span for span in free if not _overlaps(span[0], span[1], taken)]
+        span = (disjoint or free or candidates)[0]
+        spans[i] = span
+        taken.append(span)
+
+
+def align_tags(query_text: str, tags: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """
+    Locate every tag value in the query
+
+    One multi-pattern scan over the case-folded query finds all occurrences
+    of all values at once. Values still missing are retried in a second scan
+    that also ignores whitespace and punctuation differences ("St. Jude's" vs
+    "St Jude’s"). Among several occurrences of a value, whole-word ones with
+    matching case are preferred, so "Ines F" is not placed inside
+    "guidelines for". Tags that neither scan finds keep start = end = -1, the
+    span_metrics convention for an unlocatable span.
+
+    Args:
+        query_text: Query as exported (stripped)
+        tags: Entities with 'type' and 'value' keys
+
+    Returns:
+        Tuple of (entities with start/end added, alignment kind per tag)
+    """
+    spans: List[Optional[Tuple[int, int]]] = [None] * len(tags)
+    kinds = ["unaligned"] * len(tags)
+    pending = list(range(len(tags)))
+
+    for normalize in (False, True):
+        values = list(dict.fromkeys(tags[i]['value'] for i in pending))
+        if not values:
+            break
+        occurrences: Dict[str, List[Tuple[int, int]]] = {}
+        for hit in PhiMatcher(values, normalize, compiled=False).scan(query_text):
+            if hit['end'] > hit['start']:
+                occurrences.setdefault(hit['value'], []).append((hit['start'], hit['end']))
+        for value, candidates in occurrences.items():
+            if len(candidates) > 1:
+                candidates.sort(key=lambda span: (
+                    not _at_word_boundary(query_text, span[0], span[1]),
+                    query_text[span[0]:span[1]] != value,
+                ))
+
+        _assign_occurrences(tags, pending, occurrences, spans)
+        for i in pending:
+            if spans[i] is None:
+                continue
+            if normalize:
+                kinds[i] = "normalized"
+            else:
+                start, end = spans[i]
+                kinds[i] = "exact" if query_text[start:end] == tags[i]['value'] else "case"
+        pending = [i for i in pending if spans[i] is None]
+
+    entities = []
+    for tag, span in zip(tags, spans):
+        start, end = span if span is not None else (-1, -1)
+        entities.append({"type": tag['type'], "value": tag['value'], "start": start, "end": end})
+    return entities, kinds
+
+
+# Worker-process state, set once per process by _init_worker
+_worker_reader: Optional[DatasetReader] = None
+
+
+def _init_worker(dataset_file: str) -> None:
+    """Pool initializer: open the dataset once per worker (the index is already current)"""
+    global _worker_reader
+    _worker_reader = DatasetReader(dataset_file, update_index=False)
+
+
+def align_chunk(task: Tuple[int, int]) -> Tuple[str, str, Counter, List[List[str]]]:
+    """
+    Align blocks [start, stop) of the dataset in the worker
+
+    Rows are rendered to CSV text here so the parent only concatenates.
+    Malformed and empty blocks are skipped exactly as DatasetReader.iter_queries
+    does, so query_id stays the block index.
+
+    Returns:
+        Tuple of (positive CSV rows, negative CSV rows, counts per alignment
+        kind plus positive/negative query counts, unaligned report rows)
+    """
+    start, stop = task
+    positive = io.StringIO()
+    negative = io.StringIO()
+    positive_writer = csv.writer(positive)
+    negative_writer = csv.writer(negative)
+    counts: Counter = Counter()
+    unaligned = []
+
+    for n in range(start, stop):
+        record = _worker_reader[n]
+        if record['malformed'] or not record['query_text']:
+            continue
+        query_text = record['query_text']
+        tags = [
+            {"type": tag['identifier_type'], "value": tag['value']}
+            for tag in record['phi_entities']
+            if 'identifier_type' in tag and 'value' in tag
+        ]
+        if not tags:
+            negative_writer.writerow([record['query_id'], query_text])
+            counts["negative_queries"] += 1
+            continue
+
+        entities, kinds = align_tags(query_text, tags)
+        positive_writer.writerow([record['query_id'], query_text, json.dumps(entities)])
+        counts["positive_queries"] += 1
+        counts.update(kinds)
+        for entity, kind in zip(entities, kinds):
+            if kind == "unaligned":
+                unaligned.append([record['query_id'], entity['type'], entity['value'], query_text])
+
+    return positive.getvalue(), negative.getvalue(), counts, unaligned
+
+
+def iter_aligned_chunks(
+    dataset_file: str,
+    workers: int = 1,
+    chunk_size: int = 5000
+) -> Iterator[Tuple[str, str, Counter, List[List[str]]]]:
+    """
+    Yield align_chunk results over the whole dataset in file order
+
+    Args:
+        dataset_file: Labeled dataset
+        workers: Number of aligning processes (1 = in-process)
+        chunk_size: Blocks per worker task
+    """
+    # Bring the sidecar index up to date once, before any worker opens it
+    with DatasetReader(dataset_file) as reader:
+        total = len(reader)
+    tasks = [(start, min(start + chunk_size, total)) for start in range(0, total, chunk_size)]
+
+    if workers <= 1:
+        _init_worker(dataset_file)
+        try:
+            for task in tasks:
+                yield align_chunk(task)
+        finally:
+            _worker_reader.close()
+        return
+
+    with Pool(processes=workers, initializer=_init_worker, initargs=(dataset_file,)) as pool:
+        for result in pool.imap(align_chunk, tasks):
+            yield result
+
+
+def write_aligned_csvs(
+    dataset_file: str,
+    positive_csv: str,
+    negative_csv: str,
+    unaligned_report: Optional[str] = None,
+    workers: int = 1,
+    chunk_size: int = 5000
+) -> Counter:
+    """
+    Write positive_queries.csv and negative_queries.csv in one pass
+
+    positive_queries.csv holds query_id, query_text and phi_entities, where
+    every entity carries start/end offsets into query_text; queries without
+    PHI tags go to negative_queries.csv.
+
+    Args:
+        dataset_file: Labeled dataset
+        positive_csv: Output for queries with PHI
+        negative_csv: Output for hard negatives
+        unaligned_report: Optional CSV listing every tag that was not found
+        workers: Number of aligning processes
+        chunk_size: Blocks per worker task
+
+    Returns:
+        Counter with positive_queries, negative_queries and one count per
+        alignment kind
+    """
+    totals: Counter = Counter()
+    report = None
+    with open(positive_csv, 'w', encoding='utf-8', newline='') as positive, \
+            open(negative_csv, 'w', encoding='utf-8', newline='') as negative:
+        csv.writer(positive).writerow(["query_id", "query_text", "phi_entities"])
+        csv.writer(negative).writerow(["query_id", "query_text"])
+        if unaligned_report:
+            report = open(unaligned_report, 'w', encoding='utf-8', newline='')
+            csv.writer(report).writerow(UNALIGNED_REPORT_COLUMNS)
+        try:
+            for i, (positive_rows, negative_rows, counts, unaligned) in enumerate(
+                    iter_aligned_chunks(dataset_file, workers, chunk_size)):
+                positive.write(positive_rows)
+                negative.write(negative_rows)
+                if report is not None:
+                    csv.writer(report).writerows(unaligned)
+                totals.update(counts)
+
+                if (i + 1) % 20 == 0:
+                    done = totals["positive_queries"] + totals["negative_queries"]
+                    print(f"  Aligned {done:,} queries...")
+        finally:
+            if report is not None:
+                report.close()
+
+    return totals
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(
+        description="Align PHI tags to character offsets and export positive/negative query CSVs")
+    parser.add_argument("--dataset", default=os.path.join(data_dir, "synthetic_dataset.txt"),
+                        help="Labeled dataset (default: %(default)s)")
+    parser.add_argument("--positive-csv", default=os.path.join(data_dir, "positive_queries.csv"),
+                        help="Output for queries with PHI (default: %(default)s)")
+    parser.add_argument("--negative-csv", default=os.path.join(data_dir, "negative_queries.csv"),
+                        help="Output for hard negatives (default: %(default)s)")
+    parser.add_argument("--unaligned-report", default=None,
+                        help="Write every tag whose value is not found in its query to this CSV")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Aligning processes (default: all cores, %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=5000,
+                        help="Queries per worker task (default: %(default)s)")
+    args = parser.parse_args()
+
+    print(f"Aligning PHI tags in {args.dataset} ({args.workers} workers)...")
+    started = time.perf_counter()
+    totals = write_aligned_csvs(
+        args.dataset, args.positive_csv, args.negative_csv,
+        args.unaligned_report, args.workers, args.chunk_size
+    )
+    elapsed = time.perf_counter() - started
+
+    queries = totals["positive_queries"] + totals["negative_queries"]
+    tags = sum(totals[kind] for kind in ALIGNMENT_KINDS)
+    print(f"\n✓ {queries:,} queries in {elapsed:.1f}s ({queries / max(elapsed, 1e-9):,.0f} queries/sec)")
+    print(f"  {args.positive_csv}: {totals['positive_queries']:,} queries, {tags:,} tags")
+    print(f"  {args.negative_csv}: {totals['negative_queries']:,} queries")
+    for kind in ALIGNMENT_KINDS:
+        share = totals[kind] / tags if tags else 0
+        print(f"  {kind:<11} {totals[kind]:>10,} ({share:.2%})")
+    if totals["unaligned"] and args.unaligned_report:
+        print(f"  Unaligned tags listed in {args.unaligned_report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+"""
+Vectorized Span-Matching Metrics Engine
+Computes exact, fuzzy, overlap and token-level TP/FP/FN per query and per
+HIPAA category over the whole corpus with NumPy, and writes
+Presidio_detailed_results.csv from evaluation traces
+"""
+
+import argparse
+import csv
+import json
+import os
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from dataset_index import DatasetReader
+from trace_store import TraceStore
+
+# Minimum intersection-over-union for a fuzzy match
+FUZZY_IOU_THRESHOLD = 0.7
+
+MATCH_MODES = ("exact", "fuzzy", "overlap")
+
+DETAILED_RESULTS_COLUMNS = [
+    "query_id", "query", "has_phi", "ground_truth_phi_count", "detected_phi_count",
+    "detected_entities", "redacted_query",
+    "tp_exact", "fp_exact", "fn_exact", "tp_fuzzy", "fp_fuzzy", "fn_fuzzy",
+]
+
+TOKEN_PATTERN = re.compile(r"\S+")
+
+
+class SpanTable:
+    """
+    Corpus-wide span columns
+
+    Row i is a span [start[i], end[i]) of category code[i] in query qid[i],
+    where qid is the query's position (0..n_queries-1) in the corpus.
+    start = -1 marks a span that could not be located in the query text.
+    """
+
+    def __init__(self, qid: np.ndarray, code: np.ndarray, start: np.ndarray, end: np.ndarray):
+        self.qid = np.asarray(qid, dtype=np.int64)
+        self.code = np.asarray(code, dtype=np.int32)
+        self.start = np.asarray(start, dtype=np.int64)
+        self.end = np.asarray(end, dtype=np.int64)
+
+    def __len__(self) -> int:
+        return len(self.qid)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[int, int, int, int]]) -> 'SpanTable':
+        """Build from (qid, code, start, end) tuples"""
+        array = np.array(list(rows), dtype=np.int64).reshape(-1, 4)
+        return cls(array[:, 0], array[:, 1], array[:, 2], array[:, 3])
+
+
+def _candidate_pairs(gt: SpanTable, pred: SpanTable) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    All (gt_index, pred_index) pairs that share query and category, ordered
+    by gt_index then pred_index
+    """
+    if len(gt) == 0 or len(pred) == 0:
+        empty = np.zeros(0, dtype=np.int64)
+        return empty, empty
+
+    # Group key: (qid, code) packed into one int64
+    n_codes = int(max(gt.code.max(), pred.code.max())) + 1
+    gt_key = gt.qid * n_codes + gt.code
+    pred_key = pred.qid * n_codes + pred.code
+
+    pred_order = np.argsort(pred_key, kind="stable")
+    sorted_pred_key = pred_key[pred_order]
+    lo = np.searchsorted(sorted_pred_key, gt_key, side="left")
+    hi = np.searchsorted(sorted_pred_key, gt_key, side="right")
+    counts = hi - lo
+
+    gt_index = np.repeat(np.arange(len(gt)), counts)
+    # Offset of each pair within its gt's candidate run
+    run_starts = np.repeat(np.cumsum(counts) - counts, counts)
+    within = np.arange(len(gt_index)) - run_starts
+    pred_index = pred_order[np.repeat(lo, counts) + within]
+    return gt_index, pred_index
+
+
+def _greedy_assign(gt_index: np.ndarray, pred_index: np.ndarray, n_gt: int, n_pred: int) -> np.ndarray:
+    """
+    One-to-one assignment equal to walking ground-truth spans in order and
+    giving each the first still-unused candidate prediction
+
+    Runs deferred acceptance in vectorized rounds: every unmatched span
+    proposes to its next candidate and each prediction keeps the lowest
+    ground-truth index it has seen. Because all predictions share that
+    priority order the result is the serial greedy assignment.
+
+    Args:
+        gt_index, pred_index: Candidate pairs sorted by (gt_index, pred_index)
+
+    Returns:
+        Array of length n_gt holding the matched prediction index or -1
+    """
+    match = np.full(n_gt, -1, dtype=np.int64)
+    holder = np.full(n_pred, n_gt, dtype=np.int64)  # n_gt means unheld
+    if len(gt_index) == 0:
+        return match
+
+    counts = np.bincount(gt_index, minlength=n_gt)
+    first = np.cumsum(counts) - counts
+    pointer = np.zeros(n_gt, dtype=np.int64)
+
+    active = np.flatnonzero(counts > 0)
+    while len(active):
+        targets = pred_index[first[active] + pointer[active]]
+        np.minimum.at(holder, targets, active)
+
+        won = holder[targets] == active
+        # Spans displaced from a prediction they held become active again
+        displaced = np.flatnonzero((match >= 0) & (holder[np.maximum(match, 0)] != np.arange(n_gt)))
+        match[displaced] = -1
+        pointer[displaced] += 1
+        match[active[won]] = targets[won]
+
+        lost = active[~won]
+        pointer[lost] += 1
+        retry = np.concatenate([lost, displaced])
+        active = np.unique(retry[pointer[retry] < counts[retry]])
+    return match
+
+
+def match_spans(gt: SpanTable, pred: SpanTable, mode: str) -> np.ndarray:
+    """
+    Match ground-truth spans to predicted spans of the same query and category
+
+    Modes:
+        exact:   identical [start, end)
+        fuzzy:   intersection-over-union >= FUZZY_IOU_THRESHOLD
+        overlap: any shared character
+
+    Returns:
+        Array of length len(gt) with the matched prediction index or -1
+    """
+    gt_index, pred_index = _candidate_pairs(gt, pred)
+    gs, ge = gt.start[gt_index], gt.end[gt_index]
+    ps, pe = pred.start[pred_index], pred.end[pred_index]
+
+    located = gs >= 0
+    if mode == "exact":
+        keep = located & (gs == ps) & (ge == pe)
+    else:
+        intersection = np.minimum(ge, pe) - np.maximum(gs, ps)
+        if mode == "overlap":
+            keep = located & (intersection > 0)
+        elif mode == "fuzzy":
+            union = np.maximum(ge, pe) - np.minimum(gs, ps)
+            keep = located & (intersection > 0) & (intersection >= FUZZY_IOU_THRESHOLD * union)
+        else:
+            raise ValueError(f"Unknown match mode: {mode}")
+
+    return _greedy_assign(gt_index[keep], pred_index[keep], len(gt), len(pred))
+
+
+def _label_tokens(token_qid: np.ndarray, token_start: np.ndarray, token_end: np.ndarray,
+                  spans: SpanTable) -> np.ndarray:
+    """
+    Category code of the span covering each token, or -1
+
+    A token is labeled by the last span that starts before the token ends,
+    provided that span reaches into the token.
+    """
+    labels = np.full(len(token_qid), -1, dtype=np.int32)
+    valid = spans.start >= 0
+    if not valid.any() or len(token_qid) == 0:
+        return labels
+
+    # Global coordinates: queries laid end to end with a gap between them
+    stride = int(max(token_end.max(), spans.end.max())) + 1
+    span_start = spans.qid[valid] * stride + spans.start[valid]
+    span_end = spans.qid[valid] * stride + spans.end[valid]
+    span_code = spans.code[valid]
+
+    order = np.argsort(span_start, kind="stable")
+    span_start, span_end, span_code = span_start[order], span_end[order], span_code[order]
+
+    global_start = token_qid * stride + token_start
+    global_end = token_qid * stride + token_end
+    last = np.searchsorted(span_start, global_end, side="left") - 1
+    has_span = last >= 0
+    covered = np.zeros(len(token_qid), dtype=bool)
+    covered[has_span] = span_end[last[has_span]] > global_start[has_span]
+    labels[covered] = span_code[last[covered]]
+    return labels
+
+
+def tokenize_corpus(texts: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Whitespace token spans for every query as (qid, start, end) arrays"""
+    joined = "\n".join(texts)
+    query_starts = np.cumsum([0] + [len(text) + 1 for text in texts[:-1]]) if texts else np.zeros(0)
+    spans = np.array([m.span() for m in TOKEN_PATTERN.finditer(joined)], dtype=np.int64).reshape(-1, 2)
+    qid = np.searchsorted(query_starts, spans[:, 0], side="right") - 1
+    offsets = np.asarray(query_starts, dtype=np.int64)[qid] if len(qid) else np.zeros(0, dtype=np.int64)
+    return qid, spans[:, 0] - offsets, spans[:, 1] - offsets
+
+
+def compute_span_metrics(
+    gt: SpanTable,
+    pred: SpanTable,
+    n_queries: int,
+    categories: List[str],
+    texts: Optional[List[str]] = None
+) -> Dict[str, Any]:
+    """
+    Compute TP/FP/FN for every match mode, per query and per category
+
+    Args:
+        gt: Ground-truth spans
+        pred: Predicted spans
+        n_queries: Number of queries in the corpus
+        categories: Category names indexed by code
+        texts: Query texts; enables token-level metrics when given
+
+    Returns:
+        Dict with "per_query" and "per_category" sections. per_query maps
+        "tp_<mode>"/"fp_<mode>"/"fn_<mode>" to arrays of length n_queries;
+        per_category maps category name to {"tp_<mode>": int, ...}
+    """
+    n_codes = len(categories)
+    gt_per_query = np.bincount(gt.qid, minlength=n_queries)
+    pred_per_query = np.bincount(pred.qid, minlength=n_queries)
+    gt_per_code = np.bincount(gt.code, minlength=n_codes)
+    pred_per_code = np.bincount(pred.code, minlength=n_codes)
+
+    per_query: Dict[str, np.ndarray] = {
+        "ground_truth_count": gt_per_query,
+        "detected_count": pred_per_query,
+    }
+    per_code: Dict[str, np.ndarray] = {}
+
+    for mode in MATCH_MODES:
+        matched = match_spans(gt, pred, mode) >= 0
+        tp_query = np.bincount(gt.qid[matched], minlength=n_queries)
+        tp_code = np.bincount(gt.code[matched], minlength=n_codes)
+        per_query[f"tp_{mode}"] = tp_query
+        per_query[f"fp_{mode}"] = pred_per_query - tp_query
+        per_query[f"fn_{mode}"] = gt_per_query - tp_query
+        per_code[f"tp_{mode}"] = tp_code
+        per_code[f"fp_{mode}"] = pred_per_code - tp_code
+        per_code[f"fn_{mode}"] = gt_per_code - tp_code
+
+    if texts is not None:
+        token_qid, token_start, token_end = tokenize_corpus(texts)
+        gt_label = _label_tokens(token_qid, token_start, token_end, gt)
+        pred_label = _label_tokens(token_qid, token_start, token_end, pred)
+        tp = (gt_label >= 0) & (gt_label == pred_label)
+        fp = (pred_label >= 0) & ~tp
+        fn = (gt_label >= 0) & ~tp
+        per_query["tp_token"] = np.bincount(token_qid[tp], minlength=n_queries)
+        per_query["fp_token"] = np.bincount(token_qid[fp], minlength=n_queries)
+        per_query["fn_token"] = np.bincount(token_qid[fn], minlength=n_queries)
+        per_code["tp_token"] = np.bincount(gt_label[tp], minlength=n_codes)
+        per_code["fp_token"] = np.bincount(pred_label[fp], minlength=n_codes)
+        per_code["fn_token"] = np.bincount(gt_label[fn], minlength=n_codes)
+
+    per_category = {
+        category: {name: int(counts[code]) for name, counts in per_code.items()}
+        for code, category in enumerate(categories)
+    }
+    for category, counts in per_category.items():
+        counts["ground_truth_count"] = int(gt_per_code[categories.index(category)])
+        counts["detected_count"] = int(pred_per_code[categories.index(category)])
+
+    return {"per_query": per_query, "per_category": per_category}
+
+
+def load_trace_records(trace_sources: List[str]) -> Dict[str, Dict[str, Any]]:
+    """
+    Load traces from legacy trace directories and/or trace store directories
+
+    Returns:
+        Dict mapping query_id to trace
+    """
+    traces = {}
+    for source in trace_sources:
+        if os.path.exists(os.path.join(source, "index.tsv")):
+            with TraceStore(source) as store:
+                for trace in store.scan():
+                    traces[str(trace["query_id"])] = trace
+            continue
+        for name in os.listdir(source):
+            if name.startswith("query_") and name.endswith("_trace.json"):
+                with open(os.path.join(source, name), "r", encoding="utf-8") as f:
+                    trace = json.load(f)
+                traces[str(trace["query_id"])] = trace
+    return traces
+
+
+def build_corpus(
+    dataset_file: str,
+    traces: Dict[str, Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], SpanTable, SpanTable, List[str]]:
+    """
+    Pair every dataset query with its trace and build span tables
+
+    Ground-truth offsets come from the tag's start/end when present,
+    otherwise from the first occurrence of its value in the query.
+
+    Returns:
+        Tuple of (rows, gt_spans, pred_spans, categories), where rows hold
+        query_id, query_text, detected entities and redacted text
+    """
+    categories: List[str] = []
+    codes: Dict[str, int] = {}
+
+    def code_of(category: str) -> int:
+        if category not in codes:
+            codes[category] = len(categories)
+            categories.append(category)
+        return codes[category]
+
+    rows = []
+    gt_rows = []
+    pred_rows = []
+    with DatasetReader(dataset_file) as reader:
+        for qid, record in enumerate(reader.iter_queries()):
+            text = record["query_text"]
+            trace = traces.get(record["query_id"], {})
+            detected = trace.get("presidio_entities_detected", [])
+            rows.append({
+                "query_id": record["query_id"],
+                "query_text": text,
+                "ground_truth_count": len(record["phi_entities"]),
+                "detected": detected,
+                "redacted_query": trace.get("presidio_output", ""),
+            })
+
+            for tag in record["phi_entities"]:
+                start = tag.get("start", -1)
+                end = tag.get("end", -1)
+                if start is None or start < 0:
+                    start = text.find(tag["value"])
+                    end = start + len(tag["value"]) if start >= 0 else -1
+                gt_rows.append((qid, code_of(tag["identifier_type"]), start, end))
+
+            for entity in detected:
+                pred_rows.append((qid, code_of(entity["hipaa_category"]), entity["start"], entity["end"]))
+
+    return rows, SpanTable.from_rows(gt_rows), SpanTable.from_rows(pred_rows), categories
+
+
+def write_detailed_results(
+    output_file: str,
+    rows: List[Dict[str, Any]],
+    metrics: Dict[str, Any],
+    extended: bool = False
+) -> None:
+    """
+    Write Presidio_detailed_results.csv
+
+    Args:
+        output_file: CSV path
+        rows: Rows from build_corpus
+        metrics: Result of compute_span_metrics
+        extended: Also write overlap and token-level columns
+    """
+    per_query = metrics["per_query"]
+    columns = list(DETAILED_RESULTS_COLUMNS)
+    extra = []
+    if extended:
+        extra = [f"{kind}_{mode}" for mode in ("overlap", "token") for kind in ("tp", "fp", "fn")
+                 if f"{kind}_{mode}" in per_query]
+        columns += extra
+
+    with open(output_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        for qid, row in enumerate(rows):
+            detected_entities = [
+                {
+                    "type": entity["hipaa_category"],
+                    "value": entity["text"],
+                    "start": entity["start"],
+                    "end": entity["end"],
+                    "score": entity["score"],
+                }
+                for entity in sorted(row["detected"], key=lambda e: (e["start"], e["end"]))
+            ]
+            values = [
+                row["query_id"],
+                row["query_text"],
+                row["ground_truth_count"] > 0,
+                row["ground_truth_count"],
+                len(row["detected"]),
+                repr(detected_entities),
+                row["redacted_query"],
+            ]
+            values += [int(per_query[f"{kind}_{mode}"][qid])
+                       for mode in ("exact", "fuzzy") for kind in ("tp", "fp", "fn")]
+            values += [int(per_query[name][qid]) for name in extra]
+            writer.writerow(values)
+
+
+def main():
+    """Main execution"""
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(description="Span-level metrics and Presidio_detailed_results.csv")
+    parser.add_argument("--dataset", default=os.path.join(base_dir, "synthetic_dataset.txt"),
+                        help="Path to synthetic_dataset.txt")
+    parser.add_argument("--traces", nargs="+",
+                        default=[os.path.join(base_dir, "Presidio_positive"),
+                                 os.path.join(base_dir, "Presidio_negative")],
+                        help="Trace directories or trace store directories")
+    parser.add_argument("--output", default=os.path.join(base_dir, "Presidio_detailed_results.csv"),
+                        help="Detailed results CSV to write")
+    parser.add_argument("--category-output", default=None,
+                        help="Optional JSON file for per-HIPAA-category metrics")
+    parser.add_argument("--extended", action="store_true",
+                        help="Add overlap and token-level columns to the CSV")
+    args = parser.parse_args()
+
+    traces = load_trace_records(args.traces)
+    rows, gt, pred, categories = build_corpus(args.dataset, traces)
+    metrics = compute_span_metrics(gt, pred, len(rows), categories,
+                                   texts=[row["query_text"] for row in rows])
+    write_detailed_results(args.output, rows, metrics, extended=args.extended)
+
+    print(f"Wrote {len(rows)} rows to {args.output}")
+    print(f"{'Category':<34} {'GT':>6} {'TP exact':>9} {'TP fuzzy':>9} {'TP overlap':>11}")
+    for category, counts in sorted(metrics["per_category"].items(), key=lambda item: -item[1]["ground_truth_count"]):
+        print(f"{category:<34} {counts['ground_truth_count']:>6} {counts['tp_exact']:>9} "
+              f"{counts['tp_fuzzy']:>9} {counts['tp_overlap']:>11}")
+
+    if args.category_output:
+        with open(args.category_output, "w", encoding="utf-8") as f:
+            json.dump(metrics["per_category"], f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
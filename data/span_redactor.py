@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+"""
+Direct Span-Splice Redaction
+Replaces analyzer spans with [REDACTED_<HIPAA>] tokens from a precomputed table,
+producing exactly the text AnonymizerEngine's replace operator would
+"""
+
+import re
+from typing import Any, Callable, Dict, Iterable, List
+
+from presidio_analyzer import RecognizerResult
+
+# AnonymizerEngine merges same-type neighbours whose gap matches ^( )+$,
+# which also accepts one trailing newline
+MERGEABLE_GAP = re.compile(r" +\n?")
+
+
+def _has_conflict(span: List[Any], other: List[Any]) -> bool:
+    """A span loses to an equal span with a higher or equal score, or to one containing it"""
+    if span[0] == other[0] and span[1] == other[1]:
+        return span[3] <= other[3]
+    return other[0] <= span[0] and other[1] >= span[1]
+
+
+def resolve_spans(text: str, analyzer_results: List[RecognizerResult]) -> List[List[Any]]:
+    """
+    Resolve overlapping analyzer results the way AnonymizerEngine does
+
+    Spans are [start, end, entity_type, score] lists, mutated in place just
+    as AnonymizerEngine mutates its copies:
+    1. Same-type spans sharing at least one character become their union
+       with the higher score.
+    2. A span is dropped when another span has the same offsets and a higher
+       or equal score, or contains it. Partial overlaps of different types
+       both survive.
+    3. Same-type neighbours separated only by spaces are merged.
+
+    Returns:
+        Surviving spans, in the order AnonymizerEngine would hold them
+    """
+    spans = sorted(
+        ([result.start, result.end, result.entity_type, result.score] for result in analyzer_results),
+        key=lambda span: (span[0], span[1])
+    )
+
+    # 1. Union intersecting spans of one type. The first intersecting span in
+    # `others` absorbs the current one, so the scan order matches the engine's.
+    others = list(spans)
+    unioned = []
+    for span in spans:
+        others.remove(span)
+        for other in others:
+            if other[2] == span[2] and min(span[1], other[1]) > max(span[0], other[0]):
+                other[0] = min(span[0], other[0])
+                other[1] = max(span[1], other[1])
+                other[3] = max(span[3], other[3])
+                break
+        else:
+            others.append(span)
+            unioned.append(span)
+
+    # 2. Drop spans that lose on score (same offsets) or length (contained)
+    others = list(unioned)
+    resolved = []
+    for span in unioned:
+        others.remove(span)
+        if not any(_has_conflict(span, other) for other in others):
+            others.append(span)
+            resolved.append(span)
+
+    # 3. Merge same-type neighbours with only spaces between them
+    merged = []
+    previous = None
+    for span in resolved:
+        if previous is not None and previous[2] == span[2] \
+                and MERGEABLE_GAP.fullmatch(text, previous[1], span[0]):
+            merged.remove(previous)
+            span[0] = previous[0]
+        merged.append(span)
+        previous = span
+    return merged
+
+
+class SpanRedactor:
+    """
+    Redaction engine holding one replacement token per entity type
+
+    Tokens are derived from entity_mapping once per type, for the types
+    given up front and for any other type the first time it is seen, so a
+    query costs no operator objects. The surviving spans are spliced into
+    the output in one left-to-right pass over the text.
+    """
+
+    def __init__(self, entity_mapping: Callable[[str], str], entity_types: Iterable[str] = ()):
+        self.entity_mapping = entity_mapping
+        self.tokens: Dict[str, str] = {}
+        for entity_type in entity_types:
+            self.token(entity_type)
+
+    def token(self, entity_type: str) -> str:
+        """Replacement text for an entity type"""
+        token = self.tokens.get(entity_type)
+        if token is None:
+            token = self.tokens[entity_type] = f"[REDACTED_{self.entity_mapping(entity_type)}]"
+        return token
+
+    def redact(self, text: str, analyzer_results: List[RecognizerResult]) -> str:
+        """
+        Return text with every resolved span replaced by its token
+
+        AnonymizerEngine replaces right to left, cutting each span off where
+        the span after it starts; reading the same cut points left to right
+        keeps partial overlaps identical.
+        """
+        if not analyzer_results:
+            return text
+        # Stable descending sort, as the engine orders spans for replacement;
+        # reversed, it gives the left-to-right order with ties kept the same
+        ordered = sorted(resolve_spans(text, analyzer_results), key=lambda span: (span[0], span[1]), reverse=True)
+        ordered.reverse()
+
+        pieces = []
+        cursor = 0
+        for i, (start, end, entity_type, _) in enumerate(ordered):
+            pieces.append(text[cursor:start])
+            pieces.append(self.token(entity_type))
+            cut = ordered[i + 1][0] if i + 1 < len(ordered) else len(text)
+            cursor = min(end, cut)
+        pieces.append(text[cursor:])
+        return "".join(pieces)
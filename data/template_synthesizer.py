@@ -0,0 +1,561 @@
+#!/usr/bin/env python3
+"""
+Offline Template-Based Corpus Synthesizer
+Mines query skeletons from synthetic_dataset.txt and fills them with local
+surrogate PHI to stream millions of labeled queries without Azure OpenAI
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import time
+from collections import Counter
+from multiprocessing import Pool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dataset_index import DatasetReader
+
+# ============================================================================
+# Local surrogate lists
+# ============================================================================
+
+FIRST_NAMES = [
+    "Aaron", "Abigail", "Adrian", "Alice", "Amara", "Andre", "Anita", "Arjun", "Beatrice", "Benjamin",
+    "Bianca", "Caleb", "Camila", "Carlos", "Chloe", "Daniel", "Daria", "Deepa", "Elena", "Elias",
+    "Emily", "Farah", "Felix", "Fiona", "Gabriel", "Grace", "Hannah", "Hector", "Ines", "Isaac",
+    "Jasmine", "Javier", "Joanna", "Kai", "Keisha", "Kenji", "Laura", "Leon", "Lucia", "Malik",
+    "Marta", "Mateo", "Naomi", "Nikhil", "Nora", "Omar", "Olivia", "Priya", "Quentin", "Rachel",
+    "Rafael", "Rosa", "Samuel", "Sofia", "Tariq", "Teresa", "Uma", "Victor", "Wendy", "Yusuf",
+]
+
+LAST_NAMES = [
+    "Abbott", "Alvarez", "Bennett", "Brooks", "Castillo", "Chen", "Dawson", "Delgado", "Ellis", "Farouk",
+    "Fischer", "Garner", "Gupta", "Hale", "Herrera", "Ibarra", "Jensen", "Kaur", "Kowalski", "Lambert",
+    "Lindqvist", "Marsh", "Mendoza", "Nakamura", "Novak", "Okafor", "Ortega", "Park", "Patel", "Quinn",
+    "Ramos", "Reyes", "Santos", "Schmidt", "Shah", "Sullivan", "Tanaka", "Torres", "Ueda", "Vance",
+    "Vargas", "Walsh", "Weber", "Whitaker", "Xu", "Yamada", "Young", "Zamora", "Zhang", "Ziegler",
+]
+
+NAME_TITLES = {"Dr.", "Mr.", "Mrs.", "Ms.", "Miss", "Prof."}
+
+FACILITY_PLACES = [
+    "Alder Creek", "Bayview", "Birchwood", "Brookside", "Cedar Ridge", "Clearwater", "Crestview", "Elmhurst",
+    "Fairhaven", "Glenwood", "Harborview", "Highland", "Kingsbridge", "Lakeshore", "Maple Grove", "Meadowbrook",
+    "Northfield", "Oak Hollow", "Pine Valley", "Ridgecrest", "Riverbend", "Silver Lake", "Stonebridge",
+    "Summit", "Westbrook", "Willow Park",
+]
+
+FACILITY_KINDS = [
+    "Hospital", "Medical Center", "Clinic", "Health Center", "Regional Medical Center", "General Hospital",
+    "Community Hospital", "Family Practice", "Urgent Care", "Cancer Center", "Children's Hospital",
+]
+
+SAINTS = ["Agnes", "Brendan", "Catherine", "Dominic", "Elizabeth", "Francis", "Gregory", "Helena", "Luke", "Martin"]
+
+STREET_NAMES = ["Ash", "Birch", "Chestnut", "Harbor", "Hillcrest", "Juniper", "Linden", "Orchard", "Sycamore", "Walnut"]
+STREET_SUFFIXES = ["Street", "Avenue", "Road", "Lane", "Drive", "Boulevard"]
+
+EMAIL_DOMAINS = ["example.com", "example.org", "example.net", "mail.example.com", "clinic.example.org"]
+
+MONTHS = [
+    "January", "February", "March", "April", "May", "June",
+    "July", "August", "September", "October", "November", "December",
+]
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+SURROGATE_YEARS = (2015, 2025)
+
+DIGITS = "0123456789"
+UPPERCASE = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+LOWERCASE = UPPERCASE.lower()
+
+# ============================================================================
+# Surrogate generation
+# ============================================================================
+
+DATE_TOKEN = re.compile(
+    r"(?P<numeric>\b\d{1,4}(?P<sep>[/-])\d{1,2}(?:(?P=sep)\d{2,4})?\b)"
+    r"|(?P<month>\b(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec)[a-z]*\b\.?)"
+    r"|(?P<weekday>\b(?:Mon|Tues|Wednes|Thurs|Fri|Satur|Sun)day\b)"
+    r"|(?P<short_year>'\d{2}\b)"
+    r"|(?P<year>\b\d{4}\b)"
+    r"|(?P<day>\b\d{1,2}(?P<suffix>st|nd|rd|th)?\b)"
+)
+AGE_PATTERN = re.compile(r"\b(\d{1,3})(?=[- ]year[- ]old\b)")
+
+
+def _ordinal_suffix(day: int) -> str:
+    if 10 <= day % 100 <= 20:
+        return "th"
+    return {1: "st", 2: "nd", 3: "rd"}.get(day % 10, "th")
+
+
+def _with_case(word: str, template: str) -> str:
+    """Apply the capitalization style of template to word"""
+    if template.isupper() and len(template) > 1:
+        return word.upper()
+    if template.islower():
+        return word.lower()
+    return word
+
+
+def surrogate_date(value: str, rng: random.Random) -> str:
+    """
+    Replace every date component of value with one random date, keeping the
+    original layout ("May 30th, 2022", "03/05/2021", "Feb 9 '23", ...)
+    """
+    year = rng.randint(*SURROGATE_YEARS)
+    month = rng.randint(1, 12)
+    day = rng.randint(1, 28)
+
+    def replace(match: re.Match) -> str:
+        if match.group("numeric"):
+            sep = match.group("sep")
+            parts = match.group("numeric").split(sep)
+            fields = ["year", month, day] if len(parts[0]) == 4 else [month, day, "year"]
+            rendered = []
+            for original, field in zip(parts, fields):
+                if field == "year":
+                    rendered.append(f"{year % 100:02d}" if len(original) == 2 else str(year))
+                else:
+                    rendered.append(str(field).zfill(len(original)))
+            return sep.join(rendered)
+        if match.group("month"):
+            original = match.group("month")
+            full = MONTHS[month - 1]
+            name = full if original.rstrip(".") in MONTHS else full[:3]
+            return name + ("." if original.endswith(".") else "")
+        if match.group("weekday"):
+            return rng.choice(WEEKDAYS)
+        if match.group("short_year"):
+            return f"'{year % 100:02d}"
+        if match.group("year"):
+            return str(year)
+        return f"{day}{_ordinal_suffix(day)}" if match.group("suffix") else str(day)
+
+    return DATE_TOKEN.sub(replace, value)
+
+
+def surrogate_name(value: str, rng: random.Random) -> str:
+    """Random name with the same shape: titles kept, initials stay initials"""
+    tokens = value.split()
+    initials = [re.fullmatch(r"[A-Za-z]\.?", token) is not None for token in tokens]
+    words = [i for i, token in enumerate(tokens) if token not in NAME_TITLES and not initials[i]]
+    rendered = []
+    for i, token in enumerate(tokens):
+        if token in NAME_TITLES:
+            rendered.append(token)
+        elif initials[i]:
+            rendered.append(rng.choice("ABCDEFGHJKLMNPRSTW") + token[1:])
+        else:
+            # The last full word is a surname ("Dr. Smith", "L. Wang") unless
+            # only an initial follows it ("Anna S.")
+            is_given = i != words[-1] or (i + 1 < len(tokens) and initials[i + 1])
+            name = rng.choice(FIRST_NAMES if is_given else LAST_NAMES)
+            rendered.append(_with_case(name, token))
+    return " ".join(rendered)
+
+
+def surrogate_location(value: str, rng: random.Random) -> str:
+    """Random facility name, or a street address when value starts with a number"""
+    if value[:1].isdigit():
+        return f"{rng.randint(10, 9899)} {rng.choice(STREET_NAMES)} {rng.choice(STREET_SUFFIXES)}"
+    style = rng.random()
+    if style < 0.15:
+        return f"St. {rng.choice(SAINTS)}'s"
+    if style < 0.25:
+        return rng.choice(FACILITY_PLACES)
+    return f"{rng.choice(FACILITY_PLACES)} {rng.choice(FACILITY_KINDS)}"
+
+
+def surrogate_email(value: str, rng: random.Random) -> str:
+    """Random address whose local part follows the original first.last / flast / digits layout"""
+    if "@" not in value:
+        return reshape_identifier(value, rng)
+    local = value.split("@", 1)[0]
+    first = rng.choice(FIRST_NAMES).lower()
+    last = rng.choice(LAST_NAMES).lower()
+    separator = next((char for char in "._" if char in local), "")
+    if separator:
+        tail = local.split(separator, 1)[1].rstrip("0123456789")
+        local_part = f"{first}{separator}{last[0] if len(tail) == 1 else last}"
+    else:
+        local_part = f"{first[0]}{last}" if len(local) > 2 else first
+    if local[-1:].isdigit():
+        local_part += str(rng.randint(10, 99))
+    return f"{local_part}@{rng.choice(EMAIL_DOMAINS)}"
+
+
+def surrogate_ip(value: str, rng: random.Random) -> str:
+    """Random private IPv4 address"""
+    return f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+
+
+def reshape_identifier(value: str, rng: random.Random) -> str:
+    """
+    Redraw every digit and letter of the tokens that contain a digit
+
+    "MRN: AB-123456" becomes "MRN: QX-804217": labels such as "MRN:" or
+    "patient ID" are kept, separators and lengths are preserved, and each
+    digit run starts with a non-zero digit.
+    """
+    rendered = []
+    for token in value.split(" "):
+        if not any(char.isdigit() for char in token):
+            rendered.append(token)
+            continue
+        chars = []
+        previous_digit = False
+        for char in token:
+            alphabet = None
+            if char.isdigit():
+                alphabet = DIGITS if previous_digit else DIGITS[1:]
+            elif char.isupper():
+                alphabet = UPPERCASE
+            elif char.islower():
+                alphabet = LOWERCASE
+            # random() indexing is several times cheaper than randint per character
+            chars.append(alphabet[int(rng.random() * len(alphabet))] if alphabet else char)
+            previous_digit = char.isdigit()
+        rendered.append("".join(chars))
+    return " ".join(rendered)
+
+
+SURROGATES = {
+    "NAME": surrogate_name,
+    "GEOGRAPHIC_LOCATION": surrogate_location,
+    "DATE": surrogate_date,
+    "EMAIL_ADDRESS": surrogate_email,
+    "IP_ADDRESS": surrogate_ip,
+}
+
+
+def surrogate_value(identifier_type: str, value: str, rng: random.Random) -> str:
+    """Surrogate for one PHI value; identifier-like types keep their format"""
+    return SURROGATES.get(identifier_type, reshape_identifier)(value, rng)
+
+
+# ============================================================================
+# Template mining
+# ============================================================================
+
+def mine_template(query_text: str, phi_entities: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """
+    Turn one labeled query into a skeleton
+
+    Every occurrence of each tag value becomes a slot (longest values are
+    placed first, so "2023" inside "April 12, 2023" is not a separate slot)
+    and ages in the surrounding text become age slots.
+
+    Returns:
+        Dict with "pieces" - a list of ("text", str), ("tag", tag_index)
+        and ("age", int) - and "tags" [(identifier_type, value)], or None
+        when a tag value cannot be located in the query
+    """
+    tags = [(tag['identifier_type'], tag['value']) for tag in phi_entities]
+    claimed: List[Tuple[int, int, int]] = []
+    for tag_index in sorted(range(len(tags)), key=lambda i: -len(tags[i][1])):
+        value = tags[tag_index][1]
+        if not value:
+            return None
+        placed = False
+        start = query_text.find(value)
+        while start != -1:
+            end = start + len(value)
+            if all(end <= s or start >= e for s, e, _ in claimed):
+                claimed.append((start, end, tag_index))
+                placed = True
+            start = query_text.find(value, start + 1)
+        if not placed:
+            return None
+
+    pieces: List[Tuple[str, Any]] = []
+
+    def add_text(text: str) -> None:
+        position = 0
+        for match in AGE_PATTERN.finditer(text):
+            if match.start() > position:
+                pieces.append(("text", text[position:match.start()]))
+            pieces.append(("age", int(match.group(1))))
+            position = match.end()
+        if position < len(text):
+            pieces.append(("text", text[position:]))
+
+    position = 0
+    for start, end, tag_index in sorted(claimed):
+        add_text(query_text[position:start])
+        pieces.append(("tag", tag_index))
+        position = end
+    add_text(query_text[position:])
+    return {"pieces": pieces, "tags": tags}
+
+
+def mine_templates(dataset_file: str) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Mine skeletons from every well-formed query of a dataset file
+
+    Returns:
+        Tuple of (templates, number of queries skipped because a tag value
+        does not occur verbatim in the query)
+    """
+    templates = []
+    skipped = 0
+    with DatasetReader(dataset_file) as reader:
+        for record in reader.iter_queries():
+            entities = [tag for tag in record['phi_entities'] if 'identifier_type' in tag and 'value' in tag]
+            template = mine_template(record['query_text'], entities)
+            if template is None:
+                skipped += 1
+            else:
+                templates.append(template)
+    return templates, skipped
+
+
+def parse_dataset_statistics(statistics_file: str) -> Dict[str, Dict[Any, int]]:
+    """
+    Read the PHI type and query complexity distributions from dataset_statistics.txt
+
+    Returns:
+        Dict with "phi_types" {identifier_type: count} and
+        "complexity" {phi_elements_per_query: query_count}
+    """
+    distributions: Dict[str, Dict[Any, int]] = {"phi_types": {}, "complexity": {}}
+    headers = {"PHI TYPE DISTRIBUTION": "phi_types", "QUERY COMPLEXITY DISTRIBUTION": "complexity"}
+    section = None
+    with open(statistics_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip().isupper() and not line.startswith(" "):
+                section = headers.get(line.strip())
+            elif section == "phi_types":
+                match = re.match(r"\s+([A-Z_]+): ([\d,]+) \(", line)
+                if match:
+                    distributions["phi_types"][match.group(1)] = int(match.group(2).replace(",", ""))
+            elif section == "complexity":
+                match = re.match(r"\s+(\d+) PHI elements: ([\d,]+) queries", line)
+                if match:
+                    distributions["complexity"][int(match.group(1))] = int(match.group(2).replace(",", ""))
+    return distributions
+
+
+def template_weights(templates: List[Dict[str, Any]], complexity: Dict[int, int]) -> List[float]:
+    """
+    Sampling weight per template so PHI-per-query follows `complexity`
+
+    Each complexity bucket's share is split evenly across the templates
+    with that many tags. Buckets without templates are dropped; with no
+    distribution every template gets the same weight.
+    """
+    bucket_sizes = Counter(len(template["tags"]) for template in templates)
+    if not complexity:
+        return [1.0] * len(templates)
+    return [
+        complexity.get(len(template["tags"]), 0) / bucket_sizes[len(template["tags"])]
+        for template in templates
+    ]
+
+
+# ============================================================================
+# Synthesis
+# ============================================================================
+
+def render_query(template: Dict[str, Any], rng: random.Random) -> Tuple[str, List[Dict[str, Any]]]:
+    """
+    Fill one skeleton
+
+    Returns:
+        Tuple of (query_text, tags) where each tag carries identifier_type,
+        value and the start/end offsets of its first occurrence
+    """
+    values = [surrogate_value(identifier_type, value, rng) for identifier_type, value in template["tags"]]
+    offsets: List[Optional[int]] = [None] * len(values)
+    parts = []
+    position = 0
+    for kind, payload in template["pieces"]:
+        if kind == "text":
+            text = payload
+        elif kind == "tag":
+            text = values[payload]
+            if offsets[payload] is None:
+                offsets[payload] = position
+        else:
+            text = str(max(1, payload + rng.randint(-5, 5)))
+        parts.append(text)
+        position += len(text)
+
+    tags = [
+        {
+            "identifier_type": identifier_type,
+            "value": value,
+            "start": start,
+            "end": start + len(value),
+        }
+        for (identifier_type, _), value, start in zip(template["tags"], values, offsets)
+    ]
+    return "".join(parts), tags
+
+
+def format_block(query_text: str, tags: List[Dict[str, Any]]) -> str:
+    """One ===QUERY=== / ===PHI_TAGS=== block as written by generate_phi_queries"""
+    tag_lines = "".join(json.dumps(tag) + "\n" for tag in tags)
+    return f"===QUERY===\n{query_text}\n===PHI_TAGS===\n{tag_lines}\n"
+
+
+# Worker-process state, set once per process by _init_worker
+_worker_templates: List[Dict[str, Any]] = []
+_worker_cum_weights: List[float] = []
+_worker_seed = 0
+
+
+def _init_worker(templates: List[Dict[str, Any]], weights: List[float], seed: int) -> None:
+    """Pool initializer: keep the templates and sampling weights in the worker"""
+    global _worker_templates, _worker_cum_weights, _worker_seed
+    _worker_templates = templates
+    _worker_cum_weights = []
+    running = 0.0
+    for weight in weights:
+        running += weight
+        _worker_cum_weights.append(running)
+    _worker_seed = seed
+
+
+def synthesize_chunk(task: Tuple[int, int]) -> Tuple[str, Counter, int]:
+    """
+    Render one chunk of queries in the worker
+
+    The chunk's generator is seeded from (seed, chunk_index) only, so the
+    output does not depend on how many workers render it.
+
+    Args:
+        task: (chunk_index, number_of_queries)
+
+    Returns:
+        Tuple of (dataset text for the chunk, PHI type counts, queries with PHI)
+    """
+    chunk_index, count = task
+    rng = random.Random(f"{_worker_seed}:{chunk_index}")
+    chosen = rng.choices(_worker_templates, cum_weights=_worker_cum_weights, k=count)
+    blocks = []
+    type_counts: Counter = Counter()
+    with_phi = 0
+    for template in chosen:
+        query_text, tags = render_query(template, rng)
+        blocks.append(format_block(query_text, tags))
+        for tag in tags:
+            type_counts[tag["identifier_type"]] += 1
+        with_phi += bool(tags)
+    return "".join(blocks), type_counts, with_phi
+
+
+def iter_synthesized_chunks(
+    templates: List[Dict[str, Any]],
+    weights: List[float],
+    count: int,
+    seed: int = 0,
+    workers: int = 1,
+    chunk_size: int = 5000
+) -> Iterator[Tuple[str, Counter, int]]:
+    """
+    Yield synthesize_chunk results for `count` queries in chunk order
+
+    Args:
+        templates: Skeletons from mine_templates
+        weights: Per-template sampling weights
+        count: Total number of queries
+        seed: Seed; the same seed, count and chunk_size give identical output
+        workers: Number of rendering processes (1 = in-process)
+        chunk_size: Queries per chunk
+
+    Yields:
+        (dataset text, PHI type counts, queries with PHI) per chunk
+    """
+    tasks = [(i, min(chunk_size, count - start)) for i, start in enumerate(range(0, count, chunk_size))]
+    if workers <= 1:
+        _init_worker(templates, weights, seed)
+        for task in tasks:
+            yield synthesize_chunk(task)
+        return
+
+    with Pool(processes=workers, initializer=_init_worker, initargs=(templates, weights, seed)) as pool:
+        for result in pool.imap(synthesize_chunk, tasks):
+            yield result
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+
+    parser = argparse.ArgumentParser(
+        description="Synthesize labeled queries offline from the skeletons of synthetic_dataset.txt")
+    parser.add_argument("--count", type=int, default=1_000_000,
+                        help="Number of queries to write (default: %(default)s)")
+    parser.add_argument("--output", default=os.path.join(data_dir, "synthetic_dataset_scaled.txt"),
+                        help="Output dataset, or - for stdout (default: %(default)s)")
+    parser.add_argument("--dataset", default=os.path.join(data_dir, "synthetic_dataset.txt"),
+                        help="Dataset to mine skeletons from (default: %(default)s)")
+    parser.add_argument("--statistics", default=os.path.join(data_dir, "dataset_statistics.txt"),
+                        help="Distribution to sample PHI-per-query from (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Random seed (default: 0)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Rendering processes (default: all cores, %(default)s)")
+    parser.add_argument("--chunk-size", type=int, default=5000,
+                        help="Queries per worker task; part of the seed schedule (default: %(default)s)")
+    args = parser.parse_args()
+
+    # Keep stdout clean when the dataset itself is streamed there
+    log = sys.stderr if args.output == "-" else sys.stdout
+
+    print(f"Mining skeletons from {args.dataset}...", file=log)
+    templates, skipped = mine_templates(args.dataset)
+    print(f"✓ {len(templates)} skeletons ({skipped} skipped: tag value not found in query)", file=log)
+
+    distributions = {"phi_types": {}, "complexity": {}}
+    if os.path.exists(args.statistics):
+        distributions = parse_dataset_statistics(args.statistics)
+    else:
+        print(f"  {args.statistics} not found; sampling skeletons uniformly", file=log)
+    weights = template_weights(templates, distributions["complexity"])
+
+    print(f"Synthesizing {args.count:,} queries (seed {args.seed}, {args.workers} workers)...", file=log)
+    started = time.perf_counter()
+    type_counts: Counter = Counter()
+    written = 0
+    with_phi = 0
+    out = sys.stdout if args.output == "-" else open(args.output, 'w', encoding='utf-8')
+    try:
+        chunks = iter_synthesized_chunks(
+            templates, weights, args.count, args.seed, args.workers, args.chunk_size
+        )
+        for chunk_text, chunk_types, chunk_with_phi in chunks:
+            out.write(chunk_text)
+            type_counts.update(chunk_types)
+            with_phi += chunk_with_phi
+            written = min(args.count, written + args.chunk_size)
+            if written % (args.chunk_size * 20) == 0 or written == args.count:
+                print(f"  Wrote {written:,} queries...", file=log)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    elapsed = time.perf_counter() - started
+
+    total_phi = sum(type_counts.values())
+    print(f"\n✓ {written:,} queries in {elapsed:.1f}s ({written / elapsed:,.0f} queries/sec)", file=log)
+    print(f"  Queries with PHI: {with_phi:,} ({with_phi / written:.1%})", file=log)
+    print(f"  Total PHI Elements: {total_phi:,}", file=log)
+
+    source_types = distributions["phi_types"]
+    source_total = sum(source_types.values())
+    print("\nPHI TYPE DISTRIBUTION (synthesized vs source)", file=log)
+    for identifier_type, count in type_counts.most_common():
+        source_share = source_types.get(identifier_type, 0) / source_total if source_total else 0.0
+        print(f"  {identifier_type}: {count:,} ({count / total_phi:.1%} vs {source_share:.1%})", file=log)
+
+    if args.output != "-":
+        print(f"\nDataset written to {args.output}", file=log)
+
+
+if __name__ == "__main__":
+    main()
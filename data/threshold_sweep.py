@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Analyze-Once Score Threshold Sweep
+Stores every Presidio candidate span found at threshold 0.0, then recomputes
+recall, leaks, false positive rate and specificity for any threshold grid,
+globally or per HIPAA category, without running Presidio again
+"""
+
+import argparse
+import csv
+import json
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from leak_detection import PhiMatcher
+
+CANDIDATES_FORMAT = "presidio_candidate_spans/1"
+ROC_COLUMNS = [
+    "category", "threshold", "recall", "successfully_redacted", "leaked_phi",
+    "queries_with_leaks", "perfect_rate", "category_recall",
+    "false_positive_rate", "specificity", "queries_with_false_positives",
+    "precision", "retained_spans"
+]
+
+
+def collect_candidates(
+    queries: Iterator[Dict[str, Any]],
+    output_file: str,
+    batch_size: int = 32,
+    cache_path: Optional[str] = None
+) -> int:
+    """
+    Analyze every query once at score threshold 0.0 and store all candidate spans
+
+    Output is JSON lines: a header with the analyzer fingerprint, then one
+    record per query with its text, ground truth and candidates as
+    [entity_type, hipaa_category, start, end, score, recognizer].
+
+    Args:
+        queries: Rows with query_id, query_text and a phi_entities list
+        output_file: Candidate span file to write
+        batch_size: Number of texts per nlp.pipe batch
+        cache_path: Analysis cache database; may be the evaluation's cache,
+                    whose 0.35-threshold entries stay (the threshold is
+                    part of the analyzer fingerprint in every key)
+
+    Returns:
+        Number of queries stored
+    """
+    from analysis_cache import AnalysisCache, analyzer_fingerprint
+    from run_presidio_evaluation import (
+        ANALYZER_CONFIG,
+        analyze_batch_with_presidio,
+        initialize_presidio_analyzer,
+        map_presidio_entity_to_hipaa,
+        _chunked,
+    )
+
+    collect_config = dict(ANALYZER_CONFIG, score_threshold=0.0)
+    print(f"Initializing Presidio analyzer...")
+    analyzer = initialize_presidio_analyzer()
+    cache = AnalysisCache(cache_path, analyzer, collect_config) if cache_path else None
+
+    count = 0
+    try:
+        with open(output_file, 'w', encoding='utf-8') as f:
+            header = {
+                "format": CANDIDATES_FORMAT,
+                "analyzer_config": collect_config,
+                "production_threshold": ANALYZER_CONFIG["score_threshold"],
+                "analyzer_fingerprint": analyzer_fingerprint(analyzer, collect_config),
+            }
+            f.write(json.dumps(header) + '\n')
+
+            for rows in _chunked(queries, batch_size * 8):
+                texts = [row['query_text'] for row in rows]
+                all_results = analyze_batch_with_presidio(
+                    texts, analyzer, batch_size, cache=cache, score_threshold=0.0
+                )
+                for row, results in zip(rows, all_results):
+                    record = {
+                        "query_id": row['query_id'],
+                        "query_text": row['query_text'],
+                        "phi_entities": row['phi_entities'],
+                        "candidates": [
+                            [
+                                result.entity_type,
+                                map_presidio_entity_to_hipaa(result.entity_type),
+                                result.start,
+                                result.end,
+                                result.score,
+                                result.recognition_metadata.get("recognizer_name", "Unknown"),
+                            ]
+                            for result in results
+                        ],
+                    }
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    count += 1
+                print(f"  Analyzed {count} queries...")
+    finally:
+        if cache is not None:
+            cache.close()
+    return count
+
+
+class ThresholdSweep:
+    """
+    Vectorized re-scoring of stored candidate spans under score thresholds
+
+    A candidate span is kept when its score is at least the threshold of its
+    HIPAA category, matching the analyzer's score_threshold filter (removing
+    contained duplicates commutes with that filter). A ground truth value
+    leaks when some case-insensitive occurrence of it in the query overlaps no
+    kept span, which is when detect_phi_leaks would still find it in the
+    redacted output. A query without PHI is a false positive when any span is
+    kept.
+    """
+
+    def __init__(self, candidates_file: str):
+        self.header: Dict[str, Any] = {}
+        categories: Dict[str, int] = {}
+
+        def code(category: str) -> int:
+            return categories.setdefault(category, len(categories))
+
+        span_query, span_code, span_score, span_tp = [], [], [], []
+        entity_query, entity_code = [], []
+        # Values that fold to "" are reported as leaked by detect_phi_leaks
+        always_leaked = []
+        occurrence_entity = []
+        pair_occurrence, pair_span = [], []
+        positive_queries = negative_queries = 0
+        query_is_positive = []
+
+        with open(candidates_file, 'r', encoding='utf-8') as f:
+            for line_number, line in enumerate(f):
+                record = json.loads(line)
+                if line_number == 0 and record.get("format") == CANDIDATES_FORMAT:
+                    self.header = record
+                    continue
+
+                query_index = len(query_is_positive)
+                text = record["query_text"]
+                entities = record["phi_entities"]
+                query_is_positive.append(bool(entities))
+                if entities:
+                    positive_queries += 1
+                else:
+                    negative_queries += 1
+
+                first_span = len(span_query)
+                spans = record["candidates"]
+                for _, category, _, _, score, _ in spans:
+                    span_query.append(query_index)
+                    span_code.append(code(category))
+                    span_score.append(score)
+                    span_tp.append(False)
+
+                if not entities:
+                    continue
+
+                matcher = PhiMatcher([entity['value'] for entity in entities])
+                first_entity = len(entity_query)
+                for entity in entities:
+                    entity_query.append(query_index)
+                    entity_code.append(code(entity['type']))
+                for hit in matcher.scan(text):
+                    if hit["start"] == hit["end"]:
+                        always_leaked.append(first_entity + hit["pattern"])
+                        continue
+                    occurrence = len(occurrence_entity)
+                    occurrence_entity.append(first_entity + hit["pattern"])
+                    for offset, (_, _, start, end, _, _) in enumerate(spans):
+                        if start < hit["end"] and hit["start"] < end:
+                            pair_occurrence.append(occurrence)
+                            pair_span.append(first_span + offset)
+                            span_tp[first_span + offset] = True
+
+        self.categories = list(categories)
+        self.span_query = np.asarray(span_query, dtype=np.int64)
+        self.span_code = np.asarray(span_code, dtype=np.int64)
+        self.span_score = np.asarray(span_score, dtype=np.float64)
+        self.span_tp = np.asarray(span_tp, dtype=bool)
+        self.entity_query = np.asarray(entity_query, dtype=np.int64)
+        self.entity_code = np.asarray(entity_code, dtype=np.int64)
+        self.occurrence_entity = np.asarray(occurrence_entity, dtype=np.int64)
+        self.pair_occurrence = np.asarray(pair_occurrence, dtype=np.int64)
+        self.pair_span = np.asarray(pair_span, dtype=np.int64)
+        self.query_is_positive = np.asarray(query_is_positive, dtype=bool)
+        self.positive_queries = positive_queries
+        self.negative_queries = negative_queries
+        # Entities with no occurrence in their query can never be found in the output
+        self.entity_has_occurrence = np.bincount(
+            self.occurrence_entity, minlength=len(self.entity_query)
+        ) > 0
+        self.entity_always_leaked = np.zeros(len(self.entity_query), dtype=bool)
+        self.entity_always_leaked[np.asarray(always_leaked, dtype=np.int64)] = True
+        self.span_in_negative = ~self.query_is_positive[self.span_query]
+
+    def category_thresholds(self, default: float, overrides: Optional[Dict[str, float]] = None) -> np.ndarray:
+        """Per-category threshold vector (indexed by category code)"""
+        thresholds = np.full(len(self.categories), default, dtype=np.float64)
+        for category, threshold in (overrides or {}).items():
+            if category in self.categories:
+                thresholds[self.categories.index(category)] = threshold
+        return thresholds
+
+    def evaluate(self, thresholds: np.ndarray, category: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Score one threshold assignment
+
+        Args:
+            thresholds: Threshold per category code (see category_thresholds)
+            category: Also report recall restricted to this ground truth category
+
+        Returns:
+            Dict with the ROC_COLUMNS metrics (minus category/threshold)
+        """
+        kept = self.span_score >= thresholds[self.span_code]
+
+        broken = np.bincount(
+            self.pair_occurrence, weights=kept[self.pair_span], minlength=len(self.occurrence_entity)
+        ) > 0
+        intact = np.bincount(
+            self.occurrence_entity, weights=~broken, minlength=len(self.entity_query)
+        ) > 0
+        leaked = (intact & self.entity_has_occurrence) | self.entity_always_leaked
+
+        total_phi = len(self.entity_query)
+        leaked_phi = int(leaked.sum())
+        queries_with_leaks = int(np.count_nonzero(np.bincount(self.entity_query[leaked])))
+
+        false_positive_queries = int(np.count_nonzero(
+            np.bincount(self.span_query[kept & self.span_in_negative])
+        ))
+        kept_count = int(kept.sum())
+
+        category_recall = None
+        if category is not None and category in self.categories:
+            in_category = self.entity_code == self.categories.index(category)
+            category_total = int(in_category.sum())
+            if category_total:
+                category_recall = 1 - int((leaked & in_category).sum()) / category_total
+
+        return {
+            "recall": (total_phi - leaked_phi) / total_phi if total_phi else 1.0,
+            "successfully_redacted": total_phi - leaked_phi,
+            "leaked_phi": leaked_phi,
+            "queries_with_leaks": queries_with_leaks,
+            "perfect_rate": (self.positive_queries - queries_with_leaks) / self.positive_queries
+            if self.positive_queries else 0,
+            "category_recall": category_recall,
+            "false_positive_rate": false_positive_queries / self.negative_queries
+            if self.negative_queries else 0,
+            "specificity": (self.negative_queries - false_positive_queries) / self.negative_queries
+            if self.negative_queries else 1.0,
+            "queries_with_false_positives": false_positive_queries,
+            "precision": int((kept & self.span_tp).sum()) / kept_count if kept_count else 1.0,
+            "retained_spans": kept_count,
+        }
+
+    def sweep(
+        self,
+        grid: List[float],
+        category: Optional[str] = None,
+        base_threshold: float = 0.35,
+        overrides: Optional[Dict[str, float]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        Evaluate a grid of thresholds
+
+        With category=None the threshold is applied to every category (a
+        global sweep, after any overrides). Otherwise only that category's
+        threshold moves and the rest stay at base_threshold/overrides.
+        """
+        rows = []
+        for threshold in grid:
+            if category is None:
+                thresholds = self.category_thresholds(threshold)
+            else:
+                thresholds = self.category_thresholds(base_threshold, overrides)
+                if category in self.categories:
+                    thresholds[self.categories.index(category)] = threshold
+            row = {"category": category or "ALL", "threshold": round(threshold, 6)}
+            row.update(self.evaluate(thresholds, category))
+            rows.append(row)
+        return rows
+
+
+def roc_auc(rows: List[Dict[str, Any]]) -> float:
+    """Area under recall vs false positive rate for a global sweep"""
+    points = sorted({(row["false_positive_rate"], row["recall"]) for row in rows})
+    points = [(0.0, 0.0)] + points + [(1.0, 1.0)]
+    area = 0.0
+    for (x0, y0), (x1, y1) in zip(points, points[1:]):
+        area += (x1 - x0) * (y0 + y1) / 2
+    return area
+
+
+def parse_grid(spec: str) -> List[float]:
+    """Parse "start:stop:step" (inclusive) or a comma-separated list"""
+    if ':' in spec:
+        start, stop, step = (float(part) for part in spec.split(':'))
+        count = int(round((stop - start) / step)) + 1
+        return [round(start + i * step, 10) for i in range(count)]
+    return [float(value) for value in spec.split(',') if value]
+
+
+def parse_overrides(spec: Optional[str]) -> Dict[str, float]:
+    """Parse "NAME=0.5,DATE=0.6" into a category threshold map"""
+    overrides = {}
+    for item in (spec or '').split(','):
+        if item:
+            category, threshold = item.split('=')
+            overrides[category.strip()] = float(threshold)
+    return overrides
+
+
+def write_table(output_file: str, rows: List[Dict[str, Any]]) -> None:
+    """Write sweep rows as CSV"""
+    with open(output_file, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=ROC_COLUMNS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({
+                name: (f"{value:.6f}" if isinstance(value, float) else ("" if value is None else value))
+                for name, value in row.items()
+            })
+
+
+def main():
+    """Main execution"""
+    data_dir = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Analyze once, then sweep Presidio score thresholds offline")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    collect_parser = subparsers.add_parser("collect", help="Store every candidate span at threshold 0.0")
+    collect_parser.add_argument("--dataset", default=os.path.join(data_dir, "synthetic_dataset.txt"),
+                                help="Labeled dataset (default: %(default)s)")
+    collect_parser.add_argument("--output", default=os.path.join(data_dir, "candidate_spans.jsonl"),
+                                help="Candidate span file (default: %(default)s)")
+    collect_parser.add_argument("--batch-size", type=int, default=32,
+                                help="Texts per nlp.pipe batch (default: 32)")
+    collect_parser.add_argument("--cache", default=None,
+                                help="Analysis cache database (can be shared with the evaluation runs)")
+
+    sweep_parser = subparsers.add_parser("sweep", help="Recompute metrics over a threshold grid")
+    sweep_parser.add_argument("candidates", help="Candidate span file from 'collect'")
+    sweep_parser.add_argument("--grid", default="0:1:0.005",
+                              help="start:stop:step or comma-separated thresholds (default: %(default)s)")
+    sweep_parser.add_argument("--per-category", action="store_true",
+                              help="Also sweep each HIPAA category alone, others held at --base-threshold")
+    sweep_parser.add_argument("--base-threshold", type=float, default=0.35,
+                              help="Threshold for categories not being swept (default: %(default)s)")
+    sweep_parser.add_argument("--thresholds", default=None,
+                              help="Fixed per-category overrides, e.g. NAME=0.6,DATE=0.8")
+    sweep_parser.add_argument("--output", default="threshold_sweep.csv",
+                              help="ROC/PR table (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.command == "collect":
+        from run_presidio_unified import iter_labeled_queries
+        count = collect_candidates(iter_labeled_queries(args.dataset), args.output, args.batch_size, args.cache)
+        print(f"\n✓ Stored candidate spans for {count} queries in {args.output}")
+        return
+
+    started = time.perf_counter()
+    sweeper = ThresholdSweep(args.candidates)
+    loaded = time.perf_counter()
+    grid = parse_grid(args.grid)
+    overrides = parse_overrides(args.thresholds)
+
+    rows = sweeper.sweep(grid)
+    if overrides:
+        fixed = {"category": "FIXED", "threshold": args.base_threshold}
+        fixed.update(sweeper.evaluate(sweeper.category_thresholds(args.base_threshold, overrides)))
+        rows.append(fixed)
+    if args.per_category:
+        # Only categories the analyzer can emit have a threshold to move
+        for code in np.unique(sweeper.span_code):
+            category = sweeper.categories[code]
+            rows.extend(sweeper.sweep(grid, category, args.base_threshold, overrides))
+    swept = time.perf_counter()
+
+    write_table(args.output, rows)
+
+    print(f"Loaded {len(sweeper.span_score)} candidate spans, {len(sweeper.entity_query)} PHI entities "
+          f"({sweeper.positive_queries} positive / {sweeper.negative_queries} negative queries) "
+          f"in {loaded - started:.2f}s")
+    print(f"Evaluated {len(rows)} threshold settings in {swept - loaded:.2f}s")
+
+    global_rows = [row for row in rows if row["category"] == "ALL"]
+    print(f"ROC AUC (recall vs false positive rate): {roc_auc(global_rows):.4f}")
+    production = sweeper.evaluate(sweeper.category_thresholds(args.base_threshold, overrides))
+    print(f"At {args.base_threshold}{' with overrides' if overrides else ''}: "
+          f"recall {production['recall']:.2%}, leaked {production['leaked_phi']}, "
+          f"FPR {production['false_positive_rate']:.2%}, specificity {production['specificity']:.2%}")
+    print(f"Table written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Append-Only Sharded Trace Store
+Stores per-query traces as compact JSON lines in size-rotated shard files,
+with a query_id index for point lookups and an exporter for the legacy
+one-file-per-query layout
+"""
+
+import argparse
+import json
+import mmap
+import os
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+SHARD_PATTERN = "shard_{:05d}.jsonl"
+INDEX_FILE = "index.tsv"
+DEFAULT_MAX_SHARD_BYTES = 64 * 1024 * 1024
+
+
+def _truncate_to_last_line(path: str) -> None:
+    """Cut a file back to just after its last newline, dropping a torn final line"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size == 0:
+            return
+        f.seek(size - 1)
+        if f.read(1) == b'\n':
+            return
+        # Walk back to the last complete line
+        position = size
+        while position > 0:
+            step = min(65536, position)
+            f.seek(position - step)
+            chunk = f.read(step)
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                f.truncate(position - step + newline + 1)
+                return
+            position -= step
+        f.truncate(0)
+
+
+class TraceStore:
+    """
+    Append-only trace store rooted at a directory
+
+    Layout:
+        shard_00000.jsonl, shard_00001.jsonl, ...  one compact trace per line
+        index.tsv                                  query_id, shard, offset, length
+
+    A query_id written twice resolves to its latest record.
+    """
+
+    def __init__(self, root_dir: str, max_shard_bytes: int = DEFAULT_MAX_SHARD_BYTES):
+        self.root_dir = root_dir
+        self.max_shard_bytes = max_shard_bytes
+        self.index: Dict[str, Tuple[int, int, int]] = {}
+
+        os.makedirs(root_dir, exist_ok=True)
+        self._shard_id = self._last_shard_id()
+        self._recover()
+        self._load_index()
+
+        self._shard = open(self._shard_path(self._shard_id), 'ab')
+        self._index = open(os.path.join(root_dir, INDEX_FILE), 'a', encoding='utf-8')
+
+    def __enter__(self) -> 'TraceStore':
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, query_id: str) -> bool:
+        return str(query_id) in self.index
+
+    def _shard_path(self, shard_id: int) -> str:
+        return os.path.join(self.root_dir, SHARD_PATTERN.format(shard_id))
+
+    def _last_shard_id(self) -> int:
+        shard_ids = [
+            int(name[len("shard_"):-len(".jsonl")])
+            for name in os.listdir(self.root_dir)
+            if name.startswith("shard_") and name.endswith(".jsonl")
+        ]
+        return max(shard_ids) if shard_ids else 0
+
+    def _recover(self) -> None:
+        """Truncate partially written trailing lines of the active shard and the index"""
+        _truncate_to_last_line(self._shard_path(self._shard_id))
+        _truncate_to_last_line(os.path.join(self.root_dir, INDEX_FILE))
+
+    def _load_index(self) -> None:
+        """
+        Load index.tsv, keeping only entries whose record is intact
+
+        Rotated shards are never written again, so their entries only need
+        to lie inside the file. An entry in the active shard must also span
+        exactly one line (a newline before it and as its last byte): after a
+        crash the index can name a record that never reached the shard, or
+        one truncated by _recover whose offset a later append has reused.
+        A rejected entry leaves the query at its previous intact record.
+        """
+        index_path = os.path.join(self.root_dir, INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+        shard_sizes: Dict[int, int] = {}
+        active_path = self._shard_path(self._shard_id)
+        active = None
+        if os.path.exists(active_path) and os.path.getsize(active_path):
+            with open(active_path, 'rb') as f:
+                active = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    parts = line.rstrip('\n').split('\t')
+                    if len(parts) != 4:
+                        continue
+                    query_id, shard_id, offset, length = parts[0], int(parts[1]), int(parts[2]), int(parts[3])
+                    if shard_id not in shard_sizes:
+                        path = self._shard_path(shard_id)
+                        shard_sizes[shard_id] = os.path.getsize(path) if os.path.exists(path) else 0
+                    end = offset + length
+                    if length < 1 or end > shard_sizes[shard_id]:
+                        continue
+                    if shard_id == self._shard_id and (
+                            active[end - 1] != 0x0A or (offset > 0 and active[offset - 1] != 0x0A)):
+                        continue
+                    self.index[query_id] = (shard_id, offset, length)
+        finally:
+            if active is not None:
+                active.close()
+
+    def append(self, trace: Dict[str, Any]) -> None:
+        """Append one trace; its query_id becomes the lookup key"""
+        record = (json.dumps(trace, ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+
+        offset = self._shard.tell()
+        if offset > 0 and offset + len(record) > self.max_shard_bytes:
+            self._shard.close()
+            self._shard_id += 1
+            self._shard = open(self._shard_path(self._shard_id), 'ab')
+            offset = 0
+
+        self._shard.write(record)
+        query_id = str(trace['query_id'])
+        self._index.write(f"{query_id}\t{self._shard_id}\t{offset}\t{len(record)}\n")
+        self.index[query_id] = (self._shard_id, offset, len(record))
+
+    def flush(self) -> None:
+        """Flush buffered shard and index writes to the OS"""
+        self._shard.flush()
+        self._index.flush()
+
+    def close(self) -> None:
+        """Flush and close the active shard and index"""
+        if not self._shard.closed:
+            self._shard.close()
+        if not self._index.closed:
+            self._index.close()
+
+    def get(self, query_id: str) -> Optional[Dict[str, Any]]:
+        """Point lookup of a trace by query_id"""
+        location = self.index.get(str(query_id))
+        if location is None:
+            return None
+        shard_id, offset, length = location
+        if shard_id == self._shard_id and not self._shard.closed:
+            self._shard.flush()
+        with open(self._shard_path(shard_id), 'rb') as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+
+    def scan(self) -> Iterator[Dict[str, Any]]:
+        """
+        Stream every current trace in write order
+
+        Records superseded by a later write of the same query_id are skipped.
+        """
+        if not self._shard.closed:
+            self._shard.flush()
+        live = {(shard_id, offset) for shard_id, offset, _ in self.index.values()}
+        for shard_id in range(self._shard_id + 1):
+            path = self._shard_path(shard_id)
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                offset = 0
+                for line in f:
+                    if (shard_id, offset) in live:
+                        yield json.loads(line)
+                    offset += len(line)
+
+    def export_legacy(self, output_dir: str) -> int:
+        """
+        Write every trace as output_dir/query_<id>_trace.json (indent=2)
+
+        Returns:
+            Number of trace files written
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        count = 0
+        for trace in self.scan():
+            trace_file = os.path.join(output_dir, f"query_{trace['query_id']}_trace.json")
+            with open(trace_file, 'w', encoding='utf-8') as f:
+                json.dump(trace, f, indent=2, ensure_ascii=False)
+            count += 1
+        return count
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Inspect or export a sharded trace store")
+    parser.add_argument("store_dir", help="Trace store directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write legacy query_<id>_trace.json files")
+    export_parser.add_argument("output_dir", help="Directory for the legacy trace files")
+
+    get_parser = subparsers.add_parser("get", help="Print one trace")
+    get_parser.add_argument("query_id")
+
+    subparsers.add_parser("count", help="Print the number of stored traces")
+
+    args = parser.parse_args()
+
+    with TraceStore(args.store_dir) as store:
+        if args.command == "export":
+            count = store.export_legacy(args.output_dir)
+            print(f"Exported {count} trace files to {args.output_dir}")
+        elif args.command == "get":
+            trace = store.get(args.query_id)
+            if trace is None:
+                parser.exit(1, f"No trace for query_id {args.query_id}\n")
+            print(json.dumps(trace, indent=2, ensure_ascii=False))
+        else:
+            print(len(store))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the Azure OpenAI chat completions endpoint
+Returns canned ===QUERY===/===PHI_TAGS=== batches (or heuristic PHI lists
+for detection_cascade.py's LLM tier) and can inject 429/500 responses, so
+the generators can be exercised without network access
+"""
+
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Tuple
+
+CHAT_PATH = re.compile(r"^/openai/deployments/([^/]+)/chat/completions$")
+
+# User prompt prefix of detection_cascade.py's LLM tier
+DETECT_PREFIX = "Identify the PHI in this query:\n"
+
+# Capitalised runs (names, places, months) and digit-bearing identifiers
+CAPITALIZED_RUN = re.compile(r"\b[A-Z][a-z]+\.?(?:\s+(?:[A-Z][a-z]*\.?|\d{1,2},?\s+\d{4}))*")
+IDENTIFIER = re.compile(r"\b[\w.@-]*\d[\w.@/-]*\d\b")
+LEADING_WORDS = {"What", "How", "Is", "Are", "Can", "Could", "Should", "Which", "When", "Does", "Do",
+                 "For", "In", "Latest", "Guidelines", "Recommended", "Best", "The", "A", "An"}
+
+
+def make_batch(request_number: int, batch_size: int) -> str:
+    """Build a well-formed batch of synthetic queries"""
+    blocks = []
+    for i in range(batch_size):
+        query_number = request_number * batch_size + i
+        if i % 4 == 3:
+            blocks.append(
+                "===QUERY===\n"
+                f"Guidelines for managing stage {query_number % 5 + 1} CKD in a 60-year-old "
+                f"with a Wells score of {query_number % 9}?\n"
+                "===PHI_TAGS===\n"
+            )
+        else:
+            name = f"Patient{query_number} Q."
+            blocks.append(
+                "===QUERY===\n"
+                f"Latest ADA guidelines for T2DM in {name}, seen at Mock Clinic "
+                f"on March {query_number % 28 + 1}, 2024 (MRN: {1000000 + query_number})?\n"
+                "===PHI_TAGS===\n"
+                f'{{"identifier_type": "NAME", "value": "{name}"}}\n'
+                '{"identifier_type": "GEOGRAPHIC_LOCATION", "value": "Mock Clinic"}\n'
+                f'{{"identifier_type": "DATE", "value": "March {query_number % 28 + 1}, 2024"}}\n'
+                f'{{"identifier_type": "MEDICAL_RECORD_NUMBER", "value": "{1000000 + query_number}"}}\n'
+            )
+    return "\n".join(blocks)
+
+
+def make_detections(text: str) -> str:
+    """Answer a detection prompt with a JSON list of PHI-looking spans"""
+    detections = []
+    for match in CAPITALIZED_RUN.finditer(text):
+        value = match.group().rstrip(".")
+        if value.split()[0] in LEADING_WORDS:
+            value = value.partition(" ")[2]
+        if value:
+            detections.append({"identifier_type": "NAME_OR_LOCATION", "value": value})
+    for match in IDENTIFIER.finditer(text):
+        if sum(ch.isdigit() for ch in match.group()) >= 5:
+            detections.append({"identifier_type": "UNIQUE_IDENTIFIER", "value": match.group()})
+    return json.dumps(detections)
+
+
+class MockAzureOpenAIHandler(BaseHTTPRequestHandler):
+    """Handles POST /openai/deployments/<name>/chat/completions"""
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status: int, payload: Dict[str, Any], headers: Dict[str, str] = None) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self) -> None:
+        path = self.path.split('?', 1)[0]
+        match = CHAT_PATH.match(path)
+        if not match:
+            self._send_json(404, {"error": {"code": "404", "message": "Resource not found"}})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+
+        server = self.server
+        with server.lock:
+            server.request_count += 1
+            request_number = server.request_count
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if server.rate_limit_every and request_number % server.rate_limit_every == 0:
+            self._send_json(
+                429,
+                {"error": {"code": "429", "message": "Rate limit is exceeded. Try again shortly."}},
+                headers={'Retry-After': str(server.retry_after)}
+            )
+            return
+        if server.error_every and request_number % server.error_every == 0:
+            self._send_json(500, {"error": {"code": "InternalServerError", "message": "Mock server error"}})
+            return
+
+        user_content = ''
+        for message in request.get('messages', []):
+            if message.get('role') == 'user':
+                user_content = message.get('content', '')
+        if user_content.startswith(DETECT_PREFIX):
+            content = make_detections(user_content[len(DETECT_PREFIX):])
+        else:
+            count_match = re.search(r"Generate (\d+)", user_content)
+            batch_size = int(count_match.group(1)) if count_match else 5
+            content = make_batch(request_number - 1, batch_size)
+        self._send_json(200, {
+            "id": f"chatcmpl-mock-{request_number}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": match.group(1),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": sum(len(m.get('content', '')) for m in request.get('messages', [])) // 4,
+                "completion_tokens": len(content) // 4,
+                "total_tokens": 0
+            }
+        })
+
+
+def start_mock_server(
+    host: str = '127.0.0.1',
+    port: int = 0,
+    latency: float = 0.0,
+    rate_limit_every: int = 0,
+    error_every: int = 0,
+    retry_after: float = 0.1,
+    verbose: bool = False
+) -> Tuple[ThreadingHTTPServer, str]:
+    """
+    Start the mock endpoint in a background thread
+
+    Args:
+        host: Interface to bind
+        port: Port to bind (0 picks a free port)
+        latency: Seconds to sleep before answering each request
+        rate_limit_every: Answer every Nth request with 429 (0 disables)
+        error_every: Answer every Nth request with 500 (0 disables)
+        retry_after: Retry-After header value sent with 429 responses
+        verbose: Log each request to stderr
+
+    Returns:
+        Tuple of (server, endpoint URL); call server.shutdown() to stop
+    """
+    server = ThreadingHTTPServer((host, port), MockAzureOpenAIHandler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.request_count = 0
+    server.latency = latency
+    server.rate_limit_every = rate_limit_every
+    server.error_every = error_every
+    server.retry_after = retry_after
+    server.verbose = verbose
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    endpoint = f"http://{server.server_address[0]}:{server.server_address[1]}"
+    return server, endpoint
+
+
+def main():
+    """Main execution"""
+    parser = argparse.ArgumentParser(description="Mock Azure OpenAI chat completions server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.2,
+                        help="Seconds of simulated latency per request")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="Return 429 for every Nth request")
+    parser.add_argument("--error-every", type=int, default=0,
+                        help="Return 500 for every Nth request")
+    args = parser.parse_args()
+
+    server, endpoint = start_mock_server(
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        rate_limit_every=args.rate_limit_every,
+        error_every=args.error_every,
+        verbose=True
+    )
+    print(f"Mock Azure OpenAI endpoint listening on {endpoint}")
+    print(f"  export AZURE_OPENAI_ENDPOINT_4o='{endpoint}'")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
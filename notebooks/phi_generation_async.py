@@ -0,0 +1,339 @@
+"""
+Concurrent, rate-limited synthetic query generation
+Async counterpart of generate_phi_queries in Methods.ipynb: several chat
+completion requests in flight, token-bucket rate limiting, exponential
+backoff on 429/5xx, and ordered append-only writes to the dataset file
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import openai
+from tqdm import tqdm
+
+
+# Markers that delimit one generated query block
+QUERY_MARKER = '===QUERY==='
+TAGS_MARKER = '===PHI_TAGS==='
+BLOCK_SEPARATOR = '\n\n'
+
+
+class TokenBucket:
+    """
+    Async token bucket: holds up to `capacity` units, refilled continuously
+    at `capacity` units per minute
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0) -> None:
+        """Wait until `amount` units are available and consume them"""
+        # A single request larger than the bucket would never fit; cap it so
+        # it waits for a full bucket instead of blocking forever
+        amount = min(amount, self.capacity)
+        async with self.lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+def estimate_request_tokens(system_prompt: str, user_prompt: str, max_tokens: int) -> int:
+    """
+    Estimate the tokens a request counts against the tokens/min quota
+
+    Azure OpenAI charges prompt tokens plus max_tokens against the TPM limit
+    when the request is admitted; ~4 characters per token is close enough
+    for pacing.
+    """
+    return (len(system_prompt) + len(user_prompt)) // 4 + max_tokens
+
+
+def _is_complete_block(tail: bytes) -> bool:
+    """
+    Whether `tail` is one whole ===QUERY=== / ===PHI_TAGS=== block: both
+    markers present, ending at a line break, and every tag line valid JSON
+    """
+    try:
+        text = tail.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    if not text.lstrip().startswith(QUERY_MARKER) or not text.endswith('\n'):
+        return False
+    query, marker, tags = text.partition(TAGS_MARKER)
+    if not marker or not query[len(QUERY_MARKER):].strip():
+        return False
+    for line in tags.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            if not isinstance(json.loads(line), dict):
+                return False
+        except json.JSONDecodeError:
+            return False
+    return True
+
+
+def repair_dataset_tail(out_path: str) -> int:
+    """
+    Truncate a partially written trailing block left by an interrupted run
+
+    Every block this generator writes is one append ending in a blank line,
+    so only the text after the last blank line can be a torn write. It is
+    removed unless it parses as a complete block (a hand-edited or older
+    dataset may end its last block with a single newline); a complete block
+    just gets its missing blank line back, so the next append stays separate.
+
+    Returns:
+        Number of bytes removed
+    """
+    if not os.path.exists(out_path):
+        return 0
+
+    size = os.path.getsize(out_path)
+    if size == 0:
+        return 0
+
+    separator = BLOCK_SEPARATOR.encode('utf-8')
+    with open(out_path, 'rb+') as f:
+        # Scan backwards in chunks for the last block separator; each read
+        # overlaps the chunk after it so a separator across the seam is found
+        chunk_size = 64 * 1024
+        end = size
+        keep = 0
+        while end > 0:
+            start = max(0, end - chunk_size)
+            f.seek(start)
+            chunk = f.read(min(size, end + len(separator) - 1) - start)
+            index = chunk.rfind(separator)
+            if index != -1:
+                keep = start + index + len(separator)
+                break
+            end = start
+
+        if keep == size:
+            return 0
+        f.seek(keep)
+        tail = f.read()
+        if _is_complete_block(tail):
+            f.seek(size)
+            f.write(b'\n')
+            return 0
+        f.truncate(keep)
+    return size - keep
+
+
+def _retry_delay(attempt: int, error: Exception, base_delay: float, max_delay: float) -> float:
+    """Exponential backoff with full jitter, honoring Retry-After when sent"""
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after:
+            try:
+                return min(float(retry_after), max_delay)
+            except ValueError:
+                pass
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def _is_retryable(error: Exception) -> bool:
+    """429, 5xx, timeouts and dropped connections are worth retrying"""
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
+
+async def generate_phi_queries_async(
+    client: openai.AsyncAzureOpenAI,
+    deployment: str,
+    system_prompt: str,
+    n: int = 50,
+    out_path: str = './synthetic_dataset.txt',
+    batch_size: int = 5,
+    temperature: float = 0.9,
+    max_tokens: int = 2500,
+    concurrency: int = 8,
+    requests_per_minute: float = 60,
+    tokens_per_minute: float = 80000,
+    max_retries: int = 6,
+    base_delay: float = 1.0,
+    max_delay: float = 60.0,
+    error_log_path: str = 'generation_errors.log',
+    dedup_index: Optional[Any] = None
+) -> Dict[str, Any]:
+    """
+    Generate `n` synthetic queries with up to `concurrency` requests in flight.
+
+    Batches are appended to `out_path` strictly in batch order, each as a
+    single write followed by fsync, so the file only ever grows by whole
+    blocks. A trailing partial block from an earlier crash is truncated
+    before generation starts.
+
+    Args:
+        client: AsyncAzureOpenAI client (create it with max_retries=0 so
+                retries are paced by this function), or an
+                AsyncCachedAzureOpenAI from data/llm_response_cache.py; in
+                its replay mode requests skip rate limiting
+        deployment: Azure OpenAI deployment name
+        system_prompt: Generation system prompt (phi_query_system_prompt)
+        n: Total number of queries to generate
+        out_path: Dataset file to append to
+        batch_size: Queries requested per API call
+        temperature: Sampling temperature
+        max_tokens: Completion token limit per call
+        concurrency: Maximum number of requests in flight
+        requests_per_minute: Request quota for the token bucket
+        tokens_per_minute: Token quota for the token bucket
+        max_retries: Retries per batch on 429/5xx/connection errors
+        base_delay: Initial backoff delay in seconds
+        max_delay: Maximum backoff delay in seconds
+        error_log_path: File that receives failed-batch log lines
+        dedup_index: Optional near-duplicate filter with a
+                     filter_blocks(text, source) -> (kept_text, dropped)
+                     method, e.g. data/near_duplicates.NearDuplicateIndex.
+                     Queries whose PHI-masked skeleton repeats an indexed
+                     one are dropped before the batch is written.
+
+    Returns:
+        Generation statistics
+    """
+    os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+    repaired_bytes = repair_dataset_tail(out_path)
+    if repaired_bytes:
+        print(f"Removed {repaired_bytes} bytes of incomplete trailing output from {out_path}")
+
+    num_batches = (n + batch_size - 1) // batch_size
+    user_prompt = (
+        f"Generate {batch_size} new, unique, and realistic clinical queries "
+        f"with structured PHI_TAGS as specified in the system prompt."
+    )
+    request_tokens = estimate_request_tokens(system_prompt, user_prompt, max_tokens)
+
+    request_bucket = TokenBucket(requests_per_minute)
+    token_bucket = TokenBucket(tokens_per_minute)
+    # Replayed answers come from the local cache, not the deployment's quota
+    offline_replay = getattr(client, 'mode', None) == 'replay'
+
+    batch_queue: asyncio.Queue = asyncio.Queue()
+    for batch_num in range(num_batches):
+        batch_queue.put_nowait(batch_num)
+
+    # Completed batches wait here until every earlier batch has been written
+    completed: Dict[int, Optional[str]] = {}
+    stats = {'successful_batches': 0, 'failed_batches': 0, 'retries': 0, 'near_duplicates': 0}
+    next_to_write = 0
+    progress = tqdm(total=num_batches, desc="Generating Query Batches")
+
+    fd = os.open(out_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def log_failure(batch_num: int, error: Any) -> None:
+        with open(error_log_path, 'a', encoding='utf-8') as f:
+            f.write(f"[{datetime.now()}] Batch {batch_num+1} failed: {error}\n")
+        stats['failed_batches'] += 1
+
+    def flush_in_order() -> None:
+        nonlocal next_to_write
+        while next_to_write in completed:
+            generated_text = completed.pop(next_to_write)
+            if generated_text is not None and dedup_index is not None:
+                # Filtered in write order, so the earliest copy of a skeleton is kept
+                source = f"{os.path.basename(out_path)}@batch{next_to_write + 1}"
+                generated_text, dropped = dedup_index.filter_blocks(generated_text, source)
+                stats['near_duplicates'] += dropped
+            if generated_text is not None:
+                if generated_text.strip():
+                    data = (generated_text.strip() + BLOCK_SEPARATOR).encode('utf-8')
+                    os.write(fd, data)
+                    os.fsync(fd)
+                    if dedup_index is not None:
+                        dedup_index.flush()
+                stats['successful_batches'] += 1
+            next_to_write += 1
+            progress.update(1)
+
+    async def request_batch(batch_num: int) -> Optional[str]:
+        for attempt in range(max_retries + 1):
+            if not offline_replay:
+                await request_bucket.acquire(1)
+                await token_bucket.acquire(request_tokens)
+            try:
+                resp = await client.chat.completions.create(
+                    model=deployment,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+            except Exception as e:
+                if attempt < max_retries and _is_retryable(e):
+                    stats['retries'] += 1
+                    await asyncio.sleep(_retry_delay(attempt, e, base_delay, max_delay))
+                    continue
+                log_failure(batch_num, e)
+                return None
+
+            generated_text = resp.choices[0].message.content
+            if generated_text and QUERY_MARKER in generated_text:
+                return generated_text
+            log_failure(batch_num, "malformed output")
+            return None
+        return None
+
+    async def worker() -> None:
+        while True:
+            try:
+                batch_num = batch_queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            completed[batch_num] = await request_batch(batch_num)
+            flush_in_order()
+
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    finally:
+        os.close(fd)
+        progress.close()
+    elapsed = time.perf_counter() - start
+
+    stats.update({
+        'requested_batches': num_batches,
+        'elapsed_seconds': elapsed,
+        'batches_per_second': num_batches / elapsed if elapsed > 0 else 0.0,
+    })
+
+    print(f"\n{'='*60}")
+    print(f"Generation complete!")
+    print(f"Queries appended to: {out_path}")
+    print(f"Successful batches: {stats['successful_batches']}/{num_batches}")
+    print(f"Retries: {stats['retries']}")
+    if dedup_index is not None:
+        print(f"Near-duplicate queries dropped: {stats['near_duplicates']}")
+    if stats['failed_batches'] > 0:
+        print(f"Failed batches: {stats['failed_batches']} (see {error_log_path})")
+    print(f"Elapsed: {elapsed:.1f}s")
+    print(f"{'='*60}")
+
+    return stats